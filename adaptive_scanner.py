@@ -0,0 +1,251 @@
+"""Escáner de registros con tamaño de bloque adaptativo.
+
+Empieza leyendo bloques grandes (hasta 125 registros) y, cuando el equipo
+responde con una excepción de dirección ilegal o no responde, divide el
+bloque a la mitad hasta encontrar los subrangos válidos. Para cada equipo
+recuerda el mejor tamaño de bloque y los huecos encontrados, de modo que
+los escaneos siguientes saltan directamente las zonas sin registros.
+"""
+import json
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+MAX_BLOCK = 125
+ADDRESS_SPACE = 65536
+
+# Códigos de excepción Modbus
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+
+
+def classify_response(response):
+    """Clasifica una respuesta como 'ok', 'illegal', 'timeout' o 'error'"""
+    if not hasattr(response, 'isError') or not response.isError():
+        return "ok"
+    from pymodbus.exceptions import ModbusIOException
+    if isinstance(response, ModbusIOException):
+        return "timeout"
+    # Algunos equipos responden "valor ilegal" cuando la cantidad cruza un hueco
+    if getattr(response, 'exception_code', None) in (ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE):
+        return "illegal"
+    return "error"
+
+
+def merge_ranges(ranges):
+    """Une rangos [inicio, fin) solapados o contiguos"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class DeviceProfile:
+    """Conocimiento acumulado sobre el mapa de registros de un equipo"""
+
+    def __init__(self, best_block=MAX_BLOCK, holes=None, block_limit=None):
+        self.best_block = best_block
+        self.block_limit = block_limit  # Máximo aceptado por el equipo, si se detectó
+        self.holes = merge_ranges(holes or [])
+
+    def add_hole(self, start, end):
+        self.holes = merge_ranges(self.holes + [[start, end]])
+
+    def remove_hole(self, start, end):
+        """Quita [start, end) de los huecos (el equipo respondió en esa zona)"""
+        remaining = []
+        for hole_start, hole_end in self.holes:
+            if hole_end <= start or hole_start >= end:
+                remaining.append([hole_start, hole_end])
+                continue
+            if hole_start < start:
+                remaining.append([hole_start, start])
+            if hole_end > end:
+                remaining.append([end, hole_end])
+        self.holes = remaining
+
+    def valid_ranges(self, start, end):
+        """Devuelve los subrangos de [start, end) que no son huecos conocidos"""
+        ranges = []
+        pos = start
+        for hole_start, hole_end in self.holes:
+            if hole_end <= pos:
+                continue
+            if hole_start >= end:
+                break
+            if hole_start > pos:
+                ranges.append((pos, hole_start))
+            pos = max(pos, hole_end)
+        if pos < end:
+            ranges.append((pos, end))
+        return ranges
+
+    def to_dict(self):
+        return {"best_block": self.best_block, "block_limit": self.block_limit, "holes": self.holes}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("best_block", MAX_BLOCK), data.get("holes"), data.get("block_limit"))
+
+
+class ProfileStore:
+    """Guarda los perfiles de escaneo por (puerto, esclavo, tabla) en un JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.profiles = {}
+        try:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    self.profiles = {key: DeviceProfile.from_dict(data) for key, data in json.load(f).items()}
+        except Exception as e:
+            log.warning("Error al cargar perfiles de escaneo: %s", e)
+
+    @staticmethod
+    def make_key(port, slave, table):
+        return f"{port}|{slave}|{table}"
+
+    def get(self, port, slave, table):
+        key = self.make_key(port, slave, table)
+        if key not in self.profiles:
+            self.profiles[key] = DeviceProfile()
+        return self.profiles[key]
+
+    def save(self):
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({key: p.to_dict() for key, p in self.profiles.items()}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            log.warning("Error al guardar perfiles de escaneo: %s", e)
+
+
+class ScanAborted(Exception):
+    """El equipo dejó de responder durante el escaneo"""
+
+
+class AdaptiveScanner:
+    """Escanea rangos de registros partiendo bloques que fallan.
+
+    ``reader(table, address, count, slave)`` debe devolver la respuesta
+    Modbus de una lectura (por ejemplo a través del árbitro del bus).
+    """
+
+    def __init__(self, reader, profile=None, max_block=MAX_BLOCK, min_block=1,
+                 max_consecutive_timeouts=5, skip_known_holes=True):
+        self.reader = reader
+        self.profile = profile or DeviceProfile()
+        self.max_block = max_block
+        self.min_block = max(1, min_block)
+        self.max_consecutive_timeouts = max_consecutive_timeouts
+        self.skip_known_holes = skip_known_holes
+
+        self.requests = 0
+        self.failed_requests = 0
+        self.registers_found = 0
+        self.timeouts = []  # Rangos que no respondieron (no se guardan como huecos)
+        self._consecutive_timeouts = 0
+
+        # Progreso: siguiente dirección a examinar; cancel() detiene el escaneo
+        self.position = None
+        self.cancelled = False
+
+    def cancel(self):
+        """Detiene el escaneo antes de la siguiente petición"""
+        self.cancelled = True
+
+    def _read(self, table, address, count, slave):
+        """Lee un bloque. Devuelve (clasificación, registros)"""
+        from pymodbus.exceptions import ModbusIOException, ConnectionException
+        self.requests += 1
+        try:
+            response = self.reader(table, address, count, slave)
+        except ModbusIOException:
+            status = "timeout"
+        except ConnectionException:
+            raise
+        else:
+            status = classify_response(response)
+
+        if status == "ok":
+            self._consecutive_timeouts = 0
+            return status, response.registers
+
+        self.failed_requests += 1
+        if status == "timeout":
+            self._consecutive_timeouts += 1
+            if self._consecutive_timeouts >= self.max_consecutive_timeouts:
+                raise ScanAborted(f"Sin respuesta en {self._consecutive_timeouts} peticiones seguidas")
+        return status, None
+
+    def _split(self, table, address, count, slave, status):
+        """Divide a la mitad un bloque fallido hasta aislar los registros válidos"""
+        if self.cancelled:
+            return False
+        if count <= self.min_block:
+            if status == "timeout":
+                self.timeouts.append((address, address + count))
+            else:
+                self.profile.add_hole(address, address + count)
+            return False
+
+        half = count // 2
+        all_ok = True
+        for sub_address, sub_count in ((address, half), (address + half, count - half)):
+            sub_status, registers = self._read(table, sub_address, sub_count, slave)
+            if sub_status == "ok":
+                self.registers_found += len(registers)
+                self.profile.remove_hole(sub_address, sub_address + sub_count)
+                yield sub_address, registers
+            else:
+                all_ok = False
+                yield from self._split(table, sub_address, sub_count, slave, sub_status)
+
+        # Si ambas mitades respondieron, el fallo era por tamaño y no por huecos
+        if all_ok and status == "illegal":
+            self.profile.block_limit = half if self.profile.block_limit is None else min(self.profile.block_limit, half)
+            self.profile.best_block = min(self.profile.best_block, half)
+        return all_ok
+
+    def scan(self, table, start, count, slave):
+        """Escanea [start, start + count) y va devolviendo (dirección, registros) por bloque"""
+        end = min(start + count, ADDRESS_SPACE)
+        if self.skip_known_holes:
+            ranges = self.profile.valid_ranges(start, end)
+        else:
+            ranges = [(start, end)]
+
+        self.position = start
+        for range_start, range_end in ranges:
+            pos = range_start
+            while pos < range_end:
+                if self.cancelled:
+                    return
+                block = min(self.profile.best_block or self.max_block, self.max_block)
+                size = min(block, range_end - pos)
+                status, registers = self._read(table, pos, size, slave)
+                if status == "ok":
+                    self.registers_found += len(registers)
+                    self.profile.remove_hole(pos, pos + size)
+                    yield pos, registers
+                else:
+                    yield from self._split(table, pos, size, slave, status)
+                pos += size
+                self.position = pos
+        self.position = end
+
+    def stats(self):
+        """Devuelve contadores del último escaneo"""
+        return {
+            "requests": self.requests,
+            "failed_requests": self.failed_requests,
+            "registers_found": self.registers_found,
+            "best_block": self.profile.best_block,
+            "holes": len(self.profile.holes),
+            "timeouts": len(self.timeouts),
+        }
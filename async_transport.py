@@ -0,0 +1,440 @@
+"""Transporte asyncio: un único bucle de eventos atiende todos los buses.
+
+Alternativa al árbitro con un hilo por puerto (``bus_arbiter``). Un hilo
+de fondo ejecuta un bucle de eventos en el que cada bus (puerto serie,
+pasarela TCP o equipo simulado ``loop://``) tiene una tarea que toma los
+trabajos de su cola de prioridad y los ejecuta de uno en uno con los
+clientes asíncronos de ``transport`` (en Modbus TCP, varios a la vez por la
+misma conexión). Muchos equipos y pasarelas se atienden a la vez sin un
+hilo por bucle y sin bloquear la GUI.
+
+``AsyncBusHandle`` ofrece la misma interfaz que ``BusHandle`` (``connect``,
+``read``, ``write`` y ``timed_read`` devuelven un ``concurrent.futures.Future``)
+y además las variantes ``aread``/``awrite``/``atimed_read`` para usarlas
+con ``await`` desde corrutinas del propio bucle. ``open_bus`` elige el
+transporte por nombre.
+"""
+import threading
+import itertools
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future
+from bus_arbiter import (get_bus, shutdown_all, PRIORITY_WRITE, PRIORITY_INTERACTIVE,
+                         PRIORITY_POLL, PRIORITY_NAMES, UTILIZATION_WINDOW, LATENCY_SAMPLES, percentile)
+from connection_pool import get_default_pool, is_connection_error
+from transport import create_async_client
+from metrics import InstrumentedAsyncClient
+from fault_policy import get_fault_policy, READ_FUNCTIONS, WRITE_FUNCTIONS
+from timing import LinePacer
+
+log = logging.getLogger(__name__)
+
+BACKEND_THREADS = "threads"
+BACKEND_ASYNCIO = "asyncio"
+BACKENDS = (BACKEND_THREADS, BACKEND_ASYNCIO)
+
+
+async def async_execute_read(client, table, address, count, slave):
+    """Lee de la tabla Modbus indicada con un cliente asíncrono"""
+    if table == "holding":
+        return await client.read_holding_registers(address, count, slave=slave)
+    elif table == "input":
+        return await client.read_input_registers(address, count, slave=slave)
+    elif table == "coil":
+        return await client.read_coils(address, count, slave=slave)
+    elif table == "discrete_input":
+        return await client.read_discrete_inputs(address, count, slave=slave)
+    raise ValueError(f"Tipo de registro no válido: {table}")
+
+
+async def async_execute_write(client, table, address, value, slave):
+    """Escribe un valor en la tabla Modbus indicada con un cliente asíncrono"""
+    if table == "holding":
+        return await client.write_register(address, value, slave=slave)
+    elif table == "coil":
+        return await client.write_coil(address, value, slave=slave)
+    raise ValueError(f"No se puede escribir en registro tipo: {table}")
+
+
+def _wrap_future(future):
+    """Convierte un Future de concurrent.futures en uno esperable desde el bucle"""
+    import asyncio
+    return asyncio.wrap_future(future)
+
+
+class EventLoopThread:
+    """Bucle de eventos asyncio ejecutándose en un hilo de fondo"""
+
+    def __init__(self):
+        # asyncio (y con él ssl, socket...) solo se carga si se usa este transporte
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="modbus-asyncio")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        import asyncio
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro):
+        """Programa una corrutina en el bucle y devuelve un Future"""
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=2)
+
+
+_loop_thread = None
+_loop_thread_lock = threading.Lock()
+
+
+def get_loop_thread():
+    """Devuelve el bucle de eventos compartido del proceso (lo crea si no existe)"""
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None:
+            _loop_thread = EventLoopThread()
+        return _loop_thread
+
+
+def run_coroutine(coro):
+    """Ejecuta una corrutina en el bucle compartido y devuelve un Future"""
+    return get_loop_thread().run(coro)
+
+
+class _AsyncJob:
+    """Trabajo pendiente en la cola de un bus asíncrono"""
+
+    __slots__ = ("fn", "settings", "priority", "future", "submitted")
+
+    def __init__(self, fn, settings, priority):
+        self.fn = fn
+        self.settings = settings
+        self.priority = priority
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class AsyncBus:
+    """Cola de prioridad y cliente asíncrono de un puerto, servidos por una tarea del bucle"""
+
+    def __init__(self, port, loop_thread):
+        self.port = port
+        self.loop_thread = loop_thread
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {p: 0 for p in PRIORITY_NAMES}
+        self._running = True
+        self._queue = None
+        self._task = None
+        self.client = None
+        self._client_key = None
+        self.pacer = LinePacer()
+        self._in_flight = set()  # Trabajos en curso en modo pipelining
+        self.max_in_flight = 0
+
+        # Estadísticas (mismas claves que BusArbiter.stats)
+        self.started = time.monotonic()
+        self.busy_time = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self._recent = deque()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def submit(self, fn, settings, priority=PRIORITY_POLL):
+        """Encola ``await fn(client)`` y devuelve un Future (se puede llamar desde cualquier hilo).
+
+        Con ``fn=None`` el trabajo solo abre la conexión y devuelve True/False.
+        """
+        job = _AsyncJob(fn, settings, priority)
+        with self._lock:
+            if not self._running:
+                job.future.set_exception(RuntimeError(f"El bus {self.port} está detenido"))
+                return job.future
+            self._pending[priority] = self._pending.get(priority, 0) + 1
+        self.loop_thread.loop.call_soon_threadsafe(self._enqueue, job)
+        return job.future
+
+    def _enqueue(self, job):
+        import asyncio
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._task = asyncio.ensure_future(self._run())
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    async def _ensure_client(self, settings):
+        """Devuelve el cliente conectado para la configuración, o None si no se pudo abrir"""
+        key = tuple(sorted(settings.items()))
+        client = self.client
+        if client is not None and self._client_key == key and client.connected:
+            return client
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+            self.client = None
+        try:
+            client = create_async_client(**settings)
+            connected = await client.connect()
+        except Exception as e:
+            log.debug("Error al abrir %s: %s", self.port, e)
+            return None
+        if not connected:
+            return None
+        # Cada llamada Modbus del cliente queda anotada en las métricas
+        client = InstrumentedAsyncClient(client, self.port)
+        self.client = client
+        self._client_key = key
+        return client
+
+    async def _run(self):
+        """Tarea del bus: atiende los trabajos por orden de prioridad.
+
+        Con un cliente que admite pipelining (Modbus TCP) se lanzan hasta
+        ``pipeline_depth`` trabajos a la vez; con el resto, de uno en uno.
+        """
+        import asyncio
+        while True:
+            priority, _, job = await self._queue.get()
+            if job is None:
+                break
+
+            with self._lock:
+                self._pending[priority] -= 1
+
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            if self._in_flight and tuple(sorted(job.settings.items())) != self._client_key:
+                # Otra configuración reabre el cliente: antes terminan las peticiones en vuelo
+                await asyncio.wait(self._in_flight)
+
+            delay = self.pacer.delay(job.settings)
+            if delay:
+                await asyncio.sleep(delay)
+            start = time.monotonic()
+            self.total_wait += start - job.submitted
+            try:
+                client = await self._ensure_client(job.settings)
+            except Exception as e:
+                client = None
+                log.debug("Error al abrir %s: %s", self.port, e)
+
+            depth = getattr(client, "pipeline_depth", 1) if job.fn is not None else 1
+            if depth <= 1:
+                await self._execute(job, client, start)
+                continue
+
+            while len(self._in_flight) >= depth:
+                await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+            task = asyncio.ensure_future(self._execute(job, client, start))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            self.max_in_flight = max(self.max_in_flight, len(self._in_flight))
+
+    async def _execute(self, job, client, start):
+        """Ejecuta un trabajo con el cliente ya abierto (None si no se pudo abrir)"""
+        try:
+            if job.fn is None:
+                result = client is not None
+            elif client is None:
+                from pymodbus.exceptions import ConnectionException
+                raise ConnectionException(f"No se pudo conectar al puerto {self.port}")
+            else:
+                result = await job.fn(client)
+        except Exception as e:
+            if is_connection_error(e) and self.client is not None and self.client is client:
+                # Reconectar en el próximo trabajo
+                self.client.close()
+                self.client = None
+            self.failed += 1
+            job.future.set_exception(e)
+        else:
+            self.completed += 1
+            job.future.set_result(result)
+        finally:
+            self.pacer.mark()
+            end = time.monotonic()
+            duration = end - start
+            with self._lock:
+                self.busy_time += duration
+                self._recent.append((end, duration))
+                self._latencies.append(duration)
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(self._pending.values())
+
+    def stats(self):
+        """Devuelve profundidad de cola, utilización del bus y contadores"""
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0][0] < now - UTILIZATION_WINDOW:
+                self._recent.popleft()
+            recent_busy = sum(duration for _, duration in self._recent)
+            window = min(UTILIZATION_WINDOW, now - self.started) or 1e-9
+            elapsed = (now - self.started) or 1e-9
+            done = self.completed + self.failed
+            latencies = list(self._latencies)
+            return {
+                "port": self.port,
+                "backend": BACKEND_ASYNCIO,
+                "queue_depth": sum(self._pending.values()),
+                "queue_by_priority": {PRIORITY_NAMES[p]: n for p, n in self._pending.items()},
+                "completed": self.completed,
+                "failed": self.failed,
+                # Con pipelining las transacciones se solapan: la ocupación se limita a 1
+                "utilization": min(self.busy_time / elapsed, 1.0),
+                "recent_utilization": min(recent_busy / window, 1.0),
+                "avg_wait_ms": (self.total_wait / done * 1000) if done else 0.0,
+                "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+                "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+                "paced_ms": self.pacer.paced_time * 1000,
+                "max_in_flight": self.max_in_flight,
+            }
+
+    async def _shutdown(self):
+        # Cancelar lo que no se ha ejecutado y cerrar el cliente
+        if self._queue is not None:
+            while not self._queue.empty():
+                priority, _, job = self._queue.get_nowait()
+                with self._lock:
+                    self._pending[priority] -= 1
+                job.future.cancel()
+            self._queue.put_nowait((-1, -1, None))
+            await self._task
+        if self._in_flight:
+            import asyncio
+            await asyncio.wait(self._in_flight)
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def shutdown(self):
+        """Detiene la tarea del bus y cierra su conexión"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        try:
+            self.loop_thread.run(self._shutdown()).result(timeout=2)
+        except Exception as e:
+            log.debug("Error al detener el bus %s: %s", self.port, e)
+
+
+class AsyncBusHandle:
+    """Acceso a un bus asíncrono con una configuración de comunicación concreta"""
+
+    backend = BACKEND_ASYNCIO
+
+    def __init__(self, bus, settings):
+        self.bus = bus
+        self.settings = settings
+
+    def submit(self, fn, priority=PRIORITY_POLL):
+        """Ejecuta ``await fn(client)`` en el bucle del bus"""
+        return self.bus.submit(fn, self.settings, priority)
+
+    def connect(self, priority=PRIORITY_INTERACTIVE):
+        """Abre la conexión. El Future devuelve True/False"""
+        return self.bus.submit(None, self.settings, priority)
+
+    def read(self, table, address, count, slave, priority=PRIORITY_INTERACTIVE):
+        """Encola una lectura (con reintentos y circuito del esclavo) y devuelve un Future con la respuesta"""
+        return get_fault_policy().submit(
+            self.submit, self.settings, slave, READ_FUNCTIONS.get(table),
+            lambda client: async_execute_read(client, table, address, count, slave), priority,
+            asynchronous=True)
+
+    def write(self, table, address, value, slave, priority=PRIORITY_WRITE):
+        """Encola una escritura (con reintentos y circuito del esclavo) y devuelve un Future con la respuesta"""
+        return get_fault_policy().submit(
+            self.submit, self.settings, slave, WRITE_FUNCTIONS.get(table),
+            lambda client: async_execute_write(client, table, address, value, slave), priority,
+            asynchronous=True)
+
+    def timed_read(self, table, address, count, slave, priority=PRIORITY_INTERACTIVE):
+        """Como ``read`` pero el Future devuelve (respuesta, tiempo de respuesta en ms), sin reintentos"""
+        return get_fault_policy().submit(
+            self.submit, self.settings, slave, READ_FUNCTIONS.get(table),
+            lambda client: async_execute_read(client, table, address, count, slave), priority,
+            asynchronous=True, measurement=True)
+
+    # Variantes para corrutinas que se ejecutan en el propio bucle
+
+    def aread(self, table, address, count, slave, priority=PRIORITY_INTERACTIVE):
+        return _wrap_future(self.read(table, address, count, slave, priority))
+
+    def awrite(self, table, address, value, slave, priority=PRIORITY_WRITE):
+        return _wrap_future(self.write(table, address, value, slave, priority))
+
+    def atimed_read(self, table, address, count, slave, priority=PRIORITY_INTERACTIVE):
+        return _wrap_future(self.timed_read(table, address, count, slave, priority))
+
+    def stats(self):
+        return self.bus.stats()
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def get_async_bus(port, baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1.0):
+    """Devuelve un acceso asíncrono al bus del puerto indicado (una cola por puerto)"""
+    with _buses_lock:
+        bus = _buses.get(port)
+        if bus is None:
+            bus = AsyncBus(port, get_loop_thread())
+            _buses[port] = bus
+    settings = {
+        "port": port,
+        "baudrate": baudrate,
+        "parity": parity,
+        "stopbits": stopbits,
+        "bytesize": bytesize,
+        "timeout": timeout,
+    }
+    return AsyncBusHandle(bus, settings)
+
+
+def shutdown_all_async():
+    """Detiene todos los buses asíncronos del proceso"""
+    with _buses_lock:
+        buses = list(_buses.values())
+        _buses.clear()
+    for bus in buses:
+        bus.shutdown()
+
+
+def all_async_stats():
+    """Devuelve las estadísticas de todos los buses asíncronos activos"""
+    with _buses_lock:
+        buses = list(_buses.values())
+    return [bus.stats() for bus in buses]
+
+
+def open_bus(backend, port, baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1.0, pool=None):
+    """Devuelve el acceso al bus con el transporte indicado ('threads' o 'asyncio').
+
+    Los dos accesos tienen la misma interfaz (``connect``, ``read``,
+    ``write``, ``timed_read``), así que el código que los usa no cambia.
+    """
+    if backend == BACKEND_ASYNCIO:
+        return get_async_bus(port, baudrate, parity, stopbits, bytesize, timeout)
+    if backend != BACKEND_THREADS:
+        raise ValueError(f"Transporte no válido: {backend}")
+    return get_bus(port, baudrate, parity, stopbits, bytesize, timeout, pool=pool)
+
+
+def shutdown_backends(pool=None):
+    """Detiene los dos transportes y cierra las conexiones del pool"""
+    shutdown_all_async()
+    shutdown_all()
+    (pool or get_default_pool()).close_all()
@@ -0,0 +1,208 @@
+"""Detección automática de los parámetros de la línea serie.
+
+Prueba las combinaciones de baudrate, paridad y bits de parada que ofrece
+el buscador de esclavos, empezando por las más habituales en instalaciones
+Modbus RTU, y en cada una sondea primero los IDs de esclavo más comunes.
+Se detiene en la primera respuesta con CRC válido (una lectura correcta o
+una excepción Modbus) y guarda el resultado por puerto en un JSON, de modo
+que la siguiente vez basta con una sola sonda para confirmarlo.
+"""
+import os
+import json
+import time
+import logging
+from bus_arbiter import PRIORITY_INTERACTIVE
+from async_transport import open_bus, BACKEND_THREADS
+from discovery import classify_probe, PROBE_OK, PROBE_EXCEPTION
+from timing import sweep_timeout, is_serial
+
+log = logging.getLogger(__name__)
+
+# Valores que ofrecen los desplegables del buscador de esclavos
+BAUDRATES = [1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200]
+PARITIES = ["N", "E", "O"]
+STOPBITS = [1, 2]
+
+# Orden de probabilidad: las velocidades y tramas más usadas primero
+BAUDRATE_LIKELIHOOD = [9600, 19200, 38400, 115200, 57600, 4800, 2400, 1200]
+FRAMING_LIKELIHOOD = [("N", 1), ("E", 1), ("N", 2), ("O", 1), ("E", 2), ("O", 2)]
+
+# IDs que se prueban en cada combinación (el 1 es el valor de fábrica habitual)
+WELL_KNOWN_SLAVES = [1, 0, 2, 3, 247]
+
+# Modbus RTU usa siempre 8 bits de datos (7 bits solo existe en Modbus ASCII)
+RTU_BYTESIZE = 8
+
+
+def _rank(value, order):
+    return order.index(value) if value in order else len(order)
+
+
+def line_candidates(baudrates=BAUDRATES, parities=PARITIES, stopbits=STOPBITS, bytesize=RTU_BYTESIZE):
+    """Combinaciones [(baudrate, paridad, bits de parada, bits de datos)] ordenadas por probabilidad.
+
+    Se ordenan por la suma de la posición del baudrate y de la trama en sus
+    listas de probabilidad, de modo que 19200 8E1 se prueba antes que
+    1200 8N1.
+    """
+    combos = [(baud, parity, stop) for baud in baudrates for parity in parities for stop in stopbits]
+    combos.sort(key=lambda c: (_rank(c[0], BAUDRATE_LIKELIHOOD) + _rank((c[1], c[2]), FRAMING_LIKELIHOOD),
+                               _rank(c[0], BAUDRATE_LIKELIHOOD)))
+    return [(baud, parity, stop, bytesize) for baud, parity, stop in combos]
+
+
+class LineCache:
+    """Parámetros de línea detectados, guardados por puerto en un JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = {}
+        try:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    self.lines = json.load(f)
+        except Exception as e:
+            log.warning("Error al cargar parámetros de línea detectados: %s", e)
+
+    def get(self, port):
+        return self.lines.get(str(port))
+
+    def put(self, port, line):
+        self.lines[str(port)] = line
+        self.save()
+
+    def forget(self, port):
+        if self.lines.pop(str(port), None) is not None:
+            self.save()
+
+    def save(self):
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.lines, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            log.warning("Error al guardar parámetros de línea detectados: %s", e)
+
+
+def default_cache():
+    """Caché compartida junto a los scripts"""
+    return LineCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "line_settings.json"))
+
+
+class LineDetector:
+    """Busca la configuración de línea con la que responde algún esclavo del puerto.
+
+    Args:
+        port (str): Puerto serie (o pasarela/equipo simulado)
+        slave_ids (list): IDs a probar en cada combinación (los conocidos van primero)
+        table (str): Tabla de la lectura de prueba
+        register (int): Registro de la lectura de prueba
+        backend (str): Transporte ('threads' o 'asyncio')
+        pool (ConnectionPool): Pool de conexiones para el transporte con hilos
+        cache (LineCache): Caché de resultados (None = sin caché)
+        on_progress (callable): on_progress(intento, total, (baudrate, paridad, parada, datos))
+    """
+
+    def __init__(self, port, slave_ids=None, table="holding", register=0, backend=BACKEND_THREADS,
+                 pool=None, cache=None, baudrates=BAUDRATES, parities=PARITIES, stopbits=STOPBITS,
+                 on_progress=None):
+        self.port = port
+        self.slave_ids = list(slave_ids) if slave_ids else list(WELL_KNOWN_SLAVES)
+        self.table = table
+        self.register = register
+        self.backend = backend
+        self.pool = pool
+        self.cache = cache
+        self.on_progress = on_progress
+        self.candidates = line_candidates(baudrates, parities, stopbits)
+        if not is_serial(port):
+            # Las pasarelas TCP fijan la línea serie por su cuenta: basta una combinación
+            self.candidates = self.candidates[:1]
+
+        self.running = False
+        self.attempts = 0
+        self.probes = 0
+        self.elapsed = 0.0
+        self.from_cache = False
+
+    def cancel(self):
+        """Detiene la detección antes de la siguiente sonda"""
+        self.running = False
+
+    def _try_line(self, line, slave_ids):
+        """Sondea los IDs con una configuración. Devuelve (esclavo, ms) o None"""
+        baudrate, parity, stopbits, bytesize = line
+        timeout = sweep_timeout(self.port, baudrate, parity, stopbits, bytesize, self.table)
+        bus = open_bus(self.backend, self.port, baudrate, parity, stopbits, bytesize, timeout, pool=self.pool)
+        if not bus.connect().result():
+            raise ConnectionError(f"No se pudo conectar al puerto {self.port}")
+        for slave_id in slave_ids:
+            if not self.running:
+                return None
+            self.probes += 1
+            try:
+                response, response_time = bus.timed_read(self.table, self.register, 1, slave_id,
+                                                         priority=PRIORITY_INTERACTIVE).result()
+                outcome = classify_probe(response)
+            except Exception as e:
+                outcome = classify_probe(error=e)
+            # Una excepción Modbus también trae un CRC válido: la línea es correcta
+            if outcome in (PROBE_OK, PROBE_EXCEPTION):
+                return slave_id, response_time
+        return None
+
+    def _result(self, line, slave_id, response_time):
+        baudrate, parity, stopbits, bytesize = line
+        return {
+            "port": self.port,
+            "baudrate": baudrate,
+            "parity": parity,
+            "stopbits": stopbits,
+            "bytesize": bytesize,
+            "slave": slave_id,
+            "response_time": round(response_time, 1),
+            "detected": time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    def run(self):
+        """Ejecuta la detección. Devuelve un diccionario con la línea detectada o None.
+
+        Lanza ConnectionError si el puerto no se puede abrir.
+        """
+        self.running = True
+        self.attempts = 0
+        self.probes = 0
+        self.from_cache = False
+        started = time.monotonic()
+        try:
+            # Primero la configuración guardada, con su esclavo
+            cached = self.cache.get(self.port) if self.cache is not None else None
+            cached_line = None
+            if cached:
+                cached_line = (cached["baudrate"], cached["parity"], cached["stopbits"], cached["bytesize"])
+                self.attempts += 1
+                found = self._try_line(cached_line, [cached["slave"]] + self.slave_ids)
+                if found:
+                    self.from_cache = True
+                    return self._result(cached_line, *found)
+
+            total = len(self.candidates)
+            for i, line in enumerate(self.candidates):
+                if not self.running:
+                    return None
+                if line == cached_line:
+                    continue
+                self.attempts += 1
+                if self.on_progress:
+                    self.on_progress(i + 1, total, line)
+                found = self._try_line(line, self.slave_ids)
+                if found:
+                    result = self._result(line, *found)
+                    if self.cache is not None:
+                        self.cache.put(self.port, result)
+                    return result
+            return None
+        finally:
+            self.elapsed = time.monotonic() - started
+            self.running = False
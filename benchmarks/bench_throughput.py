@@ -0,0 +1,268 @@
+"""Mide el rendimiento del escaneo, la búsqueda de esclavos y el sondeo.
+
+Cada carga de trabajo se ejecuta contra una granja simulada (``simulator``)
+en memoria que reproduce el tiempo de transmisión de una línea RTU a cada
+velocidad, con los mismos motores que usan las herramientas:
+
+    scan       AdaptiveScanner, como el escáner de la GUI y ``scan_modbus_registers``
+    discover   DiscoveryEngine, como slave_finder.py y ``main.py discover``
+    poll       PollingEngine, como el monitor de la GUI y ``monitor_temperature``
+
+Por cada caso se muestran transacciones por segundo, utilización del bus,
+latencia p50/p99 de cada transacción y tiempo de CPU por transacción. Los
+resultados se guardan en JSON para comparar versiones:
+
+    python benchmarks/bench_throughput.py --save
+    python benchmarks/bench_throughput.py --baudrates 9600,19200,115200 --registers 10,125 --slaves 1,32
+    python benchmarks/bench_throughput.py --compare benchmarks/results/abc1234.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import itertools
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from async_transport import open_bus, shutdown_backends, BACKENDS, BACKEND_THREADS  # noqa: E402
+from adaptive_scanner import AdaptiveScanner, DeviceProfile  # noqa: E402
+from bus_arbiter import PRIORITY_BACKGROUND  # noqa: E402
+from discovery import DiscoveryEngine  # noqa: E402
+from polling import Tag, PollingEngine, parse_register_list  # noqa: E402
+from loopback import register_loopback_device  # noqa: E402
+from simulator import build_farm  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+WORKLOADS = ("scan", "discover", "poll")
+
+# Campos que identifican un caso al comparar dos ficheros de resultados
+CASE_KEY = ("workload", "backend", "baudrate", "registers", "slaves")
+
+_ports = itertools.count(1)
+
+
+def parse_int_list(text):
+    return [int(value) for value in str(text).replace(";", ",").split(",") if value.strip()]
+
+
+def run_scan(bus, backend, registers, slaves, cycles):
+    """Escanea ``cycles`` veces ``registers`` holding registers de cada esclavo, sin perfil previo"""
+    def reader(table, address, block_size, slave):
+        return bus.read(table, address, block_size, slave, priority=PRIORITY_BACKGROUND).result()
+
+    found = 0
+    for _ in range(cycles):
+        for slave in range(1, slaves + 1):
+            scanner = AdaptiveScanner(reader, DeviceProfile())
+            for _, block in scanner.scan("holding", 0, registers, slave):
+                found += len(block)
+    return found
+
+
+def run_discover(bus, backend, registers, slaves, cycles):
+    """Busca ``cycles`` veces los esclavos 1..``slaves`` (todos presentes) en el bus"""
+    found = 0
+    for _ in range(cycles):
+        engine = DiscoveryEngine([dict(bus.settings)], range(1, slaves + 1), backend=backend)
+        engine.start()
+        engine.wait()
+        found += engine.found
+    return found
+
+
+def run_poll(bus, backend, registers, slaves, cycles):
+    """Sondea ``registers`` registros de cada esclavo durante ``cycles`` ciclos seguidos"""
+    tags = [Tag(slave, "holding", address) for slave in range(1, slaves + 1) for address in range(registers)]
+    engine = PollingEngine(tags)
+    values = 0
+    for _ in range(cycles):
+        values += sum(1 for value in engine.poll_bus(bus) if value.ok)
+    return values
+
+
+RUNNERS = {
+    "scan": run_scan,
+    "discover": run_discover,
+    "poll": run_poll,
+}
+
+
+def run_case(workload, backend, baudrate, registers, slaves, cycles, latency=0.0, holes=""):
+    """Ejecuta un caso con una granja y un bus nuevos. Devuelve el registro de resultados"""
+    port = f"loop://bench-{next(_ports)}"
+    farm = build_farm(f"1-{slaves}", seed=1, baudrate=baudrate, holding=max(registers, 2), input=0,
+                      coils=0, discrete=0, holes=holes, latency=latency)
+    register_loopback_device(port, farm)
+    bus = open_bus(backend, port, baudrate, timeout=1.0)
+    if not bus.connect().result():
+        raise RuntimeError(f"No se pudo abrir {port}")
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    items = RUNNERS[workload](bus, backend, registers, slaves, cycles)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    stats = bus.stats()
+    transactions = farm.requests
+    return {
+        "workload": workload,
+        "backend": backend,
+        "baudrate": baudrate,
+        "registers": registers,
+        "slaves": slaves,
+        "items": items,
+        "transactions": transactions,
+        "failed": stats["failed"],
+        "elapsed_s": elapsed,
+        "tps": transactions / elapsed if elapsed else 0.0,
+        "utilization": stats["utilization"],
+        "p50_ms": stats["latency_p50_ms"],
+        "p99_ms": stats["latency_p99_ms"],
+        "wait_ms": stats["avg_wait_ms"],
+        "cpu_us_per_tx": cpu / transactions * 1e6 if transactions else 0.0,
+    }
+
+
+def build_cases(args):
+    """Combinaciones de carga, transporte, baudrate, registros y esclavos a medir"""
+    cases = []
+    for workload, backend, baudrate in itertools.product(args.workloads, args.backends, args.baudrates):
+        if workload == "scan":
+            cases.extend((workload, backend, baudrate, registers, 1) for registers in args.registers)
+        elif workload == "discover":
+            cases.extend((workload, backend, baudrate, 1, slaves) for slaves in args.slaves)
+        else:
+            cases.extend((workload, backend, baudrate, registers, slaves)
+                         for registers in args.registers for slaves in args.slaves)
+    return cases
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result):
+    return tuple(result[field] for field in CASE_KEY)
+
+
+def print_results(results):
+    print(f"{'Carga':9} {'Transp.':8} {'Baudios':>7} {'Regs':>5} {'Escl.':>5} {'Trans.':>7} "
+          f"{'Trans/s':>9} {'Uso':>5} {'p50 ms':>8} {'p99 ms':>8} {'CPU µs/tr':>10}")
+    print("-" * 93)
+    for r in results:
+        print(f"{r['workload']:9} {r['backend']:8} {r['baudrate']:7} {r['registers']:5} {r['slaves']:5} "
+              f"{r['transactions']:7} {r['tps']:9.1f} {r['utilization'] * 100:4.0f}% {r['p50_ms']:8.2f} "
+              f"{r['p99_ms']:8.2f} {r['cpu_us_per_tx']:10.1f}")
+
+
+def compare(results, baseline, threshold):
+    """Compara con un fichero anterior. Devuelve el número de casos que empeoran más de ``threshold``"""
+    previous = {case_key(r): r for r in baseline["results"]}
+    label = baseline.get("label") or baseline.get("revision") or "referencia"
+    print(f"\nComparación con {label} (umbral {threshold * 100:g}%)")
+    print(f"{'Caso':42} {'Trans/s':>18} {'p99 ms':>18} {'CPU µs/tr':>18}")
+    print("-" * 100)
+    regressions = 0
+    for r in results:
+        old = previous.get(case_key(r))
+        if old is None:
+            continue
+        name = f"{r['workload']} {r['backend']} {r['baudrate']} r{r['registers']} s{r['slaves']}"
+        changes = {}
+        for field in ("tps", "p99_ms", "cpu_us_per_tx"):
+            before = old[field]
+            changes[field] = (r[field] - before) / before if before else 0.0
+        # El CPU por transacción varía mucho entre ejecuciones: solo cuentan rendimiento y latencia
+        worse = changes["tps"] < -threshold or changes["p99_ms"] > threshold
+        regressions += worse
+        columns = "  ".join(f"{r[field]:9.1f} ({change * 100:+5.0f}%)" for field, change in changes.items())
+        print(f"{name:42} {columns}{'  <- empeora' if worse else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rendimiento de escaneo, búsqueda y sondeo sobre un bus simulado")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"Cargas a medir ({', '.join(WORKLOADS)})")
+    parser.add_argument("--backends", default=BACKEND_THREADS, help=f"Transportes ({', '.join(BACKENDS)})")
+    parser.add_argument("--baudrates", default="9600,115200", help="Velocidades de línea simuladas")
+    parser.add_argument("--registers", default="10,100", help="Registros por esclavo (scan y poll)")
+    parser.add_argument("--slaves", default="1,10", help="Esclavos en el bus (discover y poll)")
+    parser.add_argument("--cycles", type=int, default=5, help="Repeticiones de cada carga por caso")
+    parser.add_argument("--latency", type=float, default=0.0, help="Tiempo de respuesta del esclavo (s)")
+    parser.add_argument("--holes", default="", help='Direcciones sin registro en cada esclavo ("50-59")')
+    parser.add_argument("--label", help="Nombre de la ejecución (por defecto la revisión de git)")
+    parser.add_argument("--save", nargs="?", const="", metavar="FICHERO",
+                        help=f"Guardar los resultados en JSON (por defecto en {os.path.relpath(RESULTS_DIR, ROOT)}/)")
+    parser.add_argument("--compare", metavar="FICHERO", help="Resultados anteriores con los que comparar")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Empeoramiento tolerado al comparar (0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    args.workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    args.backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [w for w in args.workloads if w not in WORKLOADS] + [b for b in args.backends if b not in BACKENDS]
+    if unknown:
+        parser.error(f"Desconocido: {', '.join(unknown)}")
+    try:
+        args.baudrates = parse_int_list(args.baudrates)
+        args.registers = parse_int_list(args.registers)
+        args.slaves = parse_int_list(args.slaves)
+        if args.holes:
+            parse_register_list(args.holes)
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = []
+    try:
+        # Calentamiento: la primera transacción carga pymodbus y el resto de módulos perezosos
+        for backend in args.backends:
+            run_case("poll", backend, 115200, 1, 1, 1)
+        shutdown_backends()
+        for workload, backend, baudrate, registers, slaves in build_cases(args):
+            results.append(run_case(workload, backend, baudrate, registers, slaves, args.cycles,
+                                    args.latency, args.holes))
+            shutdown_backends()
+    except KeyboardInterrupt:
+        print("Interrumpido: se muestran los casos terminados", file=sys.stderr)
+    finally:
+        shutdown_backends()
+    print_results(results)
+
+    revision = git_revision()
+    if args.save is not None:
+        label = args.label or revision or time.strftime("%Y%m%d-%H%M%S")
+        path = args.save or os.path.join(RESULTS_DIR, f"{label}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                "label": label,
+                "revision": revision,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cycles": args.cycles,
+                "latency": args.latency,
+                "holes": args.holes,
+                "results": results,
+            }, f, indent=2)
+        print(f"\nResultados guardados en {path}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Mide el tiempo de arranque de los puntos de entrada.
+
+Cada caso se ejecuta varias veces en un intérprete nuevo (sin módulos ya
+cargados) y se muestra la mediana del tiempo de importación, sin contar el
+arranque del propio intérprete, junto con los módulos pesados que quedaron
+cargados.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 20 modbus_core main
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos cuya carga se quiere evitar hasta que hagan falta
+HEAVY_MODULES = ("pymodbus", "asyncio", "tkinter", "ssl")
+
+# Caso -> código que se ejecuta en el intérprete nuevo
+CASES = {
+    "modbus_core": "import modbus_core",
+    "modbus_core.Tag": "from modbus_core import Tag, RegisterFormat",
+    "modbus_core.open_bus": "from modbus_core import open_bus",
+    "main": "import main",
+    "main --help": "import sys, main; sys.argv = ['main.py', 'read', '--help']\ntry:\n    main.main()\nexcept SystemExit:\n    pass",
+    "modbus_gui": "import modbus_gui",
+    "slave_finder": "import slave_finder",
+}
+
+_PROBE = """
+import sys, time, json, io, contextlib
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    exec(compile({code!r}, "<case>", "exec"))
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def run_case(code, runs):
+    """Ejecuta un caso ``runs`` veces. Devuelve (mediana en ms, módulos pesados cargados)"""
+    samples = []
+    heavy = []
+    probe = _PROBE.format(code=code, heavy=HEAVY_MODULES)
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        samples.append(result["elapsed"] * 1000)
+        heavy = result["heavy"]
+    return statistics.median(samples), heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempo de importación de los puntos de entrada")
+    parser.add_argument("cases", nargs="*", help=f"Casos a medir (por defecto todos: {', '.join(CASES)})")
+    parser.add_argument("--runs", type=int, default=10, help="Ejecuciones por caso")
+    args = parser.parse_args(argv)
+
+    names = args.cases or list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f"Casos desconocidos: {', '.join(unknown)}")
+
+    print(f"{'Caso':24} {'Mediana':>10}  Módulos pesados cargados")
+    print("-" * 70)
+    for name in names:
+        try:
+            elapsed, heavy = run_case(CASES[name], args.runs)
+        except subprocess.CalledProcessError as e:
+            print(f"{name:24} {'error':>10}  {e.stderr.strip().splitlines()[-1] if e.stderr else e}")
+            continue
+        print(f"{name:24} {elapsed:8.1f} ms  {', '.join(heavy) or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""Árbitro de bus: un único hilo por puerto serializa todas las transacciones.
+
+En un bus RS-485 half-duplex dos transacciones simultáneas colisionan y
+producen errores de CRC y reintentos. Cada puerto físico tiene un hilo que
+toma trabajos de una cola de prioridad (escrituras y lecturas interactivas
+antes que el sondeo en segundo plano) y los ejecuta de uno en uno con el
+cliente del pool de conexiones, dejando entre ellos el silencio t3.5 de la
+línea. Los llamadores reciben un ``Future``.
+"""
+import threading
+import queue
+import itertools
+import time
+import math
+import logging
+from collections import deque
+from concurrent.futures import Future
+from connection_pool import get_default_pool
+from timing import LinePacer
+from fault_policy import get_fault_policy, READ_FUNCTIONS, WRITE_FUNCTIONS
+
+log = logging.getLogger(__name__)
+
+# Prioridades (menor número = se atiende antes)
+PRIORITY_WRITE = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_POLL = 2
+PRIORITY_BACKGROUND = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_WRITE: "write",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_POLL: "poll",
+    PRIORITY_BACKGROUND: "background",
+}
+
+# Ventana para el cálculo de la utilización reciente del bus (segundos)
+UTILIZATION_WINDOW = 10.0
+
+# Últimas transacciones con las que se calculan los percentiles de latencia
+LATENCY_SAMPLES = 4096
+
+
+def percentile(samples, fraction):
+    """Percentil ``fraction`` (0-1) de una lista de valores, por rango más cercano"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(math.ceil(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def execute_read(client, table, address, count, slave):
+    """Lee de la tabla Modbus indicada ('holding', 'input', 'coil', 'discrete_input')"""
+    if table == "holding":
+        return client.read_holding_registers(address, count, slave=slave)
+    elif table == "input":
+        return client.read_input_registers(address, count, slave=slave)
+    elif table == "coil":
+        return client.read_coils(address, count, slave=slave)
+    elif table == "discrete_input":
+        return client.read_discrete_inputs(address, count, slave=slave)
+    raise ValueError(f"Tipo de registro no válido: {table}")
+
+
+def execute_write(client, table, address, value, slave):
+    """Escribe un valor en la tabla Modbus indicada ('holding' o 'coil')"""
+    if table == "holding":
+        return client.write_register(address, value, slave=slave)
+    elif table == "coil":
+        return client.write_coil(address, value, slave=slave)
+    raise ValueError(f"No se puede escribir en registro tipo: {table}")
+
+
+class _Job:
+    """Trabajo pendiente en la cola del bus"""
+
+    __slots__ = ("fn", "settings", "priority", "future", "submitted")
+
+    def __init__(self, fn, settings, priority):
+        self.fn = fn
+        self.settings = settings
+        self.priority = priority
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class BusArbiter:
+    """Hilo planificador que posee el acceso a un puerto físico"""
+
+    def __init__(self, port, pool=None):
+        self.port = port
+        self.pool = pool or get_default_pool()
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {p: 0 for p in PRIORITY_NAMES}
+        self._running = True
+        self.pacer = LinePacer()
+
+        # Estadísticas
+        self.started = time.monotonic()
+        self.busy_time = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self._recent = deque()  # (fin, duración) de las últimas transacciones
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+        self._thread = threading.Thread(target=self._run, name=f"bus-{port}")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, fn, settings, priority=PRIORITY_POLL):
+        """Encola fn(client) para ejecutarse en el hilo del bus y devuelve un Future"""
+        job = _Job(fn, settings, priority)
+        with self._lock:
+            if not self._running:
+                job.future.set_exception(RuntimeError(f"El bus {self.port} está detenido"))
+                return job.future
+            self._pending[priority] = self._pending.get(priority, 0) + 1
+        self._queue.put((priority, next(self._seq), job))
+        return job.future
+
+    def _run(self):
+        """Bucle del hilo del bus: atiende los trabajos por orden de prioridad"""
+        while True:
+            priority, _, job = self._queue.get()
+            if job is None:
+                break
+
+            with self._lock:
+                self._pending[priority] -= 1
+
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            self.pacer.wait(job.settings)
+            start = time.monotonic()
+            self.total_wait += start - job.submitted
+            try:
+                client = self.pool.get_client(**job.settings)
+                result = job.fn(client)
+            except Exception as e:
+                self.failed += 1
+                job.future.set_exception(e)
+            else:
+                self.completed += 1
+                job.future.set_result(result)
+            finally:
+                self.pacer.mark()
+                end = time.monotonic()
+                duration = end - start
+                with self._lock:
+                    self.busy_time += duration
+                    self._recent.append((end, duration))
+                    self._latencies.append(duration)
+
+    def queue_depth(self):
+        """Número de trabajos en espera"""
+        with self._lock:
+            return sum(self._pending.values())
+
+    def stats(self):
+        """Devuelve profundidad de cola, utilización del bus y contadores"""
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0][0] < now - UTILIZATION_WINDOW:
+                self._recent.popleft()
+            recent_busy = sum(duration for _, duration in self._recent)
+            window = min(UTILIZATION_WINDOW, now - self.started) or 1e-9
+            elapsed = (now - self.started) or 1e-9
+            done = self.completed + self.failed
+            latencies = list(self._latencies)
+            return {
+                "port": self.port,
+                "backend": "threads",
+                "queue_depth": sum(self._pending.values()),
+                "queue_by_priority": {PRIORITY_NAMES[p]: n for p, n in self._pending.items()},
+                "completed": self.completed,
+                "failed": self.failed,
+                "utilization": self.busy_time / elapsed,
+                "recent_utilization": min(recent_busy / window, 1.0),
+                "avg_wait_ms": (self.total_wait / done * 1000) if done else 0.0,
+                "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+                "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+                "paced_ms": self.pacer.paced_time * 1000,
+            }
+
+    def shutdown(self):
+        """Detiene el hilo del bus y cancela los trabajos pendientes"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        # Vaciar la cola cancelando lo que no se ha ejecutado
+        while True:
+            try:
+                priority, _, job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                with self._lock:
+                    self._pending[priority] -= 1
+                job.future.cancel()
+        self._queue.put((-1, -1, None))
+        self._thread.join(timeout=2)
+
+
+class BusHandle:
+    """Acceso a un bus con una configuración de comunicación concreta"""
+
+    backend = "threads"
+
+    def __init__(self, arbiter, settings):
+        self.arbiter = arbiter
+        self.settings = settings
+
+    def submit(self, fn, priority=PRIORITY_POLL):
+        """Ejecuta fn(client) en el hilo del bus"""
+        return self.arbiter.submit(fn, self.settings, priority)
+
+    def connect(self, priority=PRIORITY_INTERACTIVE):
+        """Abre el puerto desde el hilo del bus. El Future devuelve True/False"""
+        return self.submit(lambda client: client.connect(), priority)
+
+    def read(self, table, address, count, slave, priority=PRIORITY_INTERACTIVE):
+        """Encola una lectura (con reintentos y circuito del esclavo) y devuelve un Future con la respuesta"""
+        return get_fault_policy().submit(
+            self.submit, self.settings, slave, READ_FUNCTIONS.get(table),
+            lambda client: execute_read(client, table, address, count, slave), priority)
+
+    def write(self, table, address, value, slave, priority=PRIORITY_WRITE):
+        """Encola una escritura (con reintentos y circuito del esclavo) y devuelve un Future con la respuesta"""
+        return get_fault_policy().submit(
+            self.submit, self.settings, slave, WRITE_FUNCTIONS.get(table),
+            lambda client: execute_write(client, table, address, value, slave), priority)
+
+    def timed_read(self, table, address, count, slave, priority=PRIORITY_INTERACTIVE):
+        """Como ``read`` pero el Future devuelve (respuesta, tiempo de respuesta en ms).
+
+        Es una medida: sale una sola vez al bus, sin reintentos. El tiempo se
+        mide en el hilo del bus, sin la espera en cola.
+        """
+        return get_fault_policy().submit(
+            self.submit, self.settings, slave, READ_FUNCTIONS.get(table),
+            lambda client: execute_read(client, table, address, count, slave), priority,
+            measurement=True)
+
+    def stats(self):
+        return self.arbiter.stats()
+
+
+_arbiters = {}
+_arbiters_lock = threading.Lock()
+
+
+def get_bus(port, baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1.0, pool=None):
+    """Devuelve un acceso al bus del puerto indicado (un árbitro por puerto físico)"""
+    with _arbiters_lock:
+        arbiter = _arbiters.get(port)
+        if arbiter is None:
+            arbiter = BusArbiter(port, pool)
+            _arbiters[port] = arbiter
+    settings = {
+        "port": port,
+        "baudrate": baudrate,
+        "parity": parity,
+        "stopbits": stopbits,
+        "bytesize": bytesize,
+        "timeout": timeout,
+    }
+    return BusHandle(arbiter, settings)
+
+
+def shutdown_all():
+    """Detiene todos los árbitros de bus del proceso"""
+    with _arbiters_lock:
+        arbiters = list(_arbiters.values())
+        _arbiters.clear()
+    for arbiter in arbiters:
+        arbiter.shutdown()
+
+
+def all_stats():
+    """Devuelve las estadísticas de todos los árbitros activos"""
+    with _arbiters_lock:
+        arbiters = list(_arbiters.values())
+    return [arbiter.stats() for arbiter in arbiters]
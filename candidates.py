@@ -0,0 +1,214 @@
+"""Detección de registros que parecen temperaturas en los resultados de un escaneo.
+
+Los registros escaneados de cada (esclavo, tabla) se guardan en una imagen
+compacta del espacio de direcciones (``array('H')`` con los valores y un
+``bytearray`` que marca qué direcciones respondieron: unos 192 KB por
+esclavo y tabla aunque se escanee todo el espacio). Cada tramo contiguo se
+decodifica de una vez con ``decoding`` en todas las interpretaciones
+(uint16/int16 con escalas ×1/×0.1/×0.01, int32 y float32 en los dos órdenes
+de palabra), y solo los valores dentro del rango de temperatura se puntúan.
+
+Los valores de relleno (0, 0xFFFF, 0x7FFF, 0x8000) se descartan. La
+puntuación combina la interpretación (×0.1 es la más habitual en
+controladores de frío), lo típico del valor y, si hay varios escaneos, la
+estabilidad: una temperatura real varía poco entre escaneos, un contador o
+un valor que salta no.
+"""
+from array import array
+from decoding import RegisterFormat, BIG, LITTLE
+
+ADDRESS_SPACE = 65536
+
+TEMPERATURE_RANGE = (-50.0, 150.0)
+
+# Peso de cada escala para registros de 16 bits
+SCALE_WEIGHTS = {1.0: 0.7, 0.1: 1.0, 0.01: 0.6}
+
+# Valores crudos que los equipos usan como relleno o "sensor en fallo"
+FILLER_VALUES = frozenset((0x0000, 0xFFFF, 0x7FFF, 0x8000))
+
+# Variación máxima entre escaneos para considerar estable un valor (°C)
+STABLE_DELTA = 2.0
+
+
+class Interpretation:
+    """Forma de leer uno o dos registros como temperatura"""
+
+    def __init__(self, label, datatype, scale=1.0, word_order=BIG, weight=1.0):
+        self.label = label
+        self.format = RegisterFormat(datatype, scale, word_order=word_order)
+        self.datatype = datatype
+        self.scale = scale
+        self.weight = weight
+
+    @property
+    def words(self):
+        return self.format.words
+
+
+def default_interpretations():
+    interpretations = []
+    for scale, weight in SCALE_WEIGHTS.items():
+        interpretations.append(Interpretation(f"uint16 ×{scale:g}", "uint16", scale, weight=weight))
+        interpretations.append(Interpretation(f"int16 ×{scale:g}", "int16", scale, weight=weight))
+    for order, name in ((BIG, "ABCD"), (LITTLE, "CDAB")):
+        interpretations.append(Interpretation(f"int32 {name} ×0.1", "int32", 0.1, order, weight=0.5))
+        interpretations.append(Interpretation(f"float32 {name}", "float32", 1.0, order, weight=0.8))
+    return interpretations
+
+
+class ScanImage:
+    """Registros de un escaneo de un (esclavo, tabla) sobre todo el espacio de direcciones"""
+
+    def __init__(self):
+        self.values = array('H', bytes(2 * ADDRESS_SPACE))
+        self.present = bytearray(ADDRESS_SPACE)
+        self.count = 0
+
+    def add_block(self, address, registers):
+        end = min(address + len(registers), ADDRESS_SPACE)
+        size = end - address
+        if size <= 0:
+            return
+        self.values[address:end] = array('H', registers[:size])
+        self.count += size - self.present.count(1, address, end)
+        self.present[address:end] = b"\x01" * size
+
+    def runs(self):
+        """Recorre los tramos contiguos de direcciones leídas como (inicio, fin)"""
+        present = self.present
+        start = present.find(1)
+        while start != -1:
+            end = present.find(0, start)
+            if end == -1:
+                end = ADDRESS_SPACE
+            yield start, end
+            start = present.find(1, end)
+
+    def read(self, address, words):
+        """Registros de un valor si todos se leyeron, si no None"""
+        end = address + words
+        if end > ADDRESS_SPACE or self.present.count(1, address, end) != words:
+            return None
+        return self.values[address:end]
+
+
+class Candidate:
+    """Registro que puede contener una temperatura"""
+
+    __slots__ = ("slave", "table", "address", "interpretation", "value", "raw", "score", "stability")
+
+    def __init__(self, slave, table, address, interpretation, value, raw, score, stability):
+        self.slave = slave
+        self.table = table
+        self.address = address
+        self.interpretation = interpretation
+        self.value = value
+        self.raw = raw
+        self.score = score
+        self.stability = stability
+
+    @property
+    def label(self):
+        return self.interpretation.label
+
+    def __repr__(self):
+        return (f"Candidate({self.slave}, {self.table!r}, {self.address}, {self.label!r}, "
+                f"{self.value:.2f}, score={self.score:.2f})")
+
+
+class CandidateFinder:
+    """Acumula escaneos y clasifica los registros por lo que se parecen a una temperatura.
+
+    Args:
+        low, high (float): Rango de temperaturas aceptado
+        interpretations (list): Interpretaciones a probar (ver ``default_interpretations``)
+    """
+
+    def __init__(self, low=TEMPERATURE_RANGE[0], high=TEMPERATURE_RANGE[1], interpretations=None):
+        self.low = low
+        self.high = high
+        self.interpretations = interpretations or default_interpretations()
+        self._scans = {}  # (esclavo, tabla) -> [ScanImage por pasada]
+
+    def add_block(self, slave, table, address, registers, scan=0):
+        """Añade un bloque leído en la pasada de escaneo ``scan``"""
+        images = self._scans.setdefault((slave, table), [])
+        while len(images) <= scan:
+            images.append(ScanImage())
+        images[scan].add_block(address, registers)
+
+    def scans(self, slave, table):
+        return len(self._scans.get((slave, table), ()))
+
+    @staticmethod
+    def _typical(value):
+        """Peso según lo habitual del valor (ambiente, frío, proceso)"""
+        if 15.0 <= value <= 30.0:
+            return 1.0
+        if -30.0 <= value <= 60.0:
+            return 0.85
+        return 0.6
+
+    def _stability(self, images, interpretation, address):
+        """Peso según cómo varía el valor entre escaneos (None si solo hay uno)"""
+        values = []
+        for image in images:
+            registers = image.read(address, interpretation.words)
+            if registers is not None:
+                values.append(interpretation.format.decode(registers))
+        if len(values) < 2:
+            return None
+        delta = max(values) - min(values)
+        if delta == 0:
+            return 0.8  # Constante: puede ser una consigna o un parámetro
+        if delta <= STABLE_DELTA:
+            return 1.0
+        return 0.2
+
+    def _evaluate(self, slave, table, images, hits):
+        image = images[-1]
+        low, high = self.low, self.high
+        for start, end in image.runs():
+            registers = image.values[start:end]
+            for interpretation in self.interpretations:
+                words = interpretation.words
+                for alignment in range(words):
+                    # Todo el tramo en una sola conversión; solo se puntúa lo que cae en rango
+                    values = interpretation.format.decode_array(registers[alignment:])
+                    for i, value in enumerate(values):
+                        if not low <= value <= high:
+                            continue
+                        offset = alignment + i * words
+                        raw = registers[offset:offset + words]
+                        if interpretation.datatype == "int16" and raw[0] < 0x8000:
+                            continue  # Igual que uint16
+                        if interpretation.datatype == "float32" and value != 0 and abs(value) < 0.01:
+                            continue  # Números desnormalizados de dos registros pequeños
+                        if all(r in FILLER_VALUES for r in raw):
+                            continue
+                        stability = self._stability(images, interpretation, start + offset)
+                        score = (interpretation.weight * self._typical(value)
+                                 * (0.7 if stability is None else stability))
+                        hits.append(Candidate(slave, table, start + offset, interpretation, value,
+                                              list(raw), score, stability))
+
+    def candidates(self, best_per_register=True, limit=None, min_score=0.0):
+        """Devuelve los candidatos ordenados de más a menos plausible.
+
+        Con ``best_per_register`` solo se devuelve la mejor interpretación de
+        cada dirección.
+        """
+        hits = []
+        for (slave, table), images in sorted(self._scans.items()):
+            self._evaluate(slave, table, images, hits)
+        if best_per_register:
+            best = {}
+            for candidate in hits:
+                key = (candidate.slave, candidate.table, candidate.address)
+                if key not in best or candidate.score > best[key].score:
+                    best[key] = candidate
+            hits = list(best.values())
+        hits = [c for c in hits if c.score >= min_score]
+        hits.sort(key=lambda c: (-c.score, c.slave, c.table, c.address))
+        return hits[:limit] if limit else hits
@@ -0,0 +1,102 @@
+"""Detección de cambios (report-by-exception) entre el sondeo y sus consumidores.
+
+Un tag solo se notifica cuando su valor se aleja del último valor notificado
+más que la banda muerta (absoluta o en porcentaje), cuando pasa de correcto
+a error o al revés, o cuando lleva ``heartbeat`` segundos sin notificarse.
+Así la interfaz, el historial y las exportaciones trabajan en proporción a
+los cambios y no a la frecuencia de sondeo. El grabador de series
+temporales (``recorder``) no se filtra: guarda todas las muestras sondeadas.
+"""
+import time
+import threading
+
+
+class _TagState:
+    __slots__ = ("value", "error", "reported_at")
+
+    def __init__(self, value, error, reported_at):
+        self.value = value
+        self.error = error
+        self.reported_at = reported_at
+
+
+class ChangeFilter:
+    """Filtra los resultados de sondeo que no cambian.
+
+    Args:
+        deadband (float): Cambio mínimo en unidades del valor escalado (0 = cualquier cambio)
+        deadband_percent (float): Cambio mínimo en % del último valor notificado
+        heartbeat (float): Segundos máximos sin notificar un tag (None o 0 = sin latido)
+
+    Con las dos bandas muertas se notifica en cuanto se supera cualquiera de ellas.
+    """
+
+    def __init__(self, deadband=0.0, deadband_percent=0.0, heartbeat=None):
+        self.deadband = abs(deadband or 0.0)
+        self.deadband_percent = abs(deadband_percent or 0.0)
+        self.heartbeat = heartbeat or None
+        self._states = {}
+        self._lock = threading.Lock()
+
+        self.received = 0
+        self.reported = 0
+        self.heartbeats = 0
+
+    @staticmethod
+    def key(tag):
+        return (tag.slave, tag.table, tag.address)
+
+    def _changed(self, last, value):
+        delta = abs(value - last)
+        if not self.deadband and not self.deadband_percent:
+            return delta > 0
+        if self.deadband and delta > self.deadband:
+            return True
+        if self.deadband_percent and delta > abs(last) * self.deadband_percent / 100.0:
+            return True
+        return False
+
+    def check(self, key, value=None, error=None, now=None):
+        """Indica si un valor (o error) debe notificarse y, si es así, lo toma como referencia"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.received += 1
+            state = self._states.get(key)
+            if state is None:
+                report = True
+            elif (error is None) != (state.error is None):
+                report = True  # Cambio de calidad
+            elif error is not None:
+                report = error != state.error
+            else:
+                report = self._changed(state.value, value)
+            if not report and self.heartbeat and now - state.reported_at >= self.heartbeat:
+                report = True
+                self.heartbeats += 1
+            if report:
+                self._states[key] = _TagState(value, error, now)
+                self.reported += 1
+            return report
+
+    def filter(self, results, now=None):
+        """Devuelve los ``TagValue`` de un ciclo que deben notificarse"""
+        now = time.monotonic() if now is None else now
+        return [result for result in results
+                if self.check(self.key(result.tag), result.value, result.error, now)]
+
+    def reset(self):
+        """Olvida los últimos valores notificados (el siguiente ciclo se notifica entero)"""
+        with self._lock:
+            self._states.clear()
+
+    def stats(self):
+        """Devuelve muestras recibidas, notificadas y la fracción suprimida"""
+        with self._lock:
+            received, reported = self.received, self.reported
+        return {
+            "received": received,
+            "reported": reported,
+            "suppressed": received - reported,
+            "heartbeats": self.heartbeats,
+            "suppressed_ratio": (received - reported) / received if received else 0.0,
+        }
@@ -0,0 +1,285 @@
+"""Pool de conexiones Modbus persistentes compartido por las herramientas.
+
+Abrir un convertidor USB-RS485 cuesta decenas o cientos de milisegundos, a
+menudo más que la propia transacción Modbus. El pool mantiene abierto un
+cliente (serie, TCP o RTU sobre TCP, ver ``transport``) por cada combinación
+(puerto, baudrate, paridad, bits de parada, bits de datos) y lo reconecta de forma perezosa después de
+un fallo del puerto.
+"""
+import time
+import threading
+import logging
+from transport import create_modbus_client
+from metrics import get_metrics
+
+log = logging.getLogger(__name__)
+
+# Operaciones Modbus que pasan por el pool (con bloqueo y reconexión)
+MODBUS_CALLS = (
+    "read_holding_registers",
+    "read_input_registers",
+    "read_coils",
+    "read_discrete_inputs",
+    "write_register",
+    "write_registers",
+    "write_coil",
+    "write_coils",
+)
+
+
+def make_key(port, baudrate=9600, parity='N', stopbits=1, bytesize=8):
+    """Devuelve la clave del pool para una configuración de puerto"""
+    return (str(port), int(baudrate), str(parity), int(stopbits), int(bytesize))
+
+
+def apply_timeout(client, timeout):
+    """Ajusta el timeout de un cliente ya creado sin reabrir el puerto"""
+    comm_params = getattr(client, "comm_params", None)
+    if comm_params is not None and hasattr(comm_params, "timeout_connect"):
+        comm_params.timeout_connect = timeout
+    params = getattr(client, "params", None)
+    if params is not None and hasattr(params, "timeout"):
+        params.timeout = timeout
+    socket = getattr(client, "socket", None)
+    if socket is not None and hasattr(socket, "timeout"):
+        try:
+            socket.timeout = timeout
+        except Exception:
+            pass
+
+
+def is_connection_error(exc):
+    """Indica si una excepción significa que el puerto quedó inutilizable"""
+    from pymodbus.exceptions import ConnectionException
+    return isinstance(exc, (ConnectionException, OSError))
+
+
+class _PoolEntry:
+    """Conexión física abierta asociada a una clave del pool.
+
+    Todas las configuraciones de un mismo puerto físico comparten ``lock``:
+    abrir una cierra las demás, y con un bloqueo por configuración dos
+    aperturas simultáneas (dos baudrates durante la búsqueda) se bloquearían
+    mutuamente.
+    """
+
+    def __init__(self, key, lock):
+        self.key = key
+        self.client = None
+        self.timeout = None
+        self.stale = False
+        self.lock = lock
+        self.transactions = 0
+        self.failures = 0
+
+
+class PooledClient:
+    """Cliente prestado por el pool.
+
+    Se usa igual que un ``ModbusSerialClient``: ``connect()`` asegura que el
+    puerto esté abierto y ``close()`` solo devuelve el cliente al pool. Cada
+    operación Modbus se ejecuta con el bloqueo del puerto tomado y marca la
+    conexión para reconectar si el puerto falla. La duración y el resultado
+    de cada operación se anotan en las métricas del proceso.
+    """
+
+    def __init__(self, pool, entry, timeout):
+        self._pool = pool
+        self._entry = entry
+        self.timeout = timeout
+
+    @property
+    def key(self):
+        return self._entry.key
+
+    @property
+    def port(self):
+        return self._entry.key[0]
+
+    def connect(self):
+        """Abre (o reutiliza) la conexión física. Devuelve True si está lista"""
+        with self._entry.lock:
+            return self._pool._ensure_connected(self._entry, self.timeout)
+
+    def close(self):
+        """Devuelve el cliente al pool sin cerrar el puerto"""
+        pass
+
+    def invalidate(self):
+        """Fuerza la reconexión en la próxima operación"""
+        self._pool.invalidate(self._entry.key)
+
+    def execute_call(self, name, *args, **kwargs):
+        """Ejecuta una operación Modbus del cliente físico con el puerto bloqueado"""
+        entry = self._entry
+        with entry.lock:
+            if not self._pool._ensure_connected(entry, self.timeout):
+                from pymodbus.exceptions import ConnectionException
+                raise ConnectionException(f"No se pudo conectar al puerto {self.port}")
+            start = time.perf_counter()
+            try:
+                entry.transactions += 1
+                response = getattr(entry.client, name)(*args, **kwargs)
+            except Exception as e:
+                get_metrics().observe_call(self.port, name, args, kwargs, time.perf_counter() - start, error=e)
+                if is_connection_error(e):
+                    self._pool._mark_failed(entry, e)
+                raise
+            get_metrics().observe_call(self.port, name, args, kwargs, time.perf_counter() - start, response)
+            return response
+
+    def __getattr__(self, name):
+        if name in MODBUS_CALLS:
+            def call(*args, **kwargs):
+                return self.execute_call(name, *args, **kwargs)
+            call.__name__ = name
+            return call
+        raise AttributeError(name)
+
+
+class ConnectionPool:
+    """Mantiene conexiones Modbus abiertas indexadas por configuración de puerto.
+
+    Contadores:
+        hits: operaciones servidas con una conexión ya abierta
+        misses: conexiones abiertas por primera vez
+        reconnects: reaperturas después de un fallo o un cierre del puerto
+        connect_failures: intentos de apertura fallidos
+    """
+
+    def __init__(self, client_factory=create_modbus_client):
+        self.client_factory = client_factory
+        self._entries = {}
+        self._port_locks = {}  # Un bloqueo por puerto físico
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.connect_failures = 0
+
+    def get_client(self, port, baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1.0):
+        """Devuelve un cliente prestado para la configuración indicada (sin E/S)"""
+        key = make_key(port, baudrate, parity, stopbits, bytesize)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                lock = self._port_locks.setdefault(key[0], threading.RLock())
+                entry = _PoolEntry(key, lock)
+                self._entries[key] = entry
+        return PooledClient(self, entry, timeout)
+
+    def _ensure_connected(self, entry, timeout):
+        """Abre o reabre la conexión de una entrada (llamar con entry.lock tomado)"""
+        client = entry.client
+        if client is not None and not entry.stale and client.is_socket_open():
+            self.hits += 1
+            if entry.timeout != timeout:
+                apply_timeout(client, timeout)
+                entry.timeout = timeout
+            return True
+
+        if client is None:
+            self.misses += 1
+        else:
+            self.reconnects += 1
+            try:
+                client.close()
+            except Exception:
+                pass
+
+        port, baudrate, parity, stopbits, bytesize = entry.key
+        self._close_siblings(entry)
+        try:
+            client = self.client_factory(port, baudrate, parity, stopbits, bytesize, timeout)
+            connected = client.connect()
+        except Exception as e:
+            log.debug("Error al abrir %s: %s", port, e)
+            connected = False
+
+        if not connected:
+            self.connect_failures += 1
+            entry.failures += 1
+            entry.client = None
+            entry.stale = False
+            return False
+
+        entry.client = client
+        entry.timeout = timeout
+        entry.stale = False
+        log.debug("Conexión abierta en %s", port)
+        return True
+
+    def _close_siblings(self, entry):
+        """Cierra las demás configuraciones abiertas del mismo puerto físico.
+
+        Un puerto serie solo se puede abrir una vez: al cambiar de baudrate o
+        de paridad (por ejemplo al autodetectar la línea) hay que liberar la
+        configuración anterior antes de abrir la nueva.
+        """
+        port = entry.key[0]
+        with self._lock:
+            siblings = [e for e in self._entries.values()
+                        if e is not entry and e.key[0] == port and e.client is not None]
+        # El llamador ya tiene el bloqueo del puerto, que es el mismo de las demás configuraciones
+        for sibling in siblings:
+            with sibling.lock:
+                if sibling.client is not None:
+                    try:
+                        sibling.client.close()
+                    except Exception:
+                        pass
+                    sibling.client = None
+                    log.debug("Cerrada la configuración %s para abrir %s", sibling.key, entry.key)
+
+    def _mark_failed(self, entry, exc):
+        """Marca la conexión de una entrada para reconectar en el próximo uso"""
+        entry.failures += 1
+        entry.stale = True
+        log.debug("Conexión en %s marcada para reconectar: %s", entry.key[0], exc)
+
+    def invalidate(self, key):
+        """Fuerza la reconexión de la entrada con la clave indicada"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            entry.stale = True
+
+    def close_all(self):
+        """Cierra todas las conexiones abiertas del pool"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            with entry.lock:
+                if entry.client is not None:
+                    try:
+                        entry.client.close()
+                    except Exception:
+                        pass
+                    entry.client = None
+
+    def stats(self):
+        """Devuelve los contadores del pool"""
+        with self._lock:
+            open_connections = sum(1 for e in self._entries.values() if e.client is not None)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reconnects": self.reconnects,
+            "connect_failures": self.connect_failures,
+            "open_connections": open_connections,
+        }
+
+
+# Pool compartido por la GUI, el monitor y el buscador de esclavos
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """Devuelve el pool de conexiones compartido del proceso"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ConnectionPool()
+        return _default_pool
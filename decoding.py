@@ -0,0 +1,177 @@
+"""Decodificación de registros Modbus a valores tipados.
+
+Un ``RegisterFormat`` describe cómo se interpreta un valor: tipo de dato
+(int16/uint16/int32/uint32/float32/float64 o un campo de bits), orden de las
+palabras y de los bytes dentro de cada palabra, escala y desplazamiento.
+Los bloques de registros se convierten de una vez: los registros se pasan a
+bytes con ``array`` (intercambiando bytes y palabras con operaciones sobre
+el array completo) y se desempaquetan con una única llamada a ``struct``,
+sin bucles de Python por registro.
+
+Órdenes habituales (notación de los fabricantes para un valor de 32 bits):
+    ABCD  palabra alta primero, byte alto primero (big endian, el de la especificación)
+    CDAB  palabra baja primero, byte alto primero (word swap)
+    BADC  palabra alta primero, byte bajo primero (byte swap)
+    DCBA  palabra baja primero, byte bajo primero (little endian)
+"""
+import sys
+import struct
+from array import array
+
+# Código de struct y registros de cada tipo de dato
+DATATYPES = {
+    "uint16": ("H", 1),
+    "int16": ("h", 1),
+    "uint32": ("I", 2),
+    "int32": ("i", 2),
+    "float32": ("f", 2),
+    "float64": ("d", 4),
+}
+
+# Registros que ocupa cada tipo de dato ("bit" es un campo de bits de un registro)
+DATATYPE_WORDS = {name: words for name, (_, words) in DATATYPES.items()}
+DATATYPE_WORDS["bit"] = 1
+
+BIG = "big"
+LITTLE = "little"
+
+BYTE_ORDERS = {
+    "ABCD": (BIG, BIG),
+    "CDAB": (LITTLE, BIG),
+    "BADC": (BIG, LITTLE),
+    "DCBA": (LITTLE, LITTLE),
+}
+
+_HOST_LITTLE = sys.byteorder == "little"
+
+
+def parse_order(order):
+    """Convierte "ABCD"/"CDAB"/"BADC"/"DCBA" en (orden de palabras, orden de bytes)"""
+    try:
+        return BYTE_ORDERS[order.upper()]
+    except KeyError:
+        raise ValueError(f"Orden de bytes no válido: {order}")
+
+
+def registers_to_bytes(registers, words=1, word_order=BIG, byte_order=BIG):
+    """Convierte registros en bytes big endian según el orden de palabras y bytes del equipo.
+
+    Los registros sobrantes que no completan un valor de ``words`` palabras
+    se descartan.
+    """
+    data = registers if isinstance(registers, array) else array('H', registers)
+    usable = len(data) - len(data) % words
+    if usable != len(data):
+        data = data[:usable]
+    if word_order == LITTLE and words > 1:
+        # Invertir el orden de las palabras de cada valor con asignaciones por rebanadas
+        swapped = array('H', bytes(2 * usable))
+        for k in range(words):
+            swapped[k::words] = data[words - 1 - k::words]
+        data = swapped
+    elif data is registers:
+        data = array('H', data)
+    # En memoria los registros quedan en el orden del procesador; big endian
+    # en el cable equivale a intercambiar bytes en un procesador little endian
+    if (byte_order == BIG) == _HOST_LITTLE:
+        data.byteswap()
+    return data.tobytes()
+
+
+class RegisterFormat:
+    """Interpretación de uno o varios registros consecutivos.
+
+    Args:
+        datatype (str): Tipo de dato (ver ``DATATYPE_WORDS``)
+        scale (float): Factor de escala
+        offset (float): Desplazamiento sumado después de escalar
+        word_order (str): Orden de las palabras ('big' = palabra alta primero)
+        byte_order (str): Orden de los bytes de cada palabra ('big' = byte alto primero)
+        bit (int): Primer bit del campo (solo para ``datatype="bit"``)
+        bits (int): Anchura del campo de bits
+    """
+
+    def __init__(self, datatype="uint16", scale=1.0, offset=0.0, word_order=BIG, byte_order=BIG,
+                 bit=0, bits=1):
+        if datatype not in DATATYPE_WORDS:
+            raise ValueError(f"Tipo de dato no válido: {datatype}")
+        if word_order not in (BIG, LITTLE) or byte_order not in (BIG, LITTLE):
+            raise ValueError(f"Orden no válido: {word_order}/{byte_order}")
+        if datatype == "bit" and not (0 <= bit and bits >= 1 and bit + bits <= 16):
+            raise ValueError(f"Campo de bits no válido: bit {bit}, {bits} bits")
+        self.datatype = datatype
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.word_order = word_order
+        self.byte_order = byte_order
+        self.bit = bit
+        self.bits = bits
+        self._structs = {}
+
+    @classmethod
+    def from_order(cls, datatype="uint16", order="ABCD", **kwargs):
+        """Crea el formato a partir de la notación ABCD/CDAB/BADC/DCBA"""
+        word_order, byte_order = parse_order(order)
+        return cls(datatype, word_order=word_order, byte_order=byte_order, **kwargs)
+
+    @property
+    def words(self):
+        return DATATYPE_WORDS[self.datatype]
+
+    def _struct(self, count):
+        unpacker = self._structs.get(count)
+        if unpacker is None:
+            unpacker = struct.Struct(f">{count}{DATATYPES[self.datatype][0]}")
+            if len(self._structs) < 64:
+                self._structs[count] = unpacker
+        return unpacker
+
+    def _apply_scale(self, values):
+        if self.scale == 1.0 and self.offset == 0.0:
+            return list(values)
+        scale, offset = self.scale, self.offset
+        return [v * scale + offset for v in values]
+
+    def decode_array(self, registers):
+        """Decodifica un bloque de registros consecutivos en una lista de valores"""
+        if self.datatype == "bit":
+            mask = (1 << self.bits) - 1
+            shift = self.bit
+            data = registers
+            if self.byte_order == LITTLE:
+                data = array('H', registers)
+                data.byteswap()
+            return self._apply_scale([(r >> shift) & mask for r in data])
+        words = self.words
+        count = len(registers) // words
+        if not count:
+            return []
+        data = registers_to_bytes(registers, words, self.word_order, self.byte_order)
+        return self._apply_scale(self._struct(count).unpack(data))
+
+    def decode(self, registers):
+        """Decodifica un único valor a partir de sus registros"""
+        values = self.decode_array(registers[:self.words])
+        if not values:
+            raise ValueError(f"Se necesitan {self.words} registros para {self.datatype}")
+        return values[0]
+
+    def __repr__(self):
+        return (f"RegisterFormat({self.datatype!r}, scale={self.scale}, offset={self.offset}, "
+                f"word_order={self.word_order!r}, byte_order={self.byte_order!r})")
+
+
+def format_scaled(value, scale):
+    """Formatea un valor escalado con los decimales que implica la escala"""
+    if scale == 1:
+        return f"{value}"
+    elif scale == 0.1:
+        return f"{value:.1f}"
+    elif scale == 0.01:
+        return f"{value:.2f}"
+    return f"{value:.3f}"
+
+
+def format_array(values, scale):
+    """Formatea una lista de valores escalados"""
+    return [format_scaled(value, scale) for value in values]
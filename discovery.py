@@ -0,0 +1,384 @@
+"""Búsqueda de esclavos en varios buses a la vez.
+
+Cada bus físico (un puerto serie, una pasarela Modbus TCP o un equipo
+simulado) tiene su propio trabajador que recorre los IDs de esclavo uno
+detrás de otro, porque un bus RS-485 no admite dos transacciones a la vez.
+Los buses distintos sí se sondean en paralelo, de modo que una búsqueda en
+toda la instalación tarda lo que el bus más lento y no la suma de todos.
+Los resultados de todos los buses se reúnen en un único inventario.
+
+En modo de dos fases, un primer barrido usa un timeout calculado a partir
+del baudrate (lo justo para una petición y su respuesta) y una segunda
+fase vuelve a sondear, con un timeout más largo y varios códigos de
+función, los IDs que respondieron o que dejaron tráfico incompleto. Cada
+ID confirmado lleva un porcentaje de confianza.
+"""
+import time
+import threading
+import logging
+from bus_arbiter import PRIORITY_POLL
+from async_transport import open_bus, run_coroutine, BACKEND_THREADS, BACKEND_ASYNCIO
+from timing import sweep_timeout
+
+log = logging.getLogger(__name__)
+
+STATUS_ACTIVE = "Activo"
+STATUS_DOUBTFUL = "Dudoso"
+
+# Clasificación de una sonda
+PROBE_OK = "ok"                # Respuesta correcta
+PROBE_EXCEPTION = "exception"  # Respuesta de excepción: hay un equipo con ese ID
+PROBE_GARBLED = "garbled"      # Llegaron bytes pero la trama no era válida
+PROBE_SILENT = "silent"        # Nada en el bus
+
+# Fases de la búsqueda
+PHASE_SWEEP = "sweep"
+PHASE_CONFIRM = "confirm"
+
+# Códigos de función usados para confirmar un candidato
+CONFIRM_TABLES = ("holding", "input", "coil", "discrete_input")
+CONFIRM_TIMEOUT = 0.5
+
+# Textos de pymodbus que indican que llegó algo que no se pudo decodificar
+_GARBLED_MARKERS = ("Incomplete message", "CRC", "Invalid Message", "unpack")
+
+
+def _classify_error_text(text):
+    if any(marker in text for marker in _GARBLED_MARKERS):
+        return PROBE_GARBLED
+    return PROBE_SILENT
+
+
+def classify_probe(response=None, error=None):
+    """Clasifica el resultado de una sonda como ok, excepción, tráfico incompleto o silencio"""
+    from pymodbus.exceptions import ModbusIOException, ModbusException
+    if error is not None:
+        if isinstance(error, ModbusException):
+            return _classify_error_text(str(error))
+        return PROBE_SILENT
+    if not hasattr(response, 'isError') or not response.isError():
+        return PROBE_OK
+    if isinstance(response, ModbusIOException):
+        return _classify_error_text(str(response))
+    if getattr(response, 'exception_code', None) is not None:
+        return PROBE_EXCEPTION
+    return PROBE_SILENT
+
+
+def parse_bus_list(text, baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=0.1):
+    """Convierte "COM3, COM4@19200, tcp://192.168.1.10:502, rtu+tcp://10.0.0.6" en una lista de configuraciones.
+
+    Cada entrada es un puerto con un baudrate opcional tras ``@``; el resto
+    de parámetros se toman de los valores indicados. Un puerto repetido se
+    sondea una sola vez.
+    """
+    buses = []
+    seen = set()
+    for part in text.replace(";", ",").replace("\n", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        port, _, baud = part.partition("@")
+        port = port.strip()
+        if port in seen:
+            continue
+        seen.add(port)
+        buses.append({
+            "port": port,
+            "baudrate": int(baud) if baud else baudrate,
+            "parity": parity,
+            "stopbits": stopbits,
+            "bytesize": bytesize,
+            "timeout": timeout,
+        })
+    if not buses:
+        raise ValueError("No se indicó ningún puerto")
+    return buses
+
+
+class DiscoveryResult:
+    """Esclavo encontrado en un bus"""
+
+    __slots__ = ("port", "slave", "response_time", "value", "status", "confidence", "functions")
+
+    def __init__(self, port, slave, response_time, value, status, confidence=None, functions=None):
+        self.port = port
+        self.slave = slave
+        self.response_time = response_time
+        self.value = value
+        self.status = status
+        self.confidence = confidence  # 0..1 en modo de dos fases
+        self.functions = functions or []  # Tablas que respondieron en la confirmación
+
+    @property
+    def ok(self):
+        return self.status == STATUS_ACTIVE
+
+    def row(self):
+        """Valores de la fila del inventario"""
+        confidence = "" if self.confidence is None else f"{self.confidence * 100:.0f}%"
+        return (self.port, self.slave, f"{self.response_time:.1f}", self.value, self.status, confidence)
+
+
+class DiscoveryEngine:
+    """Sondea los IDs de esclavo en varios buses en paralelo (un trabajador por bus).
+
+    Con ``two_phase=True`` el barrido usa el timeout mínimo calculado para
+    la línea y los candidatos se confirman con ``confirm_timeout`` y con los
+    códigos de función de ``CONFIRM_TABLES``.
+
+    Los callbacks se llaman desde los trabajadores (hilos o el bucle asyncio):
+        on_result(DiscoveryResult): esclavo que respondió (bien o con excepción)
+        on_progress(sondeados, encontrados): avance global del barrido
+        on_status(mensaje): errores de conexión y avisos de cada bus
+        on_done(stats): todos los buses terminaron
+    """
+
+    def __init__(self, buses, slave_ids, table="holding", register=0, backend=BACKEND_THREADS,
+                 pool=None, probe_interval=0.0, two_phase=False, confirm_timeout=CONFIRM_TIMEOUT,
+                 on_result=None, on_progress=None, on_status=None, on_done=None):
+        self.buses = list(buses)
+        self.slave_ids = list(slave_ids)
+        self.table = table
+        self.register = register
+        self.backend = backend
+        self.pool = pool
+        self.probe_interval = probe_interval
+        self.two_phase = two_phase
+        self.confirm_timeout = confirm_timeout
+        self.on_result = on_result
+        self.on_progress = on_progress
+        self.on_status = on_status
+        self.on_done = on_done
+
+        self.results = []
+        self.running = False
+        self.probed = 0
+        self.found = 0
+        self.bus_stats = {}
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._workers = []
+
+    @property
+    def total(self):
+        """Número de sondas del barrido (IDs × buses)"""
+        return len(self.slave_ids) * len(self.buses)
+
+    def _phase_handles(self, settings):
+        """Accesos al bus para cada fase (mismo puerto, distinto timeout)"""
+        if not self.two_phase:
+            bus = open_bus(self.backend, pool=self.pool, **settings)
+            return {PHASE_SWEEP: bus, PHASE_CONFIRM: bus}
+        fast = dict(settings, timeout=sweep_timeout(settings["port"], settings["baudrate"], settings["parity"],
+                                                    settings["stopbits"], settings["bytesize"], self.table))
+        slow = dict(settings, timeout=max(settings["timeout"], self.confirm_timeout))
+        return {
+            PHASE_SWEEP: open_bus(self.backend, pool=self.pool, **fast),
+            PHASE_CONFIRM: open_bus(self.backend, pool=self.pool, **slow),
+        }
+
+    def start(self):
+        """Arranca un trabajador por bus"""
+        self.running = True
+        self.started = time.monotonic()
+        self._remaining = len(self.buses)
+        for settings in self.buses:
+            port = settings["port"]
+            handles = self._phase_handles(settings)
+            self.bus_stats[port] = {
+                "probed": 0, "found": 0, "candidates": 0, "elapsed": 0.0, "error": None,
+                "sweep_timeout": handles[PHASE_SWEEP].settings["timeout"],
+            }
+            if self.backend == BACKEND_ASYNCIO:
+                self._workers.append(run_coroutine(self._run_bus_async(port, handles)))
+            else:
+                worker = threading.Thread(target=self._run_bus, args=(port, handles), name=f"discovery-{port}")
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self):
+        """Detiene todos los trabajadores antes de la siguiente sonda"""
+        self.running = False
+
+    def wait(self, timeout=None):
+        """Espera a que terminen todos los trabajadores"""
+        for worker in self._workers:
+            if isinstance(worker, threading.Thread):
+                worker.join(timeout)
+            else:
+                try:
+                    worker.result(timeout)
+                except Exception:
+                    pass
+
+    def _value(self, response, table):
+        if table in ("holding", "input"):
+            return response.registers[0] if response.registers else "N/A"
+        return response.bits[0] if response.bits else "N/A"
+
+    def _report(self, result):
+        with self._lock:
+            self.results.append(result)
+            if result.ok:
+                self.found += 1
+                self.bus_stats[result.port]["found"] += 1
+        if self.on_result:
+            self.on_result(result)
+
+    def _probed(self, port):
+        with self._lock:
+            self.probed += 1
+            self.bus_stats[port]["probed"] += 1
+            probed, found = self.probed, self.found
+        if self.on_progress:
+            self.on_progress(probed, found)
+
+    def _search(self, port):
+        """Lógica de búsqueda de un bus, independiente del transporte.
+
+        Genera sondas (fase, tabla, esclavo) y recibe por ``send`` la
+        tupla (clasificación, respuesta, tiempo en ms) de cada una.
+        """
+        candidates = []
+        for slave_id in self.slave_ids:
+            if not self.running:
+                return
+            outcome, response, response_time = yield PHASE_SWEEP, self.table, slave_id
+            self._probed(port)
+            if self.two_phase:
+                if outcome != PROBE_SILENT:
+                    candidates.append((slave_id, outcome, response, response_time))
+            elif outcome == PROBE_OK:
+                self._report(DiscoveryResult(port, slave_id, response_time,
+                                             self._value(response, self.table), STATUS_ACTIVE))
+            elif outcome == PROBE_EXCEPTION:
+                # Una respuesta de excepción también indica que hay un equipo con ese ID
+                self._report(DiscoveryResult(port, slave_id, response_time, "N/A", f"Error: {response}"))
+
+        if not self.two_phase or not candidates:
+            return
+        self.bus_stats[port]["candidates"] = len(candidates)
+        if self.on_status:
+            self.on_status(f"{port}: confirmando {len(candidates)} candidatos")
+
+        # Fase 2: timeout largo y varios códigos de función por candidato
+        for slave_id, first, response, response_time in candidates:
+            evidence = {PROBE_OK: 1.0, PROBE_EXCEPTION: 1.0, PROBE_GARBLED: 0.5}[first]
+            value = self._value(response, self.table) if first == PROBE_OK else "N/A"
+            status = STATUS_ACTIVE if first == PROBE_OK else None
+            last_exception = response if first == PROBE_EXCEPTION else None
+            functions = []
+            for table in CONFIRM_TABLES:
+                if not self.running:
+                    return
+                outcome, confirm_response, confirm_time = yield PHASE_CONFIRM, table, slave_id
+                if outcome in (PROBE_OK, PROBE_EXCEPTION):
+                    evidence += 1.0
+                    functions.append(table)
+                    if response_time <= 0:
+                        response_time = confirm_time
+                if outcome == PROBE_OK:
+                    status = STATUS_ACTIVE
+                    if table == self.table and value == "N/A":
+                        value = self._value(confirm_response, table)
+                elif outcome == PROBE_EXCEPTION:
+                    last_exception = confirm_response
+            if status is None:
+                status = f"Error: {last_exception}" if last_exception is not None else STATUS_DOUBTFUL
+            confidence = evidence / (1 + len(CONFIRM_TABLES))
+            self._report(DiscoveryResult(port, slave_id, response_time, value, status, confidence, functions))
+
+    def _connection_failed(self, port):
+        message = f"No se pudo conectar al puerto {port}"
+        self.bus_stats[port]["error"] = message
+        if self.on_status:
+            self.on_status(message)
+
+    def _bus_finished(self, port, started):
+        with self._lock:
+            self.bus_stats[port]["elapsed"] = time.monotonic() - started
+            self._remaining -= 1
+            done = self._remaining == 0
+        if done:
+            self.finished = time.monotonic()
+            self.running = False
+            if self.on_done:
+                self.on_done(self.stats())
+
+    def _run_bus(self, port, handles):
+        """Trabajador de un bus (hilo): ejecuta las sondas de ``_search`` de una en una"""
+        started = time.monotonic()
+        try:
+            if not handles[PHASE_SWEEP].connect().result():
+                self._connection_failed(port)
+                return
+            plan = self._search(port)
+            probe = next(plan)
+            while True:
+                phase, table, slave_id = probe
+                try:
+                    # El tiempo de respuesta se mide en el bus, sin la espera en cola
+                    response, response_time = handles[phase].timed_read(
+                        table, self.register, 1, slave_id, priority=PRIORITY_POLL).result()
+                    outcome = classify_probe(response)
+                except Exception as e:
+                    # Timeouts esperados para IDs no existentes
+                    response, response_time = e, 0.0
+                    outcome = classify_probe(error=e)
+
+                # El árbitro ya deja el silencio t3.5 entre sondas; la pausa es opcional
+                if self.probe_interval:
+                    time.sleep(self.probe_interval)
+                probe = plan.send((outcome, response, response_time))
+        except StopIteration:
+            pass
+        except Exception as e:
+            log.debug("Error en la búsqueda en %s: %s", port, e)
+        finally:
+            self._bus_finished(port, started)
+
+    async def _run_bus_async(self, port, handles):
+        """Trabajador de un bus (corrutina del bucle asyncio)"""
+        import asyncio
+        started = time.monotonic()
+        try:
+            if not await asyncio.wrap_future(handles[PHASE_SWEEP].connect()):
+                self._connection_failed(port)
+                return
+            plan = self._search(port)
+            probe = next(plan)
+            while True:
+                phase, table, slave_id = probe
+                try:
+                    response, response_time = await handles[phase].atimed_read(
+                        table, self.register, 1, slave_id, priority=PRIORITY_POLL)
+                    outcome = classify_probe(response)
+                except Exception as e:
+                    response, response_time = e, 0.0
+                    outcome = classify_probe(error=e)
+                if self.probe_interval:
+                    await asyncio.sleep(self.probe_interval)
+                probe = plan.send((outcome, response, response_time))
+        except StopIteration:
+            pass
+        except Exception as e:
+            log.debug("Error en la búsqueda en %s: %s", port, e)
+        finally:
+            self._bus_finished(port, started)
+
+    def stats(self):
+        """Devuelve el avance global y por bus"""
+        end = self.finished or time.monotonic()
+        with self._lock:
+            return {
+                "buses": len(self.buses),
+                "probed": self.probed,
+                "total": self.total,
+                "found": self.found,
+                "elapsed": (end - self.started) if self.started else 0.0,
+                "per_bus": {port: dict(stats) for port, stats in self.bus_stats.items()},
+            }
@@ -0,0 +1,378 @@
+"""Política de fallos del bus: reintentos con espera exponencial y circuito por esclavo.
+
+Un esclavo apagado cuesta un timeout completo en cada ciclo de sondeo, y en
+un bus half-duplex ese tiempo lo pierden todos los demás tags del puerto.
+Cada lectura y escritura de los accesos al bus (``BusHandle`` y
+``AsyncBusHandle``) pasa por ``FaultPolicy.submit``:
+
+    - Un timeout o una trama ilegible se repite hasta ``retries`` veces,
+      con una espera de ``backoff`` s que se duplica en cada intento (hasta
+      ``backoff_max``). Las respuestas de excepción no se repiten: el equipo
+      contestó. La espera no ocupa el bus: cada intento es un trabajo
+      distinto de la cola y el reintento se vuelve a encolar cuando vence,
+      así que entre tanto el bus atiende a los demás esclavos.
+    - Tras ``failure_threshold`` transacciones fallidas seguidas el circuito
+      del esclavo se abre: sus peticiones fallan al instante, sin ocupar el
+      bus, y solo cada ``probe_interval`` s se deja pasar una petición de
+      prueba. Si la prueba falla el intervalo se duplica (hasta
+      ``probe_interval_max``); si responde, el circuito se cierra.
+
+Las sondas de ``timed_read`` (búsqueda de esclavos y autodetección) son
+medidas explícitas: salen siempre al bus y una sola vez, para medir cada ID
+exactamente una vez, pero su resultado actualiza el circuito del esclavo si
+ya existe (una respuesta lo cierra, un timeout cuenta como fallo). No crean
+circuitos para los IDs que nadie sondea. Los reintentos se anotan en las
+métricas (``metrics``) y ``FaultPolicy.stats`` da el estado de cada circuito
+y el tiempo perdido en timeouts.
+"""
+import time
+import logging
+import threading
+from concurrent.futures import Future, InvalidStateError
+from metrics import get_metrics, classify_outcome, OUTCOME_TIMEOUT, OUTCOME_CRC, OUTCOME_ERROR
+
+log = logging.getLogger(__name__)
+
+# Estados del circuito de un esclavo
+STATE_CLOSED = "closed"        # Funciona: las peticiones pasan
+STATE_OPEN = "open"            # Sin respuesta: las peticiones fallan al instante
+STATE_HALF_OPEN = "half_open"  # Hay una petición de prueba en curso
+
+STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+STATE_NAMES = {STATE_CLOSED: "Cerrado", STATE_HALF_OPEN: "Probando", STATE_OPEN: "Abierto"}
+
+# Resultados que cuentan como fallo del esclavo (los errores del puerto no son culpa suya)
+FAILURE_OUTCOMES = (OUTCOME_TIMEOUT, OUTCOME_CRC)
+
+READ_FUNCTIONS = {"coil": 1, "discrete_input": 2, "holding": 3, "input": 4}
+WRITE_FUNCTIONS = {"coil": 5, "holding": 6}
+
+
+def line_key(settings):
+    """Puerto y parámetros de línea: el mismo ID con otro baudrate es otro circuito"""
+    return (str(settings["port"]), settings.get("baudrate"), settings.get("parity"),
+            settings.get("stopbits"), settings.get("bytesize"))
+
+
+def _slave_unavailable(port, slave, retry_in):
+    """Excepción equivalente a un timeout, sin haber ocupado el bus"""
+    from pymodbus.exceptions import ModbusIOException
+    return ModbusIOException(f"Esclavo {slave} en {port} sin respuesta: circuito abierto, "
+                             f"próxima prueba en {retry_in:.1f} s")
+
+
+class CircuitBreaker:
+    """Estado de fallos de un esclavo en una línea"""
+
+    def __init__(self, key, slave, probe_interval):
+        self.port = key[0]
+        self.key = key
+        self.slave = slave
+        self.state = STATE_CLOSED
+        self.failures = 0          # Fallos seguidos
+        self.interval = probe_interval
+        self.next_probe = 0.0
+        self.trips = 0             # Veces que se abrió el circuito
+        self.rejected = 0          # Peticiones que fallaron sin ocupar el bus
+        self.retries = 0
+        self.timeout_time = 0.0    # Tiempo de bus perdido en timeouts y tramas ilegibles
+        self.busy_time = 0.0
+
+    def row(self, now=None):
+        now = time.monotonic() if now is None else now
+        return {
+            "port": self.port,
+            "slave": self.slave,
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "timeout_s": self.timeout_time,
+            "busy_s": self.busy_time,
+            "next_probe_s": max(0.0, self.next_probe - now) if self.state == STATE_OPEN else 0.0,
+        }
+
+
+class FaultPolicy:
+    """Reintentos acotados y circuito por esclavo para las transacciones del bus.
+
+    Args:
+        retries (int): Repeticiones de una transacción sin respuesta (0 = ninguna)
+        backoff (float): Espera antes del primer reintento (s); se duplica en cada intento
+        backoff_max (float): Espera máxima entre reintentos (s)
+        failure_threshold (int): Fallos seguidos que abren el circuito (0 = sin circuito)
+        probe_interval (float): Espera inicial entre peticiones de prueba con el circuito abierto (s)
+        probe_interval_max (float): Espera máxima entre peticiones de prueba (s)
+        registry (MetricsRegistry): Dónde anotar los reintentos
+    """
+
+    def __init__(self, retries=1, backoff=0.05, backoff_max=1.0, failure_threshold=3,
+                 probe_interval=5.0, probe_interval_max=60.0, registry=None):
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe_interval_max = probe_interval_max
+        self.registry = registry or get_metrics()
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def backoff_delay(self, attempt):
+        """Espera antes del reintento número ``attempt`` (1, 2...)"""
+        return min(self.backoff * (2 ** (attempt - 1)), self.backoff_max)
+
+    def breaker(self, settings, slave, create=True):
+        key = line_key(settings)
+        with self._lock:
+            breaker = self._breakers.get((key, slave))
+            if breaker is None and create:
+                breaker = CircuitBreaker(key, slave, self.probe_interval)
+                self._breakers[(key, slave)] = breaker
+            return breaker
+
+    def _admit(self, breaker):
+        """Decide si la petición sale al bus. Devuelve True si es la petición de prueba"""
+        if not self.failure_threshold:
+            return False
+        with self._lock:
+            if breaker.state == STATE_CLOSED:
+                return False
+            now = time.monotonic()
+            if breaker.state == STATE_OPEN and now >= breaker.next_probe:
+                breaker.state = STATE_HALF_OPEN
+                return True
+            breaker.rejected += 1
+            retry_in = max(0.0, breaker.next_probe - now)
+        raise _slave_unavailable(breaker.port, breaker.slave, retry_in)
+
+    def _admit_measurement(self, breaker):
+        """Una medida explícita siempre sale al bus; con el circuito abierto hace de prueba"""
+        if breaker is None or not self.failure_threshold:
+            return False
+        with self._lock:
+            if breaker.state == STATE_OPEN:
+                breaker.state = STATE_HALF_OPEN
+                return True
+            return False
+
+    def _attempt_done(self, breaker, outcome, elapsed):
+        if breaker is None:
+            return
+        with self._lock:
+            breaker.busy_time += elapsed
+            if outcome in FAILURE_OUTCOMES:
+                breaker.timeout_time += elapsed
+
+    def _retry_delay(self, breaker, function_code, outcome, attempt, probe, retries):
+        """Espera antes de repetir el intento ``attempt``, o None si no se repite"""
+        # La petición de prueba no se repite: con una basta para saber si el esclavo volvió
+        if outcome not in FAILURE_OUTCOMES or probe or attempt > retries:
+            return None
+        with self._lock:
+            breaker.retries += 1
+        self.registry.record_retry(breaker.port, breaker.slave, function_code)
+        return self.backoff_delay(attempt)
+
+    def _finish(self, breaker, outcome):
+        """Actualiza el circuito con el resultado final de la transacción"""
+        if breaker is None or not self.failure_threshold:
+            return
+        with self._lock:
+            if outcome == OUTCOME_ERROR:
+                # Puerto caído: no dice nada del esclavo; la prueba se repetirá más tarde
+                if breaker.state == STATE_HALF_OPEN:
+                    breaker.state = STATE_OPEN
+                    breaker.next_probe = time.monotonic() + breaker.interval
+                return
+            if outcome not in FAILURE_OUTCOMES:
+                if breaker.state != STATE_CLOSED:
+                    log.info("Esclavo %s en %s responde de nuevo: circuito cerrado", breaker.slave, breaker.port)
+                breaker.state = STATE_CLOSED
+                breaker.failures = 0
+                breaker.interval = self.probe_interval
+                return
+            breaker.failures += 1
+            if breaker.state == STATE_HALF_OPEN:
+                breaker.interval = min(breaker.interval * 2, self.probe_interval_max)
+            elif breaker.failures < self.failure_threshold:
+                return
+            else:
+                breaker.trips += 1
+                log.warning("Esclavo %s en %s sin respuesta en %s peticiones: se probará cada %g s",
+                            breaker.slave, breaker.port, breaker.failures, breaker.interval)
+            breaker.state = STATE_OPEN
+            breaker.next_probe = time.monotonic() + breaker.interval
+
+    def submit(self, submit, settings, slave, function_code, transaction, priority,
+               asynchronous=False, measurement=False):
+        """Envía una transacción al bus aplicando la política y devuelve un Future.
+
+        Args:
+            submit: ``submit(fn, priority)`` del acceso al bus; encola ``fn(client)``
+            transaction: ``transaction(client)`` hace un intento (una corrutina si ``asynchronous``)
+            measurement (bool): Medida explícita (``timed_read``): sin reintentos, sin
+                rechazo por circuito abierto y el Future devuelve (respuesta, ms)
+
+        Cada intento es un trabajo distinto de la cola del bus. Las esperas entre
+        reintentos corren en un temporizador, fuera del hilo o la tarea del bus.
+        """
+        if measurement:
+            breaker = self.breaker(settings, slave, create=False)
+            probe = self._admit_measurement(breaker)
+        else:
+            breaker = self.breaker(settings, slave)
+            try:
+                probe = self._admit(breaker)
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+                return future
+        call = _Call(self, submit, transaction, priority, breaker, probe, function_code,
+                     0 if measurement else self.retries, asynchronous, measurement)
+        call.send()
+        return call.future
+
+    def execute(self, settings, slave, function_code, transaction):
+        """Ejecuta ``transaction()`` (una transacción síncrona) aplicando la política.
+
+        Las esperas entre reintentos bloquean al llamador: es para código que
+        tiene su propio cliente, nunca para trabajos del hilo de un bus (que
+        usan ``submit``).
+        """
+        breaker = self.breaker(settings, slave)
+        probe = self._admit(breaker)
+        attempt = 0
+        while True:
+            attempt += 1
+            start = time.perf_counter()
+            response = error = None
+            try:
+                response = transaction()
+            except Exception as e:
+                error = e
+            outcome, _ = classify_outcome(response, error)
+            self._attempt_done(breaker, outcome, time.perf_counter() - start)
+            delay = self._retry_delay(breaker, function_code, outcome, attempt, probe, self.retries)
+            if delay is None:
+                break
+            time.sleep(delay)
+        self._finish(breaker, outcome)
+        if error is not None:
+            raise error
+        return response
+
+    def state_of(self, port, slave):
+        """Peor estado del circuito de un esclavo en cualquier configuración del puerto"""
+        port = str(port)
+        with self._lock:
+            states = [b.state for (key, s), b in self._breakers.items() if key[0] == port and s == slave]
+        return max(states, key=STATE_VALUES.get, default=STATE_CLOSED)
+
+    def reset(self):
+        with self._lock:
+            self._breakers.clear()
+
+    def stats(self):
+        """Estado de cada circuito, de más a menos tiempo perdido en timeouts"""
+        now = time.monotonic()
+        with self._lock:
+            rows = [breaker.row(now) for breaker in self._breakers.values()]
+        rows.sort(key=lambda row: (-row["timeout_s"], row["port"], row["slave"]))
+        return rows
+
+
+class _Call:
+    """Transacción en curso de ``FaultPolicy.submit``: sus intentos salen al bus de uno en uno"""
+
+    def __init__(self, policy, submit, transaction, priority, breaker, probe, function_code,
+                 retries, asynchronous, measurement):
+        self.policy = policy
+        self.submit = submit
+        self.transaction = transaction
+        self.priority = priority
+        self.breaker = breaker
+        self.probe = probe
+        self.function_code = function_code
+        self.retries = retries
+        self.measurement = measurement
+        self.job = self._async_job if asynchronous else self._job
+        self.future = Future()
+        self.attempt = 0
+        self.started = None
+
+    def _job(self, client):
+        self.started = time.perf_counter()
+        return self.transaction(client)
+
+    async def _async_job(self, client):
+        self.started = time.perf_counter()
+        return await self.transaction(client)
+
+    def send(self):
+        """Encola el siguiente intento (desde el llamador o desde el temporizador de espera)"""
+        if self.future.cancelled():
+            self.policy._finish(self.breaker, OUTCOME_ERROR)  # Un circuito en prueba vuelve a abierto
+            return
+        self.attempt += 1
+        self.started = None
+        try:
+            attempt = self.submit(self.job, self.priority)
+        except Exception as e:
+            self.policy._finish(self.breaker, OUTCOME_ERROR)
+            self._resolve(error=e)
+            return
+        attempt.add_done_callback(self._attempt_done)
+
+    def _attempt_done(self, attempt):
+        # Se ejecuta en el hilo (o la tarea) del bus justo al terminar el intento
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+        if attempt.cancelled():
+            # El bus se detuvo antes de ejecutar el intento
+            self.policy._finish(self.breaker, OUTCOME_ERROR)
+            self.future.cancel()
+            return
+        response = None
+        error = attempt.exception()
+        if error is None:
+            response = attempt.result()
+        outcome, _ = classify_outcome(response, error)
+        self.policy._attempt_done(self.breaker, outcome, elapsed)
+        if self.breaker is not None:
+            delay = self.policy._retry_delay(self.breaker, self.function_code, outcome,
+                                             self.attempt, self.probe, self.retries)
+            if delay is not None and not self.future.cancelled():
+                timer = threading.Timer(delay, self.send)
+                timer.daemon = True
+                timer.start()
+                return
+        self.policy._finish(self.breaker, outcome)
+        if error is not None:
+            self._resolve(error=error)
+        else:
+            self._resolve((response, elapsed * 1000) if self.measurement else response)
+
+    def _resolve(self, result=None, error=None):
+        try:
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+        except InvalidStateError:
+            pass  # El llamador canceló la transacción
+
+
+_default_policy = FaultPolicy()
+
+
+def get_fault_policy():
+    """Devuelve la política de fallos que usan los accesos al bus del proceso"""
+    return _default_policy
+
+
+def set_fault_policy(policy):
+    """Sustituye la política de fallos del proceso (por ejemplo desde la línea de comandos)"""
+    global _default_policy
+    _default_policy = policy
+    return policy
@@ -0,0 +1,316 @@
+"""Historial de comandos en un archivo de solo anexado (JSON Lines).
+
+Cada operación añade una línea al final del archivo en lugar de reescribir
+todo el historial. El fsync se hace por lotes (cada N registros o cada T
+segundos), al abrir se recorta una última línea incompleta dejada por un
+corte de luz o un cierre abrupto, y ``compact()`` reescribe el archivo de
+forma atómica cuando hace falta.
+
+Los comandos idénticos consecutivos (típicos del auto-refresh) se agrupan
+en un único registro con ``count`` y marcas de tiempo primera/última. El
+registro agrupado se añade como una línea nueva marcada con
+``REPLACES_KEY`` que sustituye a la anterior al leer; nunca se recortan
+datos ya escritos, así que un corte a mitad de escritura pierde como mucho
+la última repetición. Las líneas sustituidas y los registros más antiguos
+(por encima del máximo de entradas y de bytes) se eliminan reescribiendo el
+archivo de forma atómica.
+"""
+import json
+import os
+import time
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+# Marca de la línea que sustituye a la anterior (misma orden con el contador actualizado)
+REPLACES_KEY = "replaces_previous"
+_REPLACES_MARK = f'"{REPLACES_KEY}": true'.encode("utf-8")
+
+# Líneas sustituidas que se toleran antes de reescribir el archivo
+MIN_SUPERSEDED = 64
+
+
+class HistoryStore:
+    """Almacén de historial en formato JSON Lines"""
+
+    def __init__(self, path, fsync_every=20, fsync_interval=2.0, legacy_path=None,
+                 max_entries=5000, max_bytes=2 * 1024 * 1024, collapse_repeats=True):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.collapse_repeats = collapse_repeats
+        self.skipped_lines = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+        # Estado del final del archivo para agrupar repeticiones en O(1)
+        self._entries = 0
+        self._superseded = 0
+        self._size = 0
+        self._last_record = None
+
+        if legacy_path and not os.path.exists(path) and os.path.exists(legacy_path):
+            self._migrate_legacy(legacy_path)
+        self._recover()
+        self._scan()
+        self._file = open(self.path, 'ab')
+        if self._over_cap():
+            self._evict_oldest()
+
+    @staticmethod
+    def _same_command(a, b):
+        return (a.get("operation") == b.get("operation")
+                and a.get("parameters") == b.get("parameters")
+                and a.get("result") == b.get("result"))
+
+    @staticmethod
+    def _merge(last, record):
+        """Suma una repetición al registro anterior"""
+        merged = dict(last)
+        merged["count"] = last.get("count", 1) + record.get("count", 1)
+        merged["first_timestamp"] = last.get("first_timestamp", last.get("timestamp"))
+        merged["timestamp"] = record.get("timestamp")
+        return merged
+
+    def collapse(self, records):
+        """Agrupa los registros idénticos consecutivos de una secuencia"""
+        last = None
+        for record in records:
+            if last is not None and self.collapse_repeats and self._same_command(last, record):
+                last = self._merge(last, record)
+                continue
+            if last is not None:
+                yield last
+            last = record
+        if last is not None:
+            yield last
+
+    def _migrate_legacy(self, legacy_path):
+        """Convierte una sola vez el historial JSON antiguo (una lista) a JSON Lines"""
+        try:
+            with open(legacy_path, 'r') as f:
+                records = json.load(f)
+            records = list(self.collapse(records))
+            if self.max_entries:
+                records = records[-self.max_entries:]
+            self._write_atomic(records)
+            log.info("Historial migrado de %s a %s (%d registros)", legacy_path, self.path, len(records))
+        except Exception as e:
+            log.warning("No se pudo migrar el historial antiguo: %s", e)
+
+    def _recover(self):
+        """Recorta una última línea incompleta (escritura interrumpida)"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+
+            # Buscar hacia atrás el último salto de línea
+            pos = size
+            chunk = 4096
+            while pos > 0:
+                step = min(chunk, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step)
+                index = data.rfind(b"\n")
+                if index >= 0:
+                    f.truncate(pos + index + 1)
+                    log.warning("Historial: descartada una línea incompleta al final de %s", self.path)
+                    return
+            f.truncate(0)
+
+    def _scan(self):
+        """Cuenta las entradas y las líneas sustituidas y lee el último registro del archivo"""
+        self._entries = 0
+        self._superseded = 0
+        self._size = 0
+        self._last_record = None
+        if not os.path.exists(self.path):
+            return
+        last_line = None
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    if _REPLACES_MARK in line and last_line is not None:
+                        self._superseded += 1
+                    else:
+                        self._entries += 1
+                    last_line = line
+                self._size += len(line)
+        if last_line is not None:
+            try:
+                self._last_record = json.loads(last_line)
+                self._last_record.pop(REPLACES_KEY, None)
+            except ValueError:
+                self._last_record = None
+
+    def _over_cap(self):
+        return ((self.max_entries and self._entries > self.max_entries)
+                or (self.max_bytes and self._size > self.max_bytes))
+
+    def _needs_eviction(self):
+        # Margen del 25% para que la reescritura sea poco frecuente (coste amortizado O(1))
+        return ((self.max_entries and self._entries > self.max_entries * 1.25)
+                or (self.max_bytes and self._size > self.max_bytes * 1.25)
+                or self._superseded > max(MIN_SUPERSEDED, self._entries))
+
+    def append(self, record):
+        """Añade un registro al final del archivo (O(1)).
+
+        Devuelve (registro guardado, agrupado); ``agrupado`` es True si el
+        comando repetía el anterior y se sumó a su contador.
+        """
+        with self._lock:
+            merged = (self.collapse_repeats and self._last_record is not None
+                      and self._same_command(self._last_record, record))
+            if merged:
+                # Nueva línea con el contador actualizado que sustituye a la anterior al leer
+                record = self._merge(self._last_record, record)
+                line_record = dict(record)
+                line_record[REPLACES_KEY] = True
+                self._superseded += 1
+            else:
+                line_record = record
+                self._entries += 1
+
+            line = (json.dumps(line_record, ensure_ascii=False) + "\n").encode("utf-8")
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+            self._last_record = record
+            self._pending += 1
+            if (self._pending >= self.fsync_every
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync_locked()
+
+        if self._needs_eviction():
+            self._evict_oldest()
+        return record, merged
+
+    def _evict_oldest(self):
+        """Quita las líneas sustituidas y los registros más antiguos por encima de los límites"""
+        with self._lock:
+            self._file.flush()
+            records = list(self._read_records())
+            lines = [(json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8") for record in records]
+            drop = max(0, len(lines) - self.max_entries) if self.max_entries else 0
+            if self.max_bytes:
+                total = sum(len(line) for line in lines[drop:])
+                while drop < len(lines) and total > self.max_bytes:
+                    total -= len(lines[drop])
+                    drop += 1
+            self._file.close()
+            try:
+                self._write_lines(lines[drop:])
+            finally:
+                self._file = open(self.path, 'ab')
+                self._pending = 0
+                self._last_sync = time.monotonic()
+            self.evicted += drop
+        self._scan()
+        log.debug("Historial: %d registros antiguos descartados", drop)
+
+    def _sync_locked(self):
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        """Fuerza a disco los registros pendientes"""
+        with self._lock:
+            if self._pending:
+                self._file.flush()
+                self._sync_locked()
+
+    def _read_records(self):
+        """Recorre los registros del archivo aplicando las líneas que sustituyen a la anterior"""
+        self.skipped_lines = 0
+        if not os.path.exists(self.path):
+            return
+        last = None
+        with open(self.path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    self.skipped_lines += 1
+                    continue
+                if record.pop(REPLACES_KEY, False) and last is not None:
+                    last = record
+                    continue
+                if last is not None:
+                    yield last
+                last = record
+        if last is not None:
+            yield last
+
+    def load(self):
+        """Recorre los registros guardados línea a línea sin cargar el archivo entero"""
+        with self._lock:
+            self._file.flush()
+        yield from self._read_records()
+
+    def _write_lines(self, lines):
+        """Escribe las líneas en un archivo temporal y lo sustituye atómicamente"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            for line in lines:
+                f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _write_atomic(self, records):
+        """Escribe los registros en un archivo temporal y lo sustituye atómicamente"""
+        self._write_lines((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                          for record in records)
+
+    def compact(self, records):
+        """Reescribe el archivo solo con los registros indicados (agrupando repeticiones)"""
+        records = list(self.collapse(records))
+        if self.max_entries:
+            records = records[-self.max_entries:]
+        with self._lock:
+            self._file.close()
+            try:
+                self._write_atomic(records)
+            finally:
+                self._file = open(self.path, 'ab')
+                self._pending = 0
+                self._last_sync = time.monotonic()
+        self._scan()
+        self.skipped_lines = 0
+
+    def clear(self):
+        """Borra todo el historial"""
+        self.compact([])
+
+    def size(self):
+        """Tamaño actual del archivo en bytes"""
+        return self._size
+
+    def __len__(self):
+        """Número de entradas (ya agrupadas) en el archivo"""
+        return self._entries
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
@@ -0,0 +1,263 @@
+"""Equipo Modbus simulado en memoria para probar las herramientas sin hardware.
+
+Un puerto con el prefijo ``loop://`` (por ejemplo ``loop://demo``) no abre
+ningún puerto serie: las peticiones se responden desde un mapa de registros
+en memoria compartido por todos los clientes con el mismo nombre. Hay un
+cliente síncrono (para el pool de conexiones) y otro asíncrono (para el
+transporte asyncio) con la misma interfaz que los de pymodbus.
+"""
+import time
+import math
+import threading
+
+LOOPBACK_PREFIX = "loop://"
+
+# Códigos de excepción Modbus
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+
+_FUNCTION_CODES = {
+    "holding": 3,
+    "input": 4,
+    "coil": 1,
+    "discrete_input": 2,
+}
+
+
+def is_loopback(port):
+    return str(port).startswith(LOOPBACK_PREFIX)
+
+
+class LoopbackResponse:
+    """Respuesta correcta con la misma forma que las de pymodbus"""
+
+    def __init__(self, function_code, registers=None, bits=None, address=None, value=None):
+        self.function_code = function_code
+        self.registers = registers or []
+        self.bits = bits or []
+        self.address = address
+        self.value = value
+
+    def isError(self):
+        return False
+
+    def __str__(self):
+        if self.address is not None:
+            return f"LoopbackResponse(fc={self.function_code}, address={self.address}, value={self.value})"
+        if self.registers:
+            return f"LoopbackResponse(fc={self.function_code}, registers={self.registers})"
+        return f"LoopbackResponse(fc={self.function_code}, bits={self.bits})"
+
+
+class LoopbackExceptionResponse:
+    """Respuesta de excepción Modbus (dirección o función ilegal)"""
+
+    def __init__(self, function_code, exception_code):
+        self.function_code = function_code | 0x80
+        self.exception_code = exception_code
+
+    def isError(self):
+        return True
+
+    def __str__(self):
+        return f"Exception Response({self.function_code}, {self.function_code & 0x7F}, {self.exception_code})"
+
+
+def _no_response(slave):
+    """Excepción de pymodbus equivalente a un esclavo que no contesta"""
+    from pymodbus.exceptions import ModbusIOException
+    return ModbusIOException(f"Sin respuesta del esclavo {slave} (loopback)")
+
+
+class LoopbackDevice:
+    """Mapa de registros de uno o varios esclavos simulados.
+
+    ``slaves`` es un diccionario {esclavo: {tabla: {dirección: valor}}}.
+    Las direcciones que no existen responden con "dirección ilegal" y los
+    esclavos que no existen no responden (timeout).
+    """
+
+    def __init__(self, slaves=None, latency=0.0):
+        self.slaves = slaves if slaves is not None else {}
+        self.latency = latency
+        self.dynamic = {}  # (esclavo, tabla, dirección) -> función(t) para valores que varían
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def response_delay(self, slave, table="holding", count=1):
+        """Segundos que tarda el esclavo en contestar a una petición de ``count`` registros o bits"""
+        return self.latency
+
+    def set(self, slave, table, address, value):
+        with self._lock:
+            self.slaves.setdefault(slave, {}).setdefault(table, {})[address] = value
+
+    def read(self, table, address, count, slave):
+        self.requests += 1
+        fc = _FUNCTION_CODES.get(table)
+        if slave not in self.slaves:
+            raise _no_response(slave)
+        if fc is None:
+            return LoopbackExceptionResponse(0, ILLEGAL_FUNCTION)
+        with self._lock:
+            values = self.slaves[slave].get(table, {})
+            result = []
+            now = time.time()
+            for a in range(address, address + count):
+                if a not in values:
+                    return LoopbackExceptionResponse(fc, ILLEGAL_DATA_ADDRESS)
+                source = self.dynamic.get((slave, table, a))
+                result.append(source(now) if source else values[a])
+        if table in ("coil", "discrete_input"):
+            return LoopbackResponse(fc, bits=[bool(v) for v in result])
+        return LoopbackResponse(fc, registers=[int(v) & 0xFFFF for v in result])
+
+    def write(self, table, address, value, slave):
+        self.requests += 1
+        if slave not in self.slaves:
+            raise _no_response(slave)
+        fc = {"holding": 6, "coil": 5}.get(table)
+        if fc is None:
+            return LoopbackExceptionResponse(0, ILLEGAL_FUNCTION)
+        with self._lock:
+            values = self.slaves[slave].get(table, {})
+            if address not in values:
+                return LoopbackExceptionResponse(fc, ILLEGAL_DATA_ADDRESS)
+            values[address] = value
+            self.dynamic.pop((slave, table, address), None)
+        return LoopbackResponse(fc, address=address, value=value)
+
+
+def create_demo_device():
+    """Equipo de ejemplo: una sonda de temperatura en los esclavos 0 y 1"""
+    device = LoopbackDevice()
+    for slave in (0, 1):
+        device.slaves[slave] = {
+            "holding": {address: 0 for address in range(0, 100)},
+            "input": {address: 0 for address in range(0, 50)},
+            "coil": {address: 0 for address in range(0, 16)},
+            "discrete_input": {address: 0 for address in range(0, 16)},
+        }
+        # Temperatura (÷10) que oscila lentamente alrededor de 21,5 °C
+        device.dynamic[(slave, "holding", 0)] = lambda t: int(215 + 15 * math.sin(t / 30))
+        device.dynamic[(slave, "input", 0)] = lambda t: int(215 + 15 * math.sin(t / 30))
+        device.slaves[slave]["holding"][1] = 1000 + slave
+        # Segundo bloque de registros separado por un hueco
+        device.slaves[slave]["holding"].update({address: address for address in range(1000, 1010)})
+    return device
+
+
+_devices = {}
+_devices_lock = threading.Lock()
+
+
+def register_loopback_device(port, device):
+    """Asocia un equipo simulado propio (por ejemplo una granja de esclavos) a ``loop://nombre``"""
+    with _devices_lock:
+        _devices[port] = device
+
+
+def get_loopback_device(port):
+    """Devuelve el equipo simulado asociado al nombre del puerto ``loop://nombre``"""
+    with _devices_lock:
+        device = _devices.get(port)
+        if device is None:
+            device = create_demo_device()
+            _devices[port] = device
+        return device
+
+
+class LoopbackClient:
+    """Cliente síncrono con la interfaz de ``ModbusSerialClient``"""
+
+    def __init__(self, port, timeout=1.0, device=None):
+        self.port = port
+        self.timeout = timeout
+        self.device = device or get_loopback_device(port)
+        self.connected = False
+
+    def connect(self):
+        self.connected = True
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def is_socket_open(self):
+        return self.connected
+
+    def _delay(self, slave, table="holding", count=1):
+        delay = self.device.response_delay(slave, table, count)
+        if delay:
+            time.sleep(delay)
+
+    def read_holding_registers(self, address, count=1, slave=0, **kwargs):
+        self._delay(slave, "holding", count)
+        return self.device.read("holding", address, count, slave)
+
+    def read_input_registers(self, address, count=1, slave=0, **kwargs):
+        self._delay(slave, "input", count)
+        return self.device.read("input", address, count, slave)
+
+    def read_coils(self, address, count=1, slave=0, **kwargs):
+        self._delay(slave, "coil", count)
+        return self.device.read("coil", address, count, slave)
+
+    def read_discrete_inputs(self, address, count=1, slave=0, **kwargs):
+        self._delay(slave, "discrete_input", count)
+        return self.device.read("discrete_input", address, count, slave)
+
+    def write_register(self, address, value, slave=0, **kwargs):
+        self._delay(slave)
+        return self.device.write("holding", address, value, slave)
+
+    def write_coil(self, address, value, slave=0, **kwargs):
+        self._delay(slave, "coil")
+        return self.device.write("coil", address, value, slave)
+
+
+class AsyncLoopbackClient:
+    """Cliente asíncrono con la interfaz de ``AsyncModbusSerialClient``"""
+
+    def __init__(self, port, timeout=1.0, device=None):
+        self.port = port
+        self.timeout = timeout
+        self.device = device or get_loopback_device(port)
+        self.connected = False
+
+    async def connect(self):
+        self.connected = True
+        return True
+
+    def close(self):
+        self.connected = False
+
+    async def _delay(self, slave, table="holding", count=1):
+        delay = self.device.response_delay(slave, table, count)
+        if delay:
+            import asyncio
+            await asyncio.sleep(delay)
+
+    async def read_holding_registers(self, address, count=1, slave=0, **kwargs):
+        await self._delay(slave, "holding", count)
+        return self.device.read("holding", address, count, slave)
+
+    async def read_input_registers(self, address, count=1, slave=0, **kwargs):
+        await self._delay(slave, "input", count)
+        return self.device.read("input", address, count, slave)
+
+    async def read_coils(self, address, count=1, slave=0, **kwargs):
+        await self._delay(slave, "coil", count)
+        return self.device.read("coil", address, count, slave)
+
+    async def read_discrete_inputs(self, address, count=1, slave=0, **kwargs):
+        await self._delay(slave, "discrete_input", count)
+        return self.device.read("discrete_input", address, count, slave)
+
+    async def write_register(self, address, value, slave=0, **kwargs):
+        await self._delay(slave)
+        return self.device.write("holding", address, value, slave)
+
+    async def write_coil(self, address, value, slave=0, **kwargs):
+        await self._delay(slave, "coil")
+        return self.device.write("coil", address, value, slave)
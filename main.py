@@ -1,14 +1,35 @@
+import os
+import sys
+import csv
+import json
 import time
-from pymodbus.client import ModbusSerialClient
-from pymodbus.exceptions import ModbusException
+import signal
+import argparse
+import threading
+import contextlib
 import logging
+from adaptive_scanner import AdaptiveScanner, ProfileStore, ScanAborted
+from async_transport import open_bus, shutdown_backends, BACKENDS, BACKEND_THREADS
+from polling import Tag, PollingEngine, POLL_TABLES, parse_register_list
+from bus_arbiter import PRIORITY_INTERACTIVE
+from decoding import RegisterFormat, format_scaled, parse_order, LITTLE, DATATYPES, BYTE_ORDERS
+from candidates import CandidateFinder
+from scheduler import PollScheduler, parse_rate_list, parse_period
+from change_detect import ChangeFilter
+from discovery import DiscoveryEngine, parse_bus_list, CONFIRM_TABLES
+from autodetect import LineDetector, default_cache
 
-# Configurar logging para ver detalles de la comunicación
-logging.basicConfig()
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+# Interpretaciones usadas al explorar un registro desconocido
+INT16 = RegisterFormat("int16")
+UINT32_BE = RegisterFormat("uint32")
+UINT32_LE = RegisterFormat("uint32", word_order=LITTLE)
+FLOAT32_BE = RegisterFormat("float32")
+FLOAT32_LE = RegisterFormat("float32", word_order=LITTLE)
 
-def scan_modbus_registers(port='COM3', baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1, slave_address=0):
+log = logging.getLogger(__name__)
+
+def scan_modbus_registers(port='COM3', baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1, slave_address=0,
+                          min_block=1, backend='threads', passes=1, top=20):
     """
     Escanea registros Modbus para encontrar valores de temperatura del sensor PT1000.
     
@@ -20,24 +41,26 @@ def scan_modbus_registers(port='COM3', baudrate=9600, parity='N', stopbits=1, by
         bytesize (int): Tamaño de byte
         timeout (int): Tiempo de espera para la respuesta
         slave_address (int): Dirección del esclavo Modbus
+        min_block (int): Tamaño mínimo al partir bloques fallidos (1 = aislar cada registro)
+        backend (str): Transporte ('threads' o 'asyncio')
+        passes (int): Escaneos repetidos; con más de uno se puntúa la estabilidad de cada valor
+        top (int): Candidatos a mostrar (0 = todos)
+    
+    Returns:
+        list: Candidatos (``Candidate``) ordenados por puntuación, o None si no hubo conexión
     """
+    temperature_candidates = None
     print(f"Iniciando escaneo de registros Modbus RTU en {port}")
     print(f"Configuración: {baudrate} baudios, {bytesize}{parity}{stopbits}, timeout {timeout}s")
     print(f"Dirección del esclavo: {slave_address}")
     
-    # Crear cliente Modbus RTU
-    client = ModbusSerialClient(
-        port=port,
-        baudrate=baudrate,
-        parity=parity,
-        stopbits=stopbits,
-        bytesize=bytesize,
-        timeout=timeout
-    )
+    # Acceso al bus (hilos o asyncio, misma interfaz; "loop://demo" simula un equipo)
+    bus = open_bus(backend, port, baudrate, parity, stopbits, bytesize, timeout)
     
     # Intentar conectar
-    connection = client.connect()
+    connection = bus.connect().result()
     if connection:
+        from pymodbus.exceptions import ModbusException
         print(f"Conexión establecida con el puerto {port}")
         
         try:
@@ -54,81 +77,53 @@ def scan_modbus_registers(port='COM3', baudrate=9600, parity='N', stopbits=1, by
                 (3000, 50),    # Registros 3000-3049
             ]
             
-            temperature_candidates = []
+            # Imagen compacta de lo leído; los candidatos se puntúan al final en bloque
+            finder = CandidateFinder()
             
-            # Escanear registros de retención (holding registers)
-            print("\n--- Escaneando registros de retención (holding registers) ---")
-            for start_register, count in register_ranges:
-                try:
-                    print(f"Leyendo registros {start_register}-{start_register+count-1}...")
-                    response = client.read_holding_registers(start_register, count, slave=slave_address)
-                    
-                    if not hasattr(response, 'isError') or not response.isError():
-                        print(f"Registros leídos: {response.registers}")
-                        
-                        # Buscar posibles valores de temperatura
-                        for i, value in enumerate(response.registers):
-                            reg_address = start_register + i
-                            
-                            # Probar diferentes escalas comunes para temperaturas
-                            # Valor directo (sin escala)
-                            if -50 <= value <= 150:
-                                temperature_candidates.append((reg_address, value, "holding", "1x"))
-                            
-                            # Valor dividido por 10 (un decimal)
-                            temp_val = value / 10.0
-                            if -50 <= temp_val <= 150:
-                                temperature_candidates.append((reg_address, temp_val, "holding", "0.1x"))
-                            
-                            # Valor dividido por 100 (dos decimales)
-                            temp_val = value / 100.0
-                            if -50 <= temp_val <= 150:
-                                temperature_candidates.append((reg_address, temp_val, "holding", "0.01x"))
-                except Exception as e:
-                    print(f"Error al leer registros {start_register}-{start_register+count-1}: {e}")
-                
-                time.sleep(0.2)  # Pequeña pausa entre lecturas
+            # Perfiles del equipo: mejor tamaño de bloque y huecos de escaneos anteriores
+            profiles = ProfileStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scan_profiles.json"))
             
-            # Escanear registros de entrada (input registers)
-            print("\n--- Escaneando registros de entrada (input registers) ---")
-            for start_register, count in register_ranges:
-                try:
-                    print(f"Leyendo registros de entrada {start_register}-{start_register+count-1}...")
-                    response = client.read_input_registers(start_register, count, slave=slave_address)
-                    
-                    if not hasattr(response, 'isError') or not response.isError():
-                        print(f"Registros de entrada leídos: {response.registers}")
-                        
-                        # Buscar posibles valores de temperatura
-                        for i, value in enumerate(response.registers):
-                            reg_address = start_register + i
-                            
-                            # Probar diferentes escalas comunes para temperaturas
-                            # Valor directo (sin escala)
-                            if -50 <= value <= 150:
-                                temperature_candidates.append((reg_address, value, "input", "1x"))
-                            
-                            # Valor dividido por 10 (un decimal)
-                            temp_val = value / 10.0
-                            if -50 <= temp_val <= 150:
-                                temperature_candidates.append((reg_address, temp_val, "input", "0.1x"))
+            def reader(table, address, block_size, slave):
+                return bus.read(table, address, block_size, slave).result()
+            
+            scan_tables = [(pass_index, register_type, label)
+                           for pass_index in range(max(1, passes))
+                           for register_type, label in (("holding", "registros de retención (holding registers)"),
+                                                        ("input", "registros de entrada (input registers)"))]
+            for pass_index, register_type, label in scan_tables:
+                print(f"\n--- Escaneando {label} (pasada {pass_index + 1}/{max(1, passes)}) ---")
+                scanner = AdaptiveScanner(reader, profiles.get(port, slave_address, register_type),
+                                          min_block=min_block)
+                for start_register, count in register_ranges:
+                    print(f"Leyendo registros {register_type} {start_register}-{start_register+count-1}...")
+                    try:
+                        # Los bloques que fallan se parten a la mitad hasta aislar los registros válidos
+                        for block_start, registers in scanner.scan(register_type, start_register, count, slave_address):
+                            print(f"Registros leídos {block_start}-{block_start+len(registers)-1}: {registers}")
                             
-                            # Valor dividido por 100 (dos decimales)
-                            temp_val = value / 100.0
-                            if -50 <= temp_val <= 150:
-                                temperature_candidates.append((reg_address, temp_val, "input", "0.01x"))
-                except Exception as e:
-                    print(f"Error al leer registros de entrada {start_register}-{start_register+count-1}: {e}")
+                            finder.add_block(slave_address, register_type, block_start, registers,
+                                             scan=pass_index)
+                    except ScanAborted as e:
+                        print(f"Escaneo interrumpido en {start_register}-{start_register+count-1}: {e}")
+                        break
+                    except Exception as e:
+                        print(f"Error al leer registros {start_register}-{start_register+count-1}: {e}")
                 
-                time.sleep(0.2)  # Pequeña pausa entre lecturas
+                stats = scanner.stats()
+                print(f"{stats['requests']} peticiones, bloque óptimo {stats['best_block']}, "
+                      f"{stats['holes']} huecos conocidos")
+            
+            profiles.save()
             
             # Mostrar resultados
+            temperature_candidates = finder.candidates(limit=top or None)
             if temperature_candidates:
                 print("\n=== POSIBLES VALORES DE TEMPERATURA ENCONTRADOS ===")
-                print("Dirección | Valor | Tipo | Escala")
-                print("-" * 50)
-                for reg_address, value, reg_type, scale in temperature_candidates:
-                    print(f"{reg_address:8} | {value:5.2f}°C | {reg_type:7} | {scale}")
+                print("Dirección | Valor | Tipo | Interpretación | Puntuación")
+                print("-" * 65)
+                for candidate in temperature_candidates:
+                    print(f"{candidate.address:8} | {candidate.value:6.2f}°C | {candidate.table:7} | "
+                          f"{candidate.label:15} | {candidate.score:.2f}")
                 
                 print("\nPara leer continuamente un registro específico, use el siguiente código:")
                 print("python monitor_temperature.py --port COM3 --baudrate 9600 --parity N --address 0 --register X --type Y")
@@ -147,7 +142,7 @@ def scan_modbus_registers(port='COM3', baudrate=9600, parity='N', stopbits=1, by
             print(f"\nError general: {e}")
         
         finally:
-            client.close()
+            shutdown_backends()
             print("\nConexión cerrada")
     else:
         print(f"\nNo se pudo establecer conexión con el puerto {port}")
@@ -155,8 +150,10 @@ def scan_modbus_registers(port='COM3', baudrate=9600, parity='N', stopbits=1, by
         print("1. El puerto COM3 esté disponible")
         print("2. El convertidor USB-RS485 esté correctamente instalado")
         print("3. No haya otro programa utilizando el puerto")
+    return temperature_candidates
 
-def test_modbus_connection(port='COM3', baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1):
+def test_modbus_connection(port='COM3', baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1,
+                           slave_address=0, backend='threads', autodetect=False):
     """
     Prueba si existe comunicación con un dispositivo Modbus RTU.
     
@@ -167,28 +164,46 @@ def test_modbus_connection(port='COM3', baudrate=9600, parity='N', stopbits=1, b
         stopbits (int): Bits de parada
         bytesize (int): Tamaño de byte
         timeout (int): Tiempo de espera para la respuesta
+        slave_address (int): Dirección del esclavo Modbus (con autodetect se prueba primero)
+        backend (str): Transporte ('threads' o 'asyncio')
+        autodetect (bool): Detectar baudrate, paridad y bits de parada antes de la prueba
+    
+    Returns:
+        bool: True si el dispositivo respondió
     """
     print(f"Iniciando prueba de comunicación Modbus RTU en {port}")
+    communication_successful = False
+    
+    if autodetect:
+        print("Autodetectando parámetros de línea...")
+        slave_ids = [slave_address] + [s for s in (1, 2, 3, 247) if s != slave_address]
+        detector = LineDetector(port, slave_ids=slave_ids, backend=backend,
+                                cache=default_cache())
+        try:
+            line = detector.run()
+        except ConnectionError as e:
+            line = None
+            print(f"Autodetección fallida: {e}")
+        if line is not None:
+            baudrate, parity, stopbits, bytesize = line["baudrate"], line["parity"], line["stopbits"], line["bytesize"]
+            slave_address = line["slave"]
+            origin = "configuración guardada" if detector.from_cache else f"{detector.attempts} combinaciones"
+            print(f"Línea detectada: {baudrate} {bytesize}{parity}{stopbits}, esclavo {slave_address} "
+                  f"({origin}, {detector.elapsed:.1f} s)")
+        else:
+            print(f"Ninguna combinación respondió ({detector.attempts} probadas); se usa la configuración indicada")
+    
     print(f"Configuración: {baudrate} baudios, {bytesize}{parity}{stopbits}, timeout {timeout}s")
     
-    # Crear cliente Modbus RTU
-    client = ModbusSerialClient(
-        port=port,
-        baudrate=baudrate,
-        parity=parity,
-        stopbits=stopbits,
-        bytesize=bytesize,
-        timeout=timeout
-    )
+    # Acceso al bus (hilos o asyncio, misma interfaz; "loop://demo" simula un equipo)
+    bus = open_bus(backend, port, baudrate, parity, stopbits, bytesize, timeout)
     
     # Intentar conectar
-    connection = client.connect()
+    connection = bus.connect().result()
     if connection:
+        from pymodbus.exceptions import ModbusException
         print(f"Conexión establecida con el puerto {port}")
         
-        # Dirección del dispositivo Danfoss
-        slave_address = 0
-        
         print(f"Probando comunicación con dispositivo en dirección {slave_address}...")
         
         try:
@@ -200,26 +215,22 @@ def test_modbus_connection(port='COM3', baudrate=9600, parity='N', stopbits=1, b
                 (400, 1)    # Registro 400
             ]
             
-            communication_successful = False
-            
             for start_register, count in test_registers:
                 print(f"Probando lectura del registro {start_register}...")
                 
                 # Intentar leer registro de retención
-                response = client.read_holding_registers(start_register, count, slave=slave_address)
+                response = bus.read("holding", start_register, count, slave_address).result()
                 if not hasattr(response, 'isError') or not response.isError():
                     print(f"¡COMUNICACIÓN EXITOSA! Registro {start_register} leído: {response.registers}")
                     communication_successful = True
                     break
                 
                 # Intentar leer registro de entrada
-                response = client.read_input_registers(start_register, count, slave=slave_address)
+                response = bus.read("input", start_register, count, slave_address).result()
                 if not hasattr(response, 'isError') or not response.isError():
                     print(f"¡COMUNICACIÓN EXITOSA! Registro de entrada {start_register} leído: {response.registers}")
                     communication_successful = True
                     break
-                
-                time.sleep(0.5)
             
             if communication_successful:
                 print("\n✅ COMUNICACIÓN ESTABLECIDA CON ÉXITO ✅")
@@ -227,8 +238,8 @@ def test_modbus_connection(port='COM3', baudrate=9600, parity='N', stopbits=1, b
             else:
                 print("\n❌ NO SE PUDO ESTABLECER COMUNICACIÓN ❌")
                 print("Sugerencias:")
-                print("1. Verifica que la dirección del esclavo sea 1")
-                print("2. Confirma que los parámetros de comunicación sean correctos (38400, E, 1)")
+                print(f"1. Verifica que la dirección del esclavo sea {slave_address} (--slave)")
+                print("2. Confirma los parámetros de comunicación o usa --autodetect")
                 print("3. Revisa las conexiones físicas del convertidor RS485")
         
         except ModbusException as e:
@@ -238,7 +249,7 @@ def test_modbus_connection(port='COM3', baudrate=9600, parity='N', stopbits=1, b
             print(f"\n❌ ERROR GENERAL: {e}")
         
         finally:
-            client.close()
+            shutdown_backends()
             print("Conexión cerrada")
     else:
         print(f"\n❌ NO SE PUDO ESTABLECER CONEXIÓN CON EL PUERTO {port}")
@@ -246,8 +257,10 @@ def test_modbus_connection(port='COM3', baudrate=9600, parity='N', stopbits=1, b
         print("1. El puerto COM3 esté disponible")
         print("2. El convertidor USB-RS485 esté correctamente instalado")
         print("3. No haya otro programa utilizando el puerto")
+    return communication_successful
 
-def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1, slave_address=0):
+def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1, slave_address=0,
+                              backend='threads'):
     """
     Lee específicamente el registro de temperatura en la dirección 0x0000 (0 decimal)
     e intenta interpretarlo de diferentes maneras.
@@ -260,24 +273,19 @@ def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1
         bytesize (int): Tamaño de byte
         timeout (int): Tiempo de espera para la respuesta
         slave_address (int): Dirección del esclavo Modbus
+        backend (str): Transporte ('threads' o 'asyncio')
     """
     print(f"Leyendo registro de temperatura en dirección 0x0000 (0 decimal)")
     print(f"Configuración: {baudrate} baudios, {bytesize}{parity}{stopbits}, timeout {timeout}s")
     print(f"Dirección del esclavo: {slave_address}")
     
-    # Crear cliente Modbus RTU
-    client = ModbusSerialClient(
-        port=port,
-        baudrate=baudrate,
-        parity=parity,
-        stopbits=stopbits,
-        bytesize=bytesize,
-        timeout=timeout
-    )
+    # Acceso al bus (hilos o asyncio, misma interfaz; "loop://demo" simula un equipo)
+    bus = open_bus(backend, port, baudrate, parity, stopbits, bytesize, timeout)
     
     # Intentar conectar
-    connection = client.connect()
+    connection = bus.connect().result()
     if connection:
+        from pymodbus.exceptions import ModbusException
         print(f"Conexión establecida con el puerto {port}")
         
         try:
@@ -287,7 +295,7 @@ def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1
             # 1. Leer como holding register (función 03)
             print("\nProbando como holding register (función 03):")
             try:
-                response = client.read_holding_registers(0, 1, slave=slave_address)
+                response = bus.read("holding", 0, 1, slave_address).result()
                 if not hasattr(response, 'isError') or not response.isError():
                     value = response.registers[0]
                     print(f"Valor leído: {value} (decimal) / 0x{value:04X} (hex)")
@@ -296,10 +304,7 @@ def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1
                     print(f"Interpretado como temperatura (÷100): {value/100.0}°C")
                     
                     # Interpretar como valor con signo (complemento a 2)
-                    if value > 32767:
-                        signed_value = value - 65536
-                    else:
-                        signed_value = value
+                    signed_value = INT16.decode(response.registers)
                     print(f"Interpretado como temperatura con signo: {signed_value}°C")
                     print(f"Interpretado como temperatura con signo (÷10): {signed_value/10.0}°C")
                 else:
@@ -310,7 +315,7 @@ def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1
             # 2. Leer como input register (función 04)
             print("\nProbando como input register (función 04):")
             try:
-                response = client.read_input_registers(0, 1, slave=slave_address)
+                response = bus.read("input", 0, 1, slave_address).result()
                 if not hasattr(response, 'isError') or not response.isError():
                     value = response.registers[0]
                     print(f"Valor leído: {value} (decimal) / 0x{value:04X} (hex)")
@@ -319,10 +324,7 @@ def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1
                     print(f"Interpretado como temperatura (÷100): {value/100.0}°C")
                     
                     # Interpretar como valor con signo (complemento a 2)
-                    if value > 32767:
-                        signed_value = value - 65536
-                    else:
-                        signed_value = value
+                    signed_value = INT16.decode(response.registers)
                     print(f"Interpretado como temperatura con signo: {signed_value}°C")
                     print(f"Interpretado como temperatura con signo (÷10): {signed_value/10.0}°C")
                 else:
@@ -333,21 +335,25 @@ def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1
             # 3. Probar leyendo 2 registros (por si la temperatura es un valor de 32 bits)
             print("\nProbando lectura de 2 registros (por si es valor de 32 bits):")
             try:
-                response = client.read_holding_registers(0, 2, slave=slave_address)
+                response = bus.read("holding", 0, 2, slave_address).result()
                 if not hasattr(response, 'isError') or not response.isError():
                     value1 = response.registers[0]
                     value2 = response.registers[1]
                     print(f"Valores leídos: {value1}, {value2}")
                     
                     # Combinar como valor de 32 bits (big endian)
-                    combined_be = (value1 << 16) | value2
+                    combined_be = UINT32_BE.decode(response.registers)
                     print(f"Combinado (big endian): {combined_be}")
                     print(f"Interpretado como temperatura (÷10): {combined_be/10.0}°C")
                     
                     # Combinar como valor de 32 bits (little endian)
-                    combined_le = (value2 << 16) | value1
+                    combined_le = UINT32_LE.decode(response.registers)
                     print(f"Combinado (little endian): {combined_le}")
                     print(f"Interpretado como temperatura (÷10): {combined_le/10.0}°C")
+                    
+                    # Coma flotante IEEE 754 en los dos órdenes de palabra
+                    print(f"Interpretado como float32 (ABCD): {FLOAT32_BE.decode(response.registers):.6g}")
+                    print(f"Interpretado como float32 (CDAB): {FLOAT32_LE.decode(response.registers):.6g}")
                 else:
                     print(f"Error al leer 2 registros: {response}")
             except Exception as e:
@@ -358,7 +364,7 @@ def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1
             for addr in range(1, 6):  # Probar registros 1-5
                 try:
                     print(f"\nProbando registro {addr} (0x{addr:04X}):")
-                    response = client.read_holding_registers(addr, 1, slave=slave_address)
+                    response = bus.read("holding", addr, 1, slave_address).result()
                     if not hasattr(response, 'isError') or not response.isError():
                         value = response.registers[0]
                         print(f"Valor leído: {value} (decimal) / 0x{value:04X} (hex)")
@@ -376,7 +382,7 @@ def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1
             print(f"\nError general: {e}")
         
         finally:
-            client.close()
+            shutdown_backends()
             print("\nConexión cerrada")
     else:
         print(f"\nNo se pudo establecer conexión con el puerto {port}")
@@ -385,10 +391,52 @@ def read_temperature_register(port='COM3', baudrate=9600, parity='N', stopbits=1
         print("2. El convertidor USB-RS485 esté correctamente instalado")
         print("3. No haya otro programa utilizando el puerto")
 
+def build_tags(register, slave_address=0, register_type='holding', datatype='uint16', scale=1.0,
+               order='ABCD', interval=1.0):
+    """Convierte un registro, una lista o un texto "0-3@1, 100@30s" en [(Tag, periodo)]"""
+    if isinstance(register, str):
+        rates = parse_rate_list(register, interval)
+    else:
+        registers = list(register) if isinstance(register, (list, tuple)) else [register]
+        rates = [(reg, interval) for reg in registers]
+    word_order, byte_order = parse_order(order)
+    return [(Tag(slave_address, register_type.lower(), reg, datatype, scale,
+                 word_order=word_order, byte_order=byte_order), period)
+            for reg, period in rates]
+
+def read_tags(tags, port='COM3', baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1,
+              max_gap=8, backend='threads'):
+    """
+    Lee una vez una lista de tags con el mínimo de peticiones.
+    
+    Args:
+        tags (list): Tags (``Tag``) a leer
+        port (str): Puerto COM del convertidor RS485
+        max_gap (int): Registros sin usar tolerados al agrupar peticiones
+        backend (str): Transporte ('threads' o 'asyncio')
+    
+    Returns:
+        list: ``TagValue`` de cada tag, o None si no hubo conexión
+    """
+    bus = open_bus(backend, port, baudrate, parity, stopbits, bytesize, timeout)
+    if not bus.connect().result():
+        print(f"No se pudo establecer conexión con el puerto {port}")
+        return None
+    try:
+        engine = PollingEngine(tags, max_gap)
+        return engine.poll_bus(bus, priority=PRIORITY_INTERACTIVE)
+    finally:
+        shutdown_backends()
+
 def monitor_temperature(port='COM3', baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1, 
-                       slave_address=0, register=0, register_type='holding', scale=1.0):
+                       slave_address=0, register=0, register_type='holding', scale=1.0,
+                       datatype='uint16', max_gap=8, backend='threads', interval=1.0, order='ABCD',
+                       tags=None, on_results=None, duration=None):
     """
-    Monitorea continuamente el registro de temperatura.
+    Monitorea continuamente uno o varios registros de temperatura.
+    
+    Cada registro puede tener su propio periodo ("0-3@1, 100@30s, 200@200ms");
+    los registros que vencen a la vez se agrupan en el mínimo de lecturas.
     
     Args:
         port (str): Puerto COM del convertidor RS485
@@ -398,58 +446,67 @@ def monitor_temperature(port='COM3', baudrate=9600, parity='N', stopbits=1, byte
         bytesize (int): Tamaño de byte
         timeout (int): Tiempo de espera para la respuesta
         slave_address (int): Dirección del esclavo Modbus
-        register (int): Registro a monitorear
+        register (int | list | str): Registro, lista de registros o texto con periodos
         register_type (str): Tipo de registro ('holding' o 'input')
         scale (float): Factor de escala para el valor leído
+        datatype (str): Tipo de dato ('uint16', 'int16', 'uint32', 'int32', 'float32', 'float64')
+        max_gap (int): Registros sin usar tolerados al agrupar peticiones
+        backend (str): Transporte ('threads' o 'asyncio')
+        interval (float): Periodo en segundos de los registros sin periodo propio
+        order (str): Orden de palabras y bytes de los valores de 32/64 bits ('ABCD', 'CDAB', 'BADC', 'DCBA')
+        tags (list): [(Tag, periodo)] ya preparados; sustituye a register, register_type, datatype y scale
+        on_results (callable): on_results(valores) con los ``TagValue`` de cada ciclo en lugar de imprimirlos
+        duration (float): Segundos de monitoreo (None = hasta Ctrl+C)
     """
-    print(f"Monitoreando temperatura en registro {register_type} {register} (0x{register:04X})")
-    print(f"Configuración: {baudrate} baudios, {bytesize}{parity}{stopbits}, escala {scale}")
-    print(f"Dirección del esclavo: {slave_address}")
+    if tags is not None:
+        scheduled = list(tags)
+    else:
+        try:
+            scheduled = build_tags(register, slave_address, register_type, datatype, scale, order, interval)
+        except ValueError as e:
+            print(f"Configuración no válida: {e}")
+            return
+    
+    print(f"Monitoreando temperatura en registros "
+          f"{', '.join(f'{tag.table}:{tag.address}@{period:g}s' for tag, period in scheduled)}")
+    print(f"Configuración: {baudrate} baudios, {bytesize}{parity}{stopbits}")
+    print(f"Dirección del esclavo: {', '.join(sorted({str(tag.slave) for tag, _ in scheduled}))}")
     print("Presiona Ctrl+C para detener el monitoreo")
     
-    # Crear cliente Modbus RTU
-    client = ModbusSerialClient(
-        port=port,
-        baudrate=baudrate,
-        parity=parity,
-        stopbits=stopbits,
-        bytesize=bytesize,
-        timeout=timeout
-    )
+    # Acceso al bus (hilos o asyncio, misma interfaz; "loop://demo" simula un equipo)
+    bus = open_bus(backend, port, baudrate, parity, stopbits, bytesize, timeout)
     
     # Intentar conectar
-    connection = client.connect()
+    connection = bus.connect().result()
     if connection:
+        from pymodbus.exceptions import ModbusException
         print(f"Conexión establecida con el puerto {port}")
         
-        try:
-            while True:
-                # Leer registro según el tipo especificado
-                if register_type.lower() == 'holding':
-                    response = client.read_holding_registers(register, 1, slave=slave_address)
-                elif register_type.lower() == 'input':
-                    response = client.read_input_registers(register, 1, slave=slave_address)
-                else:
-                    print(f"Tipo de registro no válido: {register_type}")
-                    break
-                
-                if not hasattr(response, 'isError') or not response.isError():
-                    value = response.registers[0]
-                    scaled_value = value * scale
-                    
-                    # Mostrar valor con formato según la escala
-                    if scale == 1:
-                        print(f"[{time.strftime('%H:%M:%S')}] Temperatura: {scaled_value}°C")
-                    elif scale == 0.1:
-                        print(f"[{time.strftime('%H:%M:%S')}] Temperatura: {scaled_value:.1f}°C")
-                    elif scale == 0.01:
-                        print(f"[{time.strftime('%H:%M:%S')}] Temperatura: {scaled_value:.2f}°C")
-                    else:
-                        print(f"[{time.strftime('%H:%M:%S')}] Temperatura: {scaled_value}°C")
+        def show(results):
+            values = []
+            for result in results:
+                if result.ok:
+                    values.append(f"{format_scaled(result.value, result.tag.scale)}°C")
                 else:
-                    print(f"[{time.strftime('%H:%M:%S')}] Error al leer registro: {response}")
-                
-                time.sleep(1)  # Actualizar cada segundo
+                    values.append(f"error ({result.error})")
+            
+            if len(scheduled) == 1:
+                print(f"[{time.strftime('%H:%M:%S')}] Temperatura: {values[0]}")
+            else:
+                readings = " | ".join(f"Reg {r.tag.address}: {v}" for r, v in zip(results, values))
+                print(f"[{time.strftime('%H:%M:%S')}] {readings}")
+        
+        # Cada grupo de periodo se despacha en su vencimiento (el más próximo primero)
+        scheduler = PollScheduler(bus, scheduled, on_results=on_results or show,
+                                  on_error=lambda e: print(f"Error al sondear: {e}"), max_gap=max_gap)
+        print(f"{len(scheduled)} registros en {len(scheduler.groups)} grupo(s), "
+              f"{scheduler.requests_per_second():.1f} peticiones/s")
+        
+        try:
+            scheduler.start()
+            deadline = None if duration is None else time.monotonic() + duration
+            while deadline is None or time.monotonic() < deadline:
+                time.sleep(1 if deadline is None else max(0.0, min(1, deadline - time.monotonic())))
         
         except KeyboardInterrupt:
             print("\nMonitoreo detenido por el usuario")
@@ -461,7 +518,11 @@ def monitor_temperature(port='COM3', baudrate=9600, parity='N', stopbits=1, byte
             print(f"\nError general: {e}")
         
         finally:
-            client.close()
+            scheduler.stop()
+            stats = scheduler.stats()
+            print(f"\n{stats['dispatches']} ciclos, {stats['missed']} vencimientos perdidos, "
+                  f"jitter máximo {stats['jitter_max_ms']:.1f} ms")
+            shutdown_backends()
             print("\nConexión cerrada")
     else:
         print(f"\nNo se pudo establecer conexión con el puerto {port}")
@@ -469,31 +530,315 @@ def monitor_temperature(port='COM3', baudrate=9600, parity='N', stopbits=1, byte
         print("1. El puerto esté disponible")
         print("2. El convertidor USB-RS485 esté correctamente instalado")
         print("3. No haya otro programa utilizando el puerto")
+    return bool(connection)
+
+# --- Línea de comandos -------------------------------------------------------
+#
+# Uso sin interfaz gráfica (por ejemplo como servicio de systemd en una pasarela):
+#   python main.py scan --port /dev/ttyUSB0 --slave 1 --passes 2
+#   python main.py read --port loop://demo --register "0-3" --format ndjson
+#   python main.py monitor --port /dev/ttyUSB0 --tags tags.csv --format csv --deadband 0.2
+#   python main.py discover --ports "/dev/ttyUSB0, /dev/ttyUSB1@19200" --slaves 1-32
+# Con --format ndjson o csv los datos van a stdout y los mensajes a stderr.
+
+OUTPUT_FORMATS = ("text", "ndjson", "csv")
+
+# Columnas de salida de cada subcomando
+TAG_FIELDS = ["time", "name", "slave", "table", "address", "value", "raw", "error"]
+CANDIDATE_FIELDS = ["slave", "table", "address", "interpretation", "value", "raw", "score", "stability"]
+DISCOVERY_FIELDS = ["port", "slave", "response_time", "value", "status", "confidence", "functions"]
+TEST_FIELDS = ["port", "ok"]
+
+
+class RecordWriter:
+    """Escribe registros (diccionarios) línea a línea en texto, NDJSON o CSV"""
+
+    def __init__(self, fmt, fields, stream):
+        self.format = fmt
+        self.fields = fields
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.DictWriter(stream, fieldnames=fields, extrasaction="ignore")
+            self._csv.writeheader()
+
+    @staticmethod
+    def _flat(value):
+        if isinstance(value, (list, tuple)):
+            return " ".join(str(v) for v in value)
+        return "" if value is None else value
+
+    def write(self, record):
+        with self._lock:
+            if self.format == "ndjson":
+                self.stream.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            elif self._csv is not None:
+                self._csv.writerow({key: self._flat(value) for key, value in record.items()})
+            else:
+                self.stream.write(" | ".join(str(self._flat(record.get(field))) for field in self.fields) + "\n")
+            # Cada línea sale en cuanto se produce (tuberías, journald)
+            self.stream.flush()
+
+
+def tag_record(result):
+    tag = result.tag
+    return {
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "name": tag.name,
+        "slave": tag.slave,
+        "table": tag.table,
+        "address": tag.address,
+        "value": round(result.value, 6) if isinstance(result.value, float) else result.value,
+        "raw": list(result.raw) if result.raw is not None else None,
+        "error": None if result.ok else str(result.error),
+    }
+
+
+def load_tag_file(path, slave_address=0, register_type='holding', datatype='uint16', scale=1.0,
+                  order='ABCD', interval=1.0):
+    """
+    Lee una lista de tags de un fichero y devuelve [(Tag, periodo)].
+    
+    Se admiten dos formatos (las líneas vacías y las que empiezan por # se ignoran):
+      - CSV con cabecera: ``address`` es obligatoria; ``slave``, ``table``, ``datatype``,
+        ``scale``, ``order``, ``period`` y ``name`` son opcionales y toman los valores
+        de la línea de comandos
+      - Un rango de registros por línea, como en --register ("0-3@1", "100@30s")
+    """
+    with open(path, 'r', newline='') as f:
+        lines = [line for line in f if line.strip() and not line.lstrip().startswith("#")]
+    if not lines:
+        raise ValueError(f"El fichero {path} no contiene tags")
+    
+    if "address" not in lines[0].lower():
+        return build_tags(",".join(lines), slave_address, register_type, datatype, scale, order, interval)
+    
+    scheduled = []
+    for number, row in enumerate(csv.DictReader(lines), start=2):
+        row = {key.strip().lower(): (value or "").strip() for key, value in row.items() if key}
+        try:
+            word_order, byte_order = parse_order(row.get("order") or order)
+            tag = Tag(row.get("slave") or slave_address, (row.get("table") or register_type).lower(),
+                      int(row["address"]), row.get("datatype") or datatype,
+                      float(row.get("scale") or scale), name=row.get("name") or None,
+                      word_order=word_order, byte_order=byte_order)
+            period = parse_period(row["period"]) if row.get("period") else interval
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"{path}, línea {number}: {e}")
+        scheduled.append((tag, period))
+    return scheduled
+
+
+def _command_tags(args):
+    if args.tags:
+        return load_tag_file(args.tags, args.slave, args.type, args.datatype, args.scale, args.order,
+                             getattr(args, "interval", 1.0))
+    return build_tags(args.register, args.slave, args.type, args.datatype, args.scale, args.order,
+                      getattr(args, "interval", 1.0))
+
+
+def _line(args):
+    return dict(port=args.port, baudrate=args.baudrate, parity=args.parity, stopbits=args.stopbits,
+                bytesize=args.bytesize, timeout=args.timeout)
+
+
+def run_scan(args, out):
+    candidates = scan_modbus_registers(slave_address=args.slave, min_block=args.min_block, backend=args.backend,
+                                       passes=args.passes, top=args.top, **_line(args))
+    if candidates is None:
+        return 1
+    if out.format != "text":
+        for candidate in candidates:
+            out.write({
+                "slave": candidate.slave,
+                "table": candidate.table,
+                "address": candidate.address,
+                "interpretation": candidate.label,
+                "value": round(candidate.value, 4),
+                "raw": candidate.raw,
+                "score": round(candidate.score, 3),
+                "stability": candidate.stability,
+            })
+    return 0
+
+
+def run_test(args, out):
+    ok = test_modbus_connection(slave_address=args.slave, backend=args.backend, autodetect=args.autodetect,
+                                **_line(args))
+    if out.format != "text":
+        out.write({"port": args.port, "ok": ok})
+    return 0 if ok else 1
+
+
+def run_read(args, out):
+    tags = [tag for tag, _ in _command_tags(args)]
+    results = read_tags(tags, max_gap=args.max_gap, backend=args.backend, **_line(args))
+    if results is None:
+        return 1
+    for result in results:
+        out.write(tag_record(result))
+    return 0 if all(result.ok for result in results) else 1
+
+
+def _monitor_output(args, out):
+    """Callback que escribe los cambios, o None para la salida de texto de monitor_temperature"""
+    if out.format == "text" and not (args.deadband or args.deadband_percent):
+        return None
+    changes = ChangeFilter(args.deadband, args.deadband_percent, args.heartbeat)
+
+    def on_results(results):
+        for result in changes.filter(results):
+            out.write(tag_record(result))
+    return on_results
+
+
+def run_monitor(args, out):
+    scheduled = _command_tags(args)
+    on_results = _monitor_output(args, out)
+    connected = monitor_temperature(tags=scheduled, on_results=on_results, max_gap=args.max_gap,
+                                    backend=args.backend, duration=args.duration, **_line(args))
+    return 0 if connected else 1
+
+
+def run_discover(args, out):
+    buses = parse_bus_list(args.ports or args.port, args.baudrate, args.parity, args.stopbits,
+                           args.bytesize, args.timeout)
+    
+    def on_result(result):
+        out.write({
+            "port": result.port,
+            "slave": result.slave,
+            "response_time": round(result.response_time, 1),
+            "value": result.value,
+            "status": result.status,
+            "confidence": result.confidence,
+            "functions": result.functions,
+        })
+    
+    engine = DiscoveryEngine(buses, parse_register_list(args.slaves), table=args.type, register=args.register,
+                             backend=args.backend, two_phase=args.two_phase, on_result=on_result,
+                             on_status=lambda message: print(message))
+    print(f"Buscando esclavos {args.slaves} en {len(buses)} bus(es)...")
+    try:
+        engine.start()
+        engine.wait()
+    except KeyboardInterrupt:
+        engine.stop()
+        engine.wait()
+    finally:
+        shutdown_backends()
+    stats = engine.stats()
+    print(f"{stats['found']} esclavos encontrados, {stats['probed']} de {stats['total']} sondas "
+          f"en {stats['elapsed']:.1f} s")
+    return 0 if stats['found'] else 1
+
+
+def build_parser():
+    line = argparse.ArgumentParser(add_help=False)
+    line.add_argument("--port", default="COM3",
+                      help="Puerto serie, tcp://host:puerto (Modbus TCP), rtu+tcp://host:puerto (RTU sobre TCP) "
+                           "o loop://nombre (simulado)")
+    line.add_argument("--baudrate", type=int, default=9600)
+    line.add_argument("--parity", choices=("N", "E", "O"), default="N")
+    line.add_argument("--stopbits", type=int, choices=(1, 2), default=1)
+    line.add_argument("--bytesize", type=int, choices=(7, 8), default=8)
+    line.add_argument("--timeout", type=float, default=1.0, help="Tiempo de espera de respuesta (s)")
+    line.add_argument("--backend", choices=BACKENDS, default=BACKEND_THREADS, help="Transporte del bus")
+    line.add_argument("--format", choices=OUTPUT_FORMATS, default="text",
+                      help="Salida: texto, NDJSON o CSV (los mensajes van a stderr)")
+    line.add_argument("--retries", type=int, default=1, help="Reintentos de una petición sin respuesta")
+    line.add_argument("--breaker-threshold", type=int, default=3,
+                      help="Fallos seguidos que dejan un esclavo en espera (0 = nunca)")
+    line.add_argument("--probe-interval", type=float, default=5.0,
+                      help="Segundos entre pruebas a un esclavo en espera (se duplica hasta 60 s)")
+    line.add_argument("--metrics-port", type=int, metavar="PUERTO",
+                      help="Publicar la latencia y los errores de cada esclavo en http://127.0.0.1:PUERTO/metrics")
+    line.add_argument("-v", "--verbose", action="store_true", help="Mostrar el detalle de la comunicación")
+    
+    tags = argparse.ArgumentParser(add_help=False)
+    tags.add_argument("--slave", type=int, default=0, help="Dirección del esclavo")
+    tags.add_argument("--register", default="0", help='Registros: "0", "0-3, 10" o con periodo "0-3@1, 100@30s"')
+    tags.add_argument("--tags", metavar="FICHERO", help="Fichero con la lista de tags (CSV con cabecera o rangos)")
+    tags.add_argument("--type", choices=POLL_TABLES, default="holding", help="Tipo de registro")
+    tags.add_argument("--datatype", choices=sorted(DATATYPES), default="uint16")
+    tags.add_argument("--scale", type=float, default=1.0, help="Factor de escala")
+    tags.add_argument("--order", choices=sorted(BYTE_ORDERS), default="ABCD",
+                      help="Orden de palabras y bytes de los valores de 32/64 bits")
+    tags.add_argument("--max-gap", type=int, default=8, help="Registros sin usar tolerados al agrupar peticiones")
+    
+    parser = argparse.ArgumentParser(description="Herramientas Modbus RTU sin interfaz gráfica")
+    commands = parser.add_subparsers(dest="command", metavar="COMANDO")
+    commands.required = True
+    
+    scan = commands.add_parser("scan", parents=[line], help="Buscar registros que parecen temperaturas")
+    scan.add_argument("--slave", type=int, default=0, help="Dirección del esclavo")
+    scan.add_argument("--passes", type=int, default=1, help="Escaneos repetidos para puntuar la estabilidad")
+    scan.add_argument("--top", type=int, default=20, help="Candidatos a mostrar (0 = todos)")
+    scan.add_argument("--min-block", type=int, default=1, help="Tamaño mínimo al partir bloques fallidos")
+    scan.set_defaults(handler=run_scan)
+    
+    test = commands.add_parser("test", parents=[line], help="Probar la comunicación con el equipo")
+    test.add_argument("--slave", type=int, default=0, help="Dirección del esclavo")
+    test.add_argument("--autodetect", action="store_true", help="Detectar antes los parámetros de línea")
+    test.set_defaults(handler=run_test)
+    
+    read = commands.add_parser("read", parents=[line, tags], help="Leer una vez una lista de tags")
+    read.set_defaults(handler=run_read)
+    
+    monitor = commands.add_parser("monitor", parents=[line, tags], help="Sondear tags de forma continua")
+    monitor.add_argument("--interval", type=float, default=1.0, help="Periodo de los tags sin periodo propio (s)")
+    monitor.add_argument("--duration", type=float, help="Segundos de monitoreo (por defecto hasta Ctrl+C)")
+    monitor.add_argument("--deadband", type=float, default=0.0, help="Solo notificar cambios mayores que este")
+    monitor.add_argument("--deadband-percent", type=float, default=0.0, help="Banda muerta en %% del último valor")
+    monitor.add_argument("--heartbeat", type=float, default=60.0, help="Notificar cada tag al menos cada N s")
+    monitor.set_defaults(handler=run_monitor)
+    
+    discover = commands.add_parser("discover", parents=[line], help="Buscar esclavos en uno o varios buses")
+    discover.add_argument("--ports", help='Buses a sondear en paralelo: "COM3, COM4@19200" (por defecto --port)')
+    discover.add_argument("--slaves", default="1-247", help='IDs a sondear: "1-247" o "1, 5, 10-20"')
+    discover.add_argument("--register", type=int, default=0, help="Registro de la lectura de prueba")
+    discover.add_argument("--type", choices=CONFIRM_TABLES, default="holding", help="Tabla de la lectura de prueba")
+    discover.add_argument("--two-phase", action="store_true", help="Barrido rápido y confirmación de candidatos")
+    discover.set_defaults(handler=run_discover, timeout=0.1)
+    return parser
+
+
+def _terminate(signum, frame):
+    # systemd detiene el servicio con SIGTERM: se trata como Ctrl+C para cerrar el bus
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Configurar logging para ver detalles de la comunicación (solo al ejecutar, no al importar)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    signal.signal(signal.SIGTERM, _terminate)
+    
+    # Reintentos y circuito por esclavo para que un equipo caído no acapare el bus
+    from fault_policy import FaultPolicy, set_fault_policy
+    set_fault_policy(FaultPolicy(retries=args.retries, failure_threshold=args.breaker_threshold,
+                                 probe_interval=args.probe_interval))
+    
+    if args.metrics_port is not None:
+        # Endpoint de Prometheus mientras dure el comando (útil con monitor como servicio)
+        from metrics import MetricsServer
+        try:
+            server = MetricsServer(args.metrics_port)
+        except OSError as e:
+            print(f"No se pudo publicar las métricas en el puerto {args.metrics_port}: {e}", file=sys.stderr)
+            return 1
+        log.info("Métricas en %s", server.url)
+    
+    out = RecordWriter(args.format, {
+        "scan": CANDIDATE_FIELDS, "test": TEST_FIELDS, "discover": DISCOVERY_FIELDS,
+    }.get(args.command, TAG_FIELDS), sys.stdout)
+    if args.format == "text":
+        return args.handler(args, out)
+    # Los datos van a stdout; los mensajes de las funciones, a stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        return args.handler(args, out)
+
 
 if __name__ == "__main__":
-    # Ejecutar la función de lectura específica del registro de temperatura
-    """read_temperature_register(
-        port='COM3',
-        baudrate=9600,
-        parity='N',
-        stopbits=1,
-        bytesize=8,
-        timeout=1,
-        slave_address=0
-    )
-    
-    # Descomentar para monitorear continuamente la temperatura
-    # (ajustar los parámetros según los resultados de la lectura inicial)
-"""
-    monitor_temperature(
-        port='COM3',
-        baudrate=9600,
-        parity='N',
-        stopbits=1,
-        bytesize=8,
-        timeout=1,
-        slave_address=0,
-        register=0,        # Ajustar según el registro correcto
-        register_type='holding',  # 'holding' o 'input'
-        scale=0.1          # Ajustar según el factor de escala correcto
-    )
+    sys.exit(main())
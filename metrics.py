@@ -0,0 +1,465 @@
+"""Métricas de cada transacción Modbus: histogramas de latencia y contadores de salud del bus.
+
+Toda llamada Modbus de las herramientas pasa por un único punto: el cliente
+prestado por el pool (``PooledClient``, transporte de hilos) o el cliente
+asíncrono del bus (``InstrumentedAsyncClient``, transporte asyncio). Allí
+se mide con reloj monótono y se anota por (puerto, esclavo, código de
+función):
+
+    - histograma de latencia de las transacciones con respuesta
+    - transacciones correctas, con excepción Modbus (por código), sin
+      respuesta (timeout), con trama ilegible (CRC) y con error de conexión
+    - reintentos (los anota quien reintenta, con ``record_retry``)
+    - bytes en la línea (trama RTU o ADU Modbus TCP, estimados por la función)
+    - tiempo de bus ocupado, incluidos los timeouts
+
+El tiempo de bus por equipo es lo que indica qué esclavo está frenando la
+línea. ``render_prometheus`` da el formato de texto de Prometheus y
+``MetricsServer`` lo publica por HTTP en ``/metrics``.
+
+Los histogramas son del estilo HDR: cubetas logarítmicas con 16
+subdivisiones lineales por potencia de dos (error relativo máximo del
+6,25 %) sobre microsegundos, así que ocupan poco y se pueden combinar.
+"""
+import time
+import math
+import logging
+import threading
+from transport import transport_of, TRANSPORT_TCP
+
+log = logging.getLogger(__name__)
+
+# Precisión del histograma: 2^SUB_BUCKET_BITS subdivisiones por potencia de dos
+SUB_BUCKET_BITS = 4
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+
+# Latencia máxima representable (µs); las mayores se anotan en la última cubeta
+MAX_LATENCY_US = 3600 * 1000000
+
+# Límites ``le`` del histograma que se publica para Prometheus (segundos)
+PROMETHEUS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Resultado de una transacción
+OUTCOME_OK = "ok"
+OUTCOME_EXCEPTION = "exception"  # Respuesta de excepción Modbus
+OUTCOME_TIMEOUT = "timeout"      # Sin respuesta
+OUTCOME_CRC = "crc"              # Llegaron bytes pero la trama no era válida
+OUTCOME_ERROR = "error"          # Puerto caído u otro error local
+OUTCOMES = (OUTCOME_OK, OUTCOME_EXCEPTION, OUTCOME_TIMEOUT, OUTCOME_CRC, OUTCOME_ERROR)
+
+# Textos de pymodbus que indican una trama recibida pero ilegible
+_GARBLED_MARKERS = ("Incomplete message", "CRC", "Invalid Message", "unpack")
+
+# Operación del cliente -> código de función
+FUNCTION_CODES = {
+    "read_coils": 1,
+    "read_discrete_inputs": 2,
+    "read_holding_registers": 3,
+    "read_input_registers": 4,
+    "write_coil": 5,
+    "write_register": 6,
+    "write_coils": 15,
+    "write_registers": 16,
+}
+
+# Bytes de la trama fuera de la PDU: dirección + CRC en RTU, cabecera MBAP en Modbus TCP
+RTU_OVERHEAD = 3
+TCP_OVERHEAD = 7
+
+
+def _bucket_index(value):
+    """Cubeta de un valor entero (µs)"""
+    if value < 2 * SUB_BUCKET_COUNT:
+        return value
+    exponent = value.bit_length() - SUB_BUCKET_BITS - 1
+    return SUB_BUCKET_COUNT * exponent + (value >> exponent)
+
+
+def _bucket_bounds(index):
+    """Menor y mayor valor (µs) de una cubeta"""
+    if index < 2 * SUB_BUCKET_COUNT:
+        return index, index
+    exponent = index // SUB_BUCKET_COUNT - 1
+    sub = index - SUB_BUCKET_COUNT * exponent
+    return sub << exponent, ((sub + 1) << exponent) - 1
+
+
+class LatencyHistogram:
+    """Histograma de latencias con precisión relativa constante"""
+
+    def __init__(self):
+        self.counts = {}  # cubeta -> transacciones
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1000000), 0), MAX_LATENCY_US)
+        index = _bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction):
+        """Latencia (s) por debajo de la cual queda ``fraction`` (0-1) de las transacciones"""
+        if not self.count:
+            return 0.0
+        target = max(1, int(math.ceil(fraction * self.count)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                # Valor más alto de la cubeta, sin pasar del máximo visto
+                return min(_bucket_bounds(index)[1] / 1000000, self.max)
+        return self.max
+
+    def cumulative(self, bounds=PROMETHEUS_BUCKETS):
+        """Transacciones con latencia menor o igual que cada límite (s)"""
+        result = [0] * len(bounds)
+        for index, count in self.counts.items():
+            high = _bucket_bounds(index)[1] / 1000000
+            for i, bound in enumerate(bounds):
+                if high <= bound:
+                    result[i] += count
+        return result
+
+
+class CallMetrics:
+    """Contadores de un (puerto, esclavo, código de función)"""
+
+    def __init__(self, port, slave, function_code):
+        self.port = port
+        self.slave = slave
+        self.function_code = function_code
+        self.latency = LatencyHistogram()
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.exception_codes = {}
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.busy_time = 0.0
+        self.last_seen = None
+
+    @property
+    def requests(self):
+        return sum(self.outcomes.values())
+
+    def row(self):
+        """Resumen para tablas y exportaciones"""
+        return {
+            "port": self.port,
+            "slave": self.slave,
+            "function": self.function_code,
+            "requests": self.requests,
+            "ok": self.outcomes[OUTCOME_OK],
+            "exceptions": self.outcomes[OUTCOME_EXCEPTION],
+            "timeouts": self.outcomes[OUTCOME_TIMEOUT],
+            "crc_errors": self.outcomes[OUTCOME_CRC],
+            "errors": self.outcomes[OUTCOME_ERROR],
+            "retries": self.retries,
+            "p50_ms": self.latency.percentile(0.5) * 1000,
+            "p99_ms": self.latency.percentile(0.99) * 1000,
+            "max_ms": (self.latency.max or 0.0) * 1000,
+            "busy_s": self.busy_time,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+def classify_outcome(response=None, error=None):
+    """Clasifica una transacción. Devuelve (resultado, código de excepción o None)"""
+    if error is not None:
+        from pymodbus.exceptions import ConnectionException, ModbusException
+        # TimeoutError (y asyncio.TimeoutError) es un OSError: hay que mirarlo antes
+        if isinstance(error, TimeoutError) or type(error).__name__ == "TimeoutError":
+            return OUTCOME_TIMEOUT, None
+        if isinstance(error, ConnectionException) or isinstance(error, OSError):
+            return OUTCOME_ERROR, None
+        if isinstance(error, ModbusException):
+            text = str(error)
+            if any(marker in text for marker in _GARBLED_MARKERS):
+                return OUTCOME_CRC, None
+            return OUTCOME_TIMEOUT, None
+        return OUTCOME_ERROR, None
+    if not hasattr(response, 'isError') or not response.isError():
+        return OUTCOME_OK, None
+    exception_code = getattr(response, 'exception_code', None)
+    if exception_code is not None:
+        return OUTCOME_EXCEPTION, exception_code
+    # pymodbus devuelve (sin lanzar) ModbusIOException cuando no hay respuesta válida
+    text = str(response)
+    if any(marker in text for marker in _GARBLED_MARKERS):
+        return OUTCOME_CRC, None
+    return OUTCOME_TIMEOUT, None
+
+
+def _call_count(name, args, kwargs):
+    """Registros o bits que mueve la operación"""
+    if name.startswith("read_"):
+        return kwargs.get("count", args[1] if len(args) > 1 else 1)
+    if name in ("write_registers", "write_coils"):
+        values = kwargs.get("values", args[1] if len(args) > 1 else ())
+        return len(values)
+    return 1
+
+
+def frame_bytes(function_code, count, outcome, transport=None):
+    """Bytes de la petición y de la respuesta en la línea (estimados por la función)"""
+    overhead = TCP_OVERHEAD if transport == TRANSPORT_TCP else RTU_OVERHEAD
+    if function_code in (15, 16):
+        data = 2 * count if function_code == 16 else (count + 7) // 8
+        request = 6 + data
+    else:
+        request = 5
+    if outcome == OUTCOME_OK:
+        if function_code in (3, 4):
+            response = 2 + 2 * count
+        elif function_code in (1, 2):
+            response = 2 + (count + 7) // 8
+        else:
+            response = 5
+    elif outcome == OUTCOME_EXCEPTION:
+        response = 2
+    else:
+        return request + overhead, 0
+    return request + overhead, response + overhead
+
+
+class MetricsRegistry:
+    """Métricas de todas las transacciones del proceso, por (puerto, esclavo, función)"""
+
+    def __init__(self):
+        self._calls = {}
+        self._transports = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def _entry(self, port, slave, function_code):
+        key = (str(port), slave, function_code)
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = CallMetrics(str(port), slave, function_code)
+            self._calls[key] = entry
+        return entry
+
+    def observe(self, port, slave, function_code, elapsed, outcome, exception_code=None, count=1):
+        """Anota una transacción terminada"""
+        transport = self._transports.get(port)
+        if transport is None:
+            transport = self._transports[port] = transport_of(port)
+        sent, received = frame_bytes(function_code, count, outcome, transport)
+        with self._lock:
+            entry = self._entry(port, slave, function_code)
+            entry.outcomes[outcome] += 1
+            entry.busy_time += elapsed
+            entry.bytes_sent += sent
+            entry.bytes_received += received
+            entry.last_seen = time.time()
+            if outcome in (OUTCOME_OK, OUTCOME_EXCEPTION):
+                entry.latency.record(elapsed)
+            if exception_code is not None:
+                entry.exception_codes[exception_code] = entry.exception_codes.get(exception_code, 0) + 1
+
+    def observe_call(self, port, name, args, kwargs, elapsed, response=None, error=None):
+        """Anota una llamada del cliente (``read_holding_registers``, ``write_coil``...)"""
+        function_code = FUNCTION_CODES.get(name)
+        if function_code is None:
+            return
+        outcome, exception_code = classify_outcome(response, error)
+        self.observe(port, kwargs.get("slave", 0), function_code, elapsed, outcome, exception_code,
+                     _call_count(name, args, kwargs))
+
+    def record_retry(self, port, slave, function_code):
+        """Anota que una transacción se va a repetir"""
+        with self._lock:
+            self._entry(port, slave, function_code).retries += 1
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self.started = time.time()
+
+    def entries(self):
+        """Copia de los contadores, del equipo que más tiempo ocupa el bus al que menos"""
+        with self._lock:
+            rows = [entry.row() for entry in self._calls.values()]
+        rows.sort(key=lambda row: (-row["busy_s"], row["port"], row["slave"], row["function"]))
+        return rows
+
+    def render_prometheus(self):
+        """Métricas en el formato de texto de Prometheus"""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            calls = sorted(self._calls.values(), key=lambda e: (e.port, e.slave, e.function_code))
+            snapshot = []
+            for entry in calls:
+                labels = (f'port="{_escape(entry.port)}",slave="{entry.slave}",'
+                          f'function="{entry.function_code}"')
+                snapshot.append((labels, entry, entry.latency.cumulative(), dict(entry.outcomes),
+                                 dict(entry.exception_codes)))
+
+        family("modbus_request_duration_seconds", "histogram",
+               "Latencia de las transacciones Modbus con respuesta")
+        for labels, entry, cumulative, _, _ in snapshot:
+            for bound, count in zip(PROMETHEUS_BUCKETS, cumulative):
+                lines.append(f'modbus_request_duration_seconds_bucket{{{labels},le="{bound:g}"}} {count}')
+            lines.append(f'modbus_request_duration_seconds_bucket{{{labels},le="+Inf"}} {entry.latency.count}')
+            lines.append(f"modbus_request_duration_seconds_sum{{{labels}}} {entry.latency.total:.6f}")
+            lines.append(f"modbus_request_duration_seconds_count{{{labels}}} {entry.latency.count}")
+
+        family("modbus_requests_total", "counter", "Transacciones Modbus por resultado")
+        for labels, _, _, outcomes, _ in snapshot:
+            for outcome, count in outcomes.items():
+                lines.append(f'modbus_requests_total{{{labels},outcome="{outcome}"}} {count}')
+
+        family("modbus_exception_responses_total", "counter", "Respuestas de excepción Modbus por código")
+        for labels, _, _, _, codes in snapshot:
+            for code, count in sorted(codes.items()):
+                lines.append(f'modbus_exception_responses_total{{{labels},code="{code}"}} {count}')
+
+        for name, attribute, help_text in (
+                ("modbus_retries_total", "retries", "Transacciones repetidas"),
+                ("modbus_bus_busy_seconds_total", "busy_time", "Tiempo de bus ocupado, incluidos los timeouts"),
+                ("modbus_bytes_sent_total", "bytes_sent", "Bytes enviados a la línea"),
+                ("modbus_bytes_received_total", "bytes_received", "Bytes recibidos de la línea")):
+            family(name, "counter", help_text)
+            for labels, entry, _, _, _ in snapshot:
+                value = getattr(entry, attribute)
+                lines.append(f"{name}{{{labels}}} {value:.6f}" if isinstance(value, float)
+                             else f"{name}{{{labels}}} {value}")
+
+        # Estado de las colas de los buses (hilos y asyncio)
+        from bus_arbiter import all_stats
+        from async_transport import all_async_stats
+        buses = all_stats() + all_async_stats()
+        for name, key, help_text in (
+                ("modbus_bus_utilization", "recent_utilization", "Fracción del tiempo reciente con el bus ocupado"),
+                ("modbus_bus_queue_depth", "queue_depth", "Trabajos en espera en la cola del bus")):
+            family(name, "gauge", help_text)
+            for stats in buses:
+                lines.append(f'{name}{{port="{_escape(stats["port"])}",backend="{stats["backend"]}"}} '
+                             f'{stats[key]:g}')
+
+        # Circuito de cada esclavo (fault_policy)
+        from fault_policy import get_fault_policy, STATE_VALUES
+        breakers = get_fault_policy().stats()
+        for name, key, kind, help_text in (
+                ("modbus_breaker_state", "state", "gauge", "Circuito del esclavo: 0 cerrado, 1 probando, 2 abierto"),
+                ("modbus_breaker_trips_total", "trips", "counter", "Veces que se abrió el circuito"),
+                ("modbus_breaker_rejected_total", "rejected", "counter",
+                 "Peticiones rechazadas sin ocupar el bus por el circuito abierto"),
+                ("modbus_timeout_seconds_total", "timeout_s", "counter",
+                 "Tiempo de bus perdido en timeouts y tramas ilegibles")):
+            family(name, kind, help_text)
+            for row in breakers:
+                value = STATE_VALUES[row[key]] if key == "state" else row[key]
+                lines.append(f'{name}{{port="{_escape(row["port"])}",slave="{row["slave"]}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_default_registry = MetricsRegistry()
+
+
+def get_metrics():
+    """Devuelve el registro de métricas compartido por todo el proceso"""
+    return _default_registry
+
+
+class InstrumentedAsyncClient:
+    """Cliente asíncrono que anota en las métricas cada llamada Modbus.
+
+    El resto de atributos (``connected``, ``pipeline_depth``, ``close``...)
+    son los del cliente envuelto.
+    """
+
+    def __init__(self, client, port, registry=None):
+        self._client = client
+        self._port = port
+        self._registry = registry or _default_registry
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in FUNCTION_CODES:
+            return attribute
+
+        async def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                response = await attribute(*args, **kwargs)
+            except Exception as e:
+                self._registry.observe_call(self._port, name, args, kwargs, time.perf_counter() - start, error=e)
+                raise
+            self._registry.observe_call(self._port, name, args, kwargs, time.perf_counter() - start, response)
+            return response
+        call.__name__ = name
+        return call
+
+
+class MetricsServer:
+    """Publica las métricas por HTTP (``GET /metrics``) en un hilo de fondo.
+
+    Args:
+        port (int): Puerto TCP (0 = uno libre)
+        host (str): Dirección de escucha
+        registry (MetricsRegistry): Métricas a publicar (por defecto las del proceso)
+    """
+
+    def __init__(self, port=9502, host="127.0.0.1", registry=None):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        registry = registry or _default_registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("Métricas: " + format, *args)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host = host
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-http")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/metrics"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,117 @@
+"""Panel de Tk con las métricas de las transacciones Modbus en vivo.
+
+Muestra una fila por (puerto, esclavo, función), ordenadas por el tiempo de
+bus que ocupan, y permite publicar las mismas métricas por HTTP en formato
+Prometheus. Lo usan modbus_gui.py (pestaña "Métricas") y slave_finder.py
+(ventana "Métricas").
+"""
+import tkinter as tk
+from tkinter import ttk
+from metrics import get_metrics, MetricsServer
+from fault_policy import get_fault_policy, STATE_NAMES
+from virtual_tree import VirtualTreeview
+
+# Cada cuánto se actualiza la tabla
+REFRESH_MS = 1000
+
+COLUMNS = [
+    ("port", "Puerto"), ("slave", "Esclavo"), ("function", "FC"), ("requests", "Peticiones"),
+    ("p50", "p50 ms"), ("p99", "p99 ms"), ("max", "Máx ms"), ("timeouts", "Timeouts"),
+    ("exceptions", "Excepciones"), ("crc", "CRC"), ("retries", "Reintentos"), ("busy", "Bus s"),
+    ("bytes", "Bytes tx/rx"), ("breaker", "Circuito"),
+]
+
+
+def _row(entry):
+    breaker = STATE_NAMES[get_fault_policy().state_of(entry["port"], entry["slave"])]
+    return (entry["port"], entry["slave"], entry["function"], entry["requests"],
+            f"{entry['p50_ms']:.1f}", f"{entry['p99_ms']:.1f}", f"{entry['max_ms']:.1f}",
+            entry["timeouts"], entry["exceptions"], entry["crc_errors"], entry["retries"],
+            f"{entry['busy_s']:.2f}", f"{entry['bytes_sent']}/{entry['bytes_received']}", breaker)
+
+
+class MetricsPanel(ttk.Frame):
+    """Tabla de métricas por equipo y función, con publicación opcional en ``/metrics``.
+
+    Args:
+        parent: Widget contenedor
+        registry (MetricsRegistry): Métricas a mostrar (por defecto las del proceso)
+        on_status (callable): on_status(mensaje) para avisos en la barra de estado
+    """
+
+    def __init__(self, parent, registry=None, on_status=None):
+        super().__init__(parent)
+        self.registry = registry or get_metrics()
+        self.on_status = on_status
+        self.server = None
+        self.rows = []
+        self.http_port_var = tk.IntVar(value=9502)
+        self.summary_var = tk.StringVar(value="Sin transacciones")
+
+        self.tree = VirtualTreeview(self, COLUMNS, source=self.rows, formatter=_row,
+                                    widths={"port": 140, "slave": 60, "function": 40, "requests": 80,
+                                            "p50": 70, "p99": 70, "max": 70, "timeouts": 70,
+                                            "exceptions": 80, "crc": 50, "retries": 80, "busy": 70,
+                                            "bytes": 110, "breaker": 80},
+                                    anchors={column_id: tk.E for column_id, _ in COLUMNS[1:]})
+        self.tree.pack(fill=tk.BOTH, expand=True)
+
+        controls = ttk.Frame(self)
+        controls.pack(fill=tk.X, pady=5)
+        ttk.Label(controls, textvariable=self.summary_var).pack(side=tk.LEFT, padx=5)
+        ttk.Button(controls, text="Reiniciar", command=self.reset).pack(side=tk.RIGHT, padx=5)
+        self.http_button = ttk.Button(controls, text="Publicar /metrics", command=self.toggle_server)
+        self.http_button.pack(side=tk.RIGHT, padx=5)
+        ttk.Entry(controls, textvariable=self.http_port_var, width=7).pack(side=tk.RIGHT)
+        ttk.Label(controls, text="Puerto HTTP:").pack(side=tk.RIGHT, padx=(5, 2))
+
+        self.after(REFRESH_MS, self.refresh)
+
+    def refresh(self):
+        """Vuelve a leer las métricas y redibuja la tabla"""
+        self.rows[:] = self.registry.entries()
+        self.tree.refresh()
+        requests = sum(row["requests"] for row in self.rows)
+        timeouts = sum(row["timeouts"] for row in self.rows)
+        if requests:
+            breakers = get_fault_policy().stats()
+            waiting = sum(1 for row in breakers if row["state"] != "closed")
+            lost = sum(row["timeout_s"] for row in breakers)
+            self.summary_var.set(f"{requests} transacciones, {timeouts} timeouts ({lost:.1f} s de bus), "
+                                 f"{waiting} esclavo(s) con el circuito abierto")
+        self.after(REFRESH_MS, self.refresh)
+
+    def reset(self):
+        self.registry.reset()
+        get_fault_policy().reset()
+        self.summary_var.set("Sin transacciones")
+        self.rows[:] = []
+        self.tree.refresh()
+
+    def toggle_server(self):
+        """Arranca o detiene el endpoint HTTP de Prometheus"""
+        if self.server is not None:
+            self.stop_server()
+            self._status("Endpoint de métricas detenido")
+            return
+        try:
+            self.server = MetricsServer(self.http_port_var.get(), registry=self.registry)
+        except (OSError, tk.TclError) as e:
+            self._status(f"No se pudo publicar las métricas: {e}")
+            return
+        self.http_button.config(text="Detener /metrics")
+        self._status(f"Métricas publicadas en {self.server.url}")
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+            self.http_button.config(text="Publicar /metrics")
+
+    def _status(self, message):
+        if self.on_status:
+            self.on_status(message)
+
+    def destroy(self):
+        self.stop_server()
+        super().destroy()
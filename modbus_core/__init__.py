@@ -0,0 +1,85 @@
+"""Núcleo Modbus sin interfaz gráfica: transporte, sondeo, decodificación e historial.
+
+Reúne en un único punto de entrada la lógica que usan modbus_gui.py,
+slave_finder.py y main.py, para scripts, servicios y tareas de cron que no
+necesitan Tk::
+
+    from modbus_core import open_bus, Tag, PollingEngine
+
+Importar el paquete es casi gratis: cada nombre se carga de su módulo la
+primera vez que se usa, y pymodbus y asyncio solo se importan al abrir un
+puerto real o el transporte asyncio. ``python benchmarks/import_time.py``
+mide el tiempo de arranque de cada punto de entrada.
+"""
+import importlib
+
+# Nombre público -> módulo que lo define
+_EXPORTS = {
+    # Transporte
+    "open_bus": "async_transport",
+    "shutdown_backends": "async_transport",
+    "BACKENDS": "async_transport",
+    "BACKEND_THREADS": "async_transport",
+    "BACKEND_ASYNCIO": "async_transport",
+    "create_modbus_client": "transport",
+    "create_async_client": "transport",
+    "PipelinedTcpClient": "transport",
+    "get_default_pool": "connection_pool",
+    "ConnectionPool": "connection_pool",
+    "PRIORITY_WRITE": "bus_arbiter",
+    "PRIORITY_INTERACTIVE": "bus_arbiter",
+    "PRIORITY_POLL": "bus_arbiter",
+    "PRIORITY_BACKGROUND": "bus_arbiter",
+    # Sondeo
+    "Tag": "polling",
+    "TagValue": "polling",
+    "PollingEngine": "polling",
+    "plan_requests": "polling",
+    "parse_register_list": "polling",
+    "PollScheduler": "scheduler",
+    "parse_rate_list": "scheduler",
+    "ChangeFilter": "change_detect",
+    # Decodificación
+    "RegisterFormat": "decoding",
+    "parse_order": "decoding",
+    "format_scaled": "decoding",
+    "DATATYPES": "decoding",
+    "BYTE_ORDERS": "decoding",
+    # Historial y grabación
+    "HistoryStore": "history_store",
+    "TimeSeriesRecorder": "recorder",
+    # Exploración de la red
+    "DiscoveryEngine": "discovery",
+    "parse_bus_list": "discovery",
+    "LineDetector": "autodetect",
+    "AdaptiveScanner": "adaptive_scanner",
+    "CandidateFinder": "candidates",
+    # Métricas
+    "get_metrics": "metrics",
+    "MetricsRegistry": "metrics",
+    "MetricsServer": "metrics",
+    "LatencyHistogram": "metrics",
+    "FaultPolicy": "fault_policy",
+    "get_fault_policy": "fault_policy",
+    "set_fault_policy": "fault_policy",
+    # Simulación
+    "SlaveFarm": "simulator",
+    "Simulator": "simulator",
+    "build_farm": "simulator",
+    "load_farm": "simulator",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value  # Las siguientes consultas no pasan por aquí
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
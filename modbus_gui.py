@@ -2,17 +2,31 @@ import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import time
 import threading
-from pymodbus.client import ModbusSerialClient
-from pymodbus.exceptions import ModbusException
+import queue
 import logging
-import json
 import os
 from datetime import datetime
+from collections import deque
+from connection_pool import get_default_pool
+from bus_arbiter import (all_stats, PRIORITY_WRITE,
+                         PRIORITY_INTERACTIVE, PRIORITY_POLL, PRIORITY_BACKGROUND)
+from async_transport import (open_bus, all_async_stats, shutdown_backends,
+                             BACKENDS, BACKEND_THREADS)
+from adaptive_scanner import AdaptiveScanner, ProfileStore, ScanAborted
+from polling import Tag
+from history_store import HistoryStore
+from decoding import RegisterFormat, DATATYPE_WORDS, BYTE_ORDERS, parse_order, format_scaled, format_array
+from scheduler import PollScheduler, parse_rate_list
+from change_detect import ChangeFilter
+from virtual_tree import VirtualTreeview
+from metrics_panel import MetricsPanel
+from recorder import TimeSeriesRecorder, QUALITY_GOOD, QUALITY_BAD, QUALITY_COMM_ERROR, now_ms
 
-# Configurar logging
-logging.basicConfig()
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+log = logging.getLogger(__name__)
+
+# Vaciado de la cola del escáner: cada cuánto y cuánto tiempo como máximo por lote
+SCAN_DRAIN_INTERVAL_MS = 100
+SCAN_DRAIN_BUDGET = 0.05
 
 class ModbusRTUApp:
     def __init__(self, root):
@@ -29,6 +43,7 @@ class ModbusRTUApp:
         self.bytesize_var = tk.IntVar(value=8)
         self.timeout_var = tk.DoubleVar(value=1.0)
         self.slave_var = tk.IntVar(value=0)
+        self.backend_var = tk.StringVar(value=BACKEND_THREADS)
         
         # Variables para operaciones
         self.register_var = tk.IntVar(value=0)
@@ -39,17 +54,61 @@ class ModbusRTUApp:
         self.auto_refresh_var = tk.BooleanVar(value=False)
         self.refresh_rate_var = tk.DoubleVar(value=1.0)
         
+        # Variables del monitor multi-registro
+        self.monitor_registers_var = tk.StringVar(value="0")
+        self.monitor_datatype_var = tk.StringVar(value="uint16")
+        self.monitor_order_var = tk.StringVar(value="ABCD")
+        self.monitor_max_gap_var = tk.IntVar(value=8)
+        self.monitor_record_var = tk.BooleanVar(value=True)
+        # Copia que lee el hilo del monitor (las variables de Tk solo desde el hilo de la GUI)
+        self.monitor_record = True
+        self.monitor_record_var.trace_add("write", lambda *_: setattr(
+            self, "monitor_record", self.monitor_record_var.get()))
+        self.monitor_deadband_var = tk.DoubleVar(value=0.0)
+        self.monitor_deadband_percent_var = tk.DoubleVar(value=0.0)
+        self.monitor_heartbeat_var = tk.DoubleVar(value=60.0)
+        self.record_bucket_var = tk.DoubleVar(value=0)
+        
         # Variables para monitoreo
         self.monitoring = False
-        self.monitor_thread = None
-        self.client = None
+        self.monitor_bus = None
+        self.monitor_scheduler = None
+        self.monitor_first_address = None
+        self.monitor_filter = None
+        
+        # Variables para el escaneo en segundo plano
+        self.scanning = False
+        self.scan_thread = None
+        self.scan_queue = None
+        self.active_scanner = None
         self.read_values = []
         
-        # Historial de comandos
-        self.command_history = []
-        self.history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modbus_history.json")
+        # Datos de las tablas (la interfaz solo dibuja las filas visibles)
+        self.monitor_max_samples = 10000
+        self.monitor_samples = deque(maxlen=self.monitor_max_samples)
+        self.scan_results = []
+        
+        # Conexiones persistentes compartidas (se abren una vez por puerto)
+        self.connection_pool = get_default_pool()
+        
+        # Historial de comandos (acotado; las repeticiones se agrupan en un registro)
+        self.history_max_entries = 5000
+        self.command_history = deque(maxlen=self.history_max_entries)
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.history_file = os.path.join(base_dir, "modbus_history.jsonl")
+        # Solo anexado: cada operación añade una línea; el JSON antiguo se migra una vez
+        self.history_store = HistoryStore(self.history_file,
+                                          legacy_path=os.path.join(base_dir, "modbus_history.json"),
+                                          max_entries=self.history_max_entries)
         self.load_history()
         
+        # Perfiles de escaneo (mejor tamaño de bloque y huecos por equipo)
+        self.scan_profiles = ProfileStore(os.path.join(base_dir, "scan_profiles.json"))
+        
+        # Grabación de todas las muestras del monitor (segmentos binarios por hora)
+        self.recorder = TimeSeriesRecorder(os.path.join(base_dir, "recordings"), retention_days=180)
+        self.record_session_start = None
+        
         # Crear interfaz
         self.create_widgets()
         
@@ -77,16 +136,31 @@ class ModbusRTUApp:
         history_frame = ttk.Frame(notebook, padding=10)
         notebook.add(history_frame, text="Historial")
         
+        # Pestaña 5: Métricas de las transacciones (latencia y errores por equipo)
+        metrics_frame = ttk.Frame(notebook, padding=10)
+        notebook.add(metrics_frame, text="Métricas")
+        
         # Configurar cada pestaña
         self.setup_operations_tab(operations_frame)
         self.setup_monitor_tab(monitor_frame)
         self.setup_scanner_tab(scanner_frame)
         self.setup_history_tab(history_frame)
+        self.metrics_panel = MetricsPanel(metrics_frame, on_status=self.update_status)
+        self.metrics_panel.pack(fill=tk.BOTH, expand=True)
         
         # Barra de estado
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        
         self.status_var = tk.StringVar(value="Listo")
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
-        status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        # Estado del bus: profundidad de cola y utilización
+        self.bus_stats_var = tk.StringVar(value="")
+        ttk.Label(status_frame, textvariable=self.bus_stats_var, relief=tk.SUNKEN,
+                  anchor=tk.E, width=40).pack(side=tk.RIGHT)
+        self.root.after(1000, self.update_bus_stats)
     
     def setup_operations_tab(self, parent):
         # Dividir en dos paneles
@@ -126,6 +200,10 @@ class ModbusRTUApp:
         ttk.Label(config_frame, text="Dirección esclavo:").grid(row=6, column=0, sticky=tk.W, pady=2)
         ttk.Entry(config_frame, textvariable=self.slave_var, width=15).grid(row=6, column=1, sticky=tk.W, pady=2)
         
+        ttk.Label(config_frame, text="Transporte:").grid(row=7, column=0, sticky=tk.W, pady=2)
+        ttk.Combobox(config_frame, textvariable=self.backend_var, 
+                    values=list(BACKENDS), width=13).grid(row=7, column=1, sticky=tk.W, pady=2)
+        
         # Panel izquierdo: Operaciones
         operations_frame = ttk.LabelFrame(left_frame, text="Operaciones Modbus", padding=10)
         operations_frame.pack(fill=tk.BOTH, expand=True)
@@ -184,17 +262,27 @@ class ModbusRTUApp:
         frame1 = ttk.Frame(config_frame)
         frame1.pack(fill=tk.X, pady=5)
         
-        ttk.Label(frame1, text="Registro:").pack(side=tk.LEFT, padx=5)
-        ttk.Entry(frame1, textvariable=self.register_var, width=8).pack(side=tk.LEFT, padx=5)
+        ttk.Label(frame1, text="Registros:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(frame1, textvariable=self.monitor_registers_var, width=16).pack(side=tk.LEFT, padx=5)
         
         ttk.Label(frame1, text="Tipo:").pack(side=tk.LEFT, padx=5)
         ttk.Combobox(frame1, textvariable=self.register_type_var, 
                     values=["holding", "input"], width=10).pack(side=tk.LEFT, padx=5)
         
+        ttk.Label(frame1, text="Dato:").pack(side=tk.LEFT, padx=5)
+        ttk.Combobox(frame1, textvariable=self.monitor_datatype_var, 
+                    values=[name for name in DATATYPE_WORDS if name != "bit"], width=8).pack(side=tk.LEFT, padx=5)
+        
+        # Orden de palabras y bytes de los valores de 32/64 bits
+        ttk.Label(frame1, text="Orden:").pack(side=tk.LEFT, padx=5)
+        ttk.Combobox(frame1, textvariable=self.monitor_order_var, 
+                    values=list(BYTE_ORDERS), width=6).pack(side=tk.LEFT, padx=5)
+        
         ttk.Label(frame1, text="Escala:").pack(side=tk.LEFT, padx=5)
         ttk.Combobox(frame1, textvariable=self.scale_var, 
                     values=[1.0, 0.1, 0.01, 0.001], width=8).pack(side=tk.LEFT, padx=5)
         
+        # Periodo por defecto de los registros sin "@periodo" (p. ej. "0-3@1, 100@30s, 200@200ms")
         ttk.Label(frame1, text="Intervalo (s):").pack(side=tk.LEFT, padx=5)
         ttk.Entry(frame1, textvariable=self.refresh_rate_var, width=5).pack(side=tk.LEFT, padx=5)
         
@@ -205,6 +293,28 @@ class ModbusRTUApp:
         self.monitor_stop_button = ttk.Button(frame1, text="Detener", command=self.stop_monitoring, state=tk.DISABLED)
         self.monitor_stop_button.pack(side=tk.LEFT, padx=5)
         
+        # Fila 2: agrupación de peticiones
+        frame2 = ttk.Frame(config_frame)
+        frame2.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(frame2, text="Hueco máx. al agrupar:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(frame2, textvariable=self.monitor_max_gap_var, width=5).pack(side=tk.LEFT, padx=5)
+        
+        # Solo se muestran y graban los cambios mayores que la banda muerta (o el latido)
+        ttk.Label(frame2, text="Banda muerta:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(frame2, textvariable=self.monitor_deadband_var, width=5).pack(side=tk.LEFT, padx=5)
+        ttk.Label(frame2, text="%:").pack(side=tk.LEFT)
+        ttk.Entry(frame2, textvariable=self.monitor_deadband_percent_var, width=5).pack(side=tk.LEFT, padx=5)
+        ttk.Label(frame2, text="Latido (s):").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(frame2, textvariable=self.monitor_heartbeat_var, width=5).pack(side=tk.LEFT, padx=5)
+        
+        self.monitor_plan_var = tk.StringVar(value="")
+        ttk.Label(frame2, textvariable=self.monitor_plan_var).pack(side=tk.LEFT, padx=5)
+        
+        # Jitter y vencimientos perdidos del planificador
+        self.monitor_sched_var = tk.StringVar(value="")
+        ttk.Label(frame2, textvariable=self.monitor_sched_var).pack(side=tk.LEFT, padx=5)
+        
         # Panel inferior: Visualización
         display_frame = ttk.LabelFrame(parent, text="Monitor de valores", padding=10)
         display_frame.pack(fill=tk.BOTH, expand=True)
@@ -219,20 +329,13 @@ class ModbusRTUApp:
         history_frame.pack(fill=tk.BOTH, expand=True, pady=5)
         
         # Tabla para el historial
-        columns = ("timestamp", "value", "formatted")
-        self.monitor_tree = ttk.Treeview(history_frame, columns=columns, show="headings")
-        self.monitor_tree.heading("timestamp", text="Hora")
-        self.monitor_tree.heading("value", text="Valor (raw)")
-        self.monitor_tree.heading("formatted", text="Valor formateado")
-        self.monitor_tree.column("timestamp", width=100)
-        self.monitor_tree.column("value", width=100)
-        self.monitor_tree.column("formatted", width=150)
-        self.monitor_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # Scrollbar para la tabla
-        scrollbar = ttk.Scrollbar(history_frame, orient=tk.VERTICAL, command=self.monitor_tree.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.monitor_tree.configure(yscrollcommand=scrollbar.set)
+        columns = [("timestamp", "Hora"), ("register", "Registro"),
+                   ("value", "Valor (raw)"), ("formatted", "Valor formateado")]
+        self.monitor_tree = VirtualTreeview(history_frame, columns, source=self.monitor_samples,
+                                            newest_first=True,
+                                            widths={"timestamp": 100, "register": 80,
+                                                    "value": 100, "formatted": 150})
+        self.monitor_tree.pack(fill=tk.BOTH, expand=True)
         
         # Botones para exportar datos
         export_frame = ttk.Frame(display_frame)
@@ -240,6 +343,11 @@ class ModbusRTUApp:
         
         ttk.Button(export_frame, text="Exportar a CSV", command=self.export_monitor_data).pack(side=tk.LEFT, padx=5)
         ttk.Button(export_frame, text="Limpiar historial", command=self.clear_monitor_history).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Checkbutton(export_frame, text="Grabar en disco", variable=self.monitor_record_var).pack(side=tk.LEFT, padx=5)
+        ttk.Label(export_frame, text="Resolución (s, 0 = todo):").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(export_frame, textvariable=self.record_bucket_var, width=6).pack(side=tk.LEFT, padx=5)
+        ttk.Button(export_frame, text="Exportar grabación", command=self.export_recording).pack(side=tk.LEFT, padx=5)
     
     def setup_scanner_tab(self, parent):
         # Panel superior: Configuración del escáner
@@ -263,32 +371,41 @@ class ModbusRTUApp:
         ttk.Combobox(frame1, textvariable=self.scan_type_var, 
                     values=["holding", "input", "both"], width=10).pack(side=tk.LEFT, padx=5)
         
+        # Tamaño mínimo al partir bloques: 1 aísla cada registro, valores mayores
+        # aceleran mapas completos marcando huecos más gruesos
+        ttk.Label(frame1, text="Resolución:").pack(side=tk.LEFT, padx=5)
+        self.scan_min_block_var = tk.IntVar(value=1)
+        ttk.Entry(frame1, textvariable=self.scan_min_block_var, width=5).pack(side=tk.LEFT, padx=5)
+        
         # Botones de control
-        ttk.Button(frame1, text="Iniciar Escaneo", command=self.start_scanning).pack(side=tk.LEFT, padx=5)
+        self.scan_start_button = ttk.Button(frame1, text="Iniciar Escaneo", command=self.start_scanning)
+        self.scan_start_button.pack(side=tk.LEFT, padx=5)
+        
+        self.scan_stop_button = ttk.Button(frame1, text="Detener", command=self.stop_scanning, state=tk.DISABLED)
+        self.scan_stop_button.pack(side=tk.LEFT, padx=5)
+        
+        # Barra de progreso del escaneo
+        progress_frame = ttk.Frame(config_frame)
+        progress_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(progress_frame, text="Progreso:").pack(side=tk.LEFT, padx=5)
+        self.scan_progress_var = tk.StringVar(value="0 / 0")
+        ttk.Label(progress_frame, textvariable=self.scan_progress_var).pack(side=tk.LEFT, padx=5)
+        
+        self.scan_progress_bar = ttk.Progressbar(progress_frame, orient=tk.HORIZONTAL, length=100, mode='determinate')
+        self.scan_progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
         
         # Panel inferior: Resultados del escaneo
         results_frame = ttk.LabelFrame(parent, text="Resultados del escaneo", padding=10)
         results_frame.pack(fill=tk.BOTH, expand=True)
         
         # Tabla para los resultados
-        columns = ("address", "type", "value_dec", "value_hex", "value_scaled")
-        self.scan_tree = ttk.Treeview(results_frame, columns=columns, show="headings")
-        self.scan_tree.heading("address", text="Dirección")
-        self.scan_tree.heading("type", text="Tipo")
-        self.scan_tree.heading("value_dec", text="Valor (Dec)")
-        self.scan_tree.heading("value_hex", text="Valor (Hex)")
-        self.scan_tree.heading("value_scaled", text="Valor (÷10)")
-        self.scan_tree.column("address", width=80)
-        self.scan_tree.column("type", width=80)
-        self.scan_tree.column("value_dec", width=100)
-        self.scan_tree.column("value_hex", width=100)
-        self.scan_tree.column("value_scaled", width=100)
-        self.scan_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # Scrollbar para la tabla
-        scrollbar = ttk.Scrollbar(results_frame, orient=tk.VERTICAL, command=self.scan_tree.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.scan_tree.configure(yscrollcommand=scrollbar.set)
+        columns = [("address", "Dirección"), ("type", "Tipo"), ("value_dec", "Valor (Dec)"),
+                   ("value_hex", "Valor (Hex)"), ("value_scaled", "Valor (÷10)")]
+        self.scan_tree = VirtualTreeview(results_frame, columns, source=self.scan_results,
+                                         widths={"address": 80, "type": 80, "value_dec": 100,
+                                                 "value_hex": 100, "value_scaled": 100})
+        self.scan_tree.pack(fill=tk.BOTH, expand=True)
         
         # Botones para exportar datos
         export_frame = ttk.Frame(results_frame)
@@ -303,22 +420,15 @@ class ModbusRTUApp:
         history_frame.pack(fill=tk.BOTH, expand=True)
         
         # Tabla para el historial
-        columns = ("timestamp", "operation", "parameters", "result")
-        self.history_tree = ttk.Treeview(history_frame, columns=columns, show="headings")
-        self.history_tree.heading("timestamp", text="Fecha/Hora")
-        self.history_tree.heading("operation", text="Operación")
-        self.history_tree.heading("parameters", text="Parámetros")
-        self.history_tree.heading("result", text="Resultado")
-        self.history_tree.column("timestamp", width=150)
-        self.history_tree.column("operation", width=100)
-        self.history_tree.column("parameters", width=300)
-        self.history_tree.column("result", width=200)
-        self.history_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # Scrollbar para la tabla
-        scrollbar = ttk.Scrollbar(history_frame, orient=tk.VERTICAL, command=self.history_tree.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.history_tree.configure(yscrollcommand=scrollbar.set)
+        columns = [("timestamp", "Fecha/Hora"), ("operation", "Operación"), ("parameters", "Parámetros"),
+                   ("result", "Resultado"), ("count", "Veces")]
+        self.history_tree = VirtualTreeview(history_frame, columns, source=self.command_history,
+                                            formatter=self.history_row, newest_first=True,
+                                            widths={"timestamp": 150, "operation": 100, "parameters": 300,
+                                                    "result": 200, "count": 60},
+                                            anchors={"count": tk.CENTER})
+        self.history_tree.pack(fill=tk.BOTH, expand=True)
+        self.history_tree.refresh()
         
         # Botones para el historial
         button_frame = ttk.Frame(parent)
@@ -331,161 +441,128 @@ class ModbusRTUApp:
         ttk.Button(button_frame, text="Exportar historial", 
                   command=self.export_history).pack(side=tk.LEFT, padx=5)
     
-    def create_modbus_client(self):
-        """Crea y conecta un cliente Modbus RTU con la configuración actual"""
-        try:
-            client = ModbusSerialClient(
-                port=self.port_var.get(),
-                baudrate=self.baudrate_var.get(),
-                parity=self.parity_var.get(),
-                stopbits=self.stopbits_var.get(),
-                bytesize=self.bytesize_var.get(),
-                timeout=self.timeout_var.get()
-            )
-            
-            connection = client.connect()
-            if not connection:
-                self.update_status(f"No se pudo conectar al puerto {self.port_var.get()}")
-                return None
-            
-            self.update_status(f"Conectado a {self.port_var.get()}")
-            return client
+    def get_connection_settings(self):
+        """Devuelve la configuración de comunicación actual"""
+        return {
+            "port": self.port_var.get(),
+            "baudrate": self.baudrate_var.get(),
+            "parity": self.parity_var.get(),
+            "stopbits": self.stopbits_var.get(),
+            "bytesize": self.bytesize_var.get(),
+            "timeout": self.timeout_var.get()
+        }
+    
+    def get_modbus_bus(self):
+        """Obtiene el acceso al bus del puerto actual.
+        
+        Todas las transacciones de un mismo puerto (botones, auto-refresh,
+        monitor y escáner) pasan por una única cola que las serializa: un
+        hilo por puerto o el bucle asyncio compartido, según el transporte.
+        Un puerto ``loop://demo`` usa un equipo simulado en memoria.
+        """
+        return open_bus(self.backend_var.get(), pool=self.connection_pool, **self.get_connection_settings())
+    
+    def read_registers(self, priority=PRIORITY_INTERACTIVE):
+        """Lee registros Modbus según la configuración actual (devuelve un Future)"""
+        register = self.register_var.get()
+        count = self.count_var.get()
+        slave = self.slave_var.get()
+        register_type = self.register_type_var.get()
+        scale = self.scale_var.get()
         
-        except Exception as e:
-            self.update_status(f"Error al crear cliente Modbus: {e}")
+        if register_type not in ["holding", "input", "coil", "discrete_input"]:
+            self.root.after(0, self.update_results, f"Tipo de registro no válido: {register_type}")
             return None
-    
-    def read_registers(self):
-        """Lee registros Modbus según la configuración actual"""
-        client = self.create_modbus_client()
-        if not client:
-            return
         
+        future = self.get_modbus_bus().read(register_type, register, count, slave, priority=priority)
+        future.add_done_callback(lambda f: self.root.after(
+            0, self.show_read_result, f, register_type, register, count, slave, scale))
+        return future
+    
+    def show_read_result(self, future, register_type, register, count, slave, scale):
+        """Muestra el resultado de una lectura terminada"""
+        parameters = f"Tipo: {register_type}, Reg: {register}, Count: {count}, Slave: {slave}"
         try:
-            register = self.register_var.get()
-            count = self.count_var.get()
-            slave = self.slave_var.get()
-            register_type = self.register_type_var.get()
-            scale = self.scale_var.get()
-            
-            # Leer según el tipo de registro
-            if register_type == "holding":
-                response = client.read_holding_registers(register, count, slave=slave)
-            elif register_type == "input":
-                response = client.read_input_registers(register, count, slave=slave)
-            elif register_type == "coil":
-                response = client.read_coils(register, count, slave=slave)
-            elif register_type == "discrete_input":
-                response = client.read_discrete_inputs(register, count, slave=slave)
-            else:
-                self.update_results(f"Tipo de registro no válido: {register_type}")
-                client.close()
-                return
-            
-            # Procesar respuesta
-            if not hasattr(response, 'isError') or not response.isError():
-                if register_type in ["holding", "input"]:
-                    self.update_results(f"Lectura exitosa de {count} registros {register_type} desde {register}:")
-                    for i, value in enumerate(response.registers):
-                        addr = register + i
-                        scaled_value = value * scale
-                        
-                        # Formatear según escala
-                        if scale == 1:
-                            formatted = f"{scaled_value}"
-                        elif scale == 0.1:
-                            formatted = f"{scaled_value:.1f}"
-                        elif scale == 0.01:
-                            formatted = f"{scaled_value:.2f}"
-                        else:
-                            formatted = f"{scaled_value:.3f}"
-                        
-                        self.update_results(f"  Registro {addr}: {value} (0x{value:04X}) → {formatted}")
-                else:
-                    self.update_results(f"Lectura exitosa de {count} bits {register_type} desde {register}:")
-                    for i, value in enumerate(response.bits):
-                        addr = register + i
-                        self.update_results(f"  Bit {addr}: {value}")
-                
-                # Guardar en historial
-                self.add_to_history("Lectura", 
-                                   f"Tipo: {register_type}, Reg: {register}, Count: {count}, Slave: {slave}",
-                                   "Exitoso")
-            else:
-                self.update_results(f"Error al leer registros: {response}")
-                self.add_to_history("Lectura", 
-                                   f"Tipo: {register_type}, Reg: {register}, Count: {count}, Slave: {slave}",
-                                   f"Error: {response}")
-        
+            response = future.result()
         except Exception as e:
             self.update_results(f"Error: {e}")
-            self.add_to_history("Lectura", 
-                               f"Tipo: {register_type}, Reg: {register}, Count: {count}, Slave: {slave}",
-                               f"Excepción: {e}")
-        
-        finally:
-            client.close()
-    
-    def write_register(self):
-        """Escribe en un registro Modbus según la configuración actual"""
-        client = self.create_modbus_client()
-        if not client:
+            self.update_status(f"Error: {e}")
+            self.add_to_history("Lectura", parameters, f"Excepción: {e}")
             return
         
-        try:
-            register = self.register_var.get()
-            slave = self.slave_var.get()
-            register_type = self.register_type_var.get()
-            value_str = self.write_value_var.get()
-            
-            # Convertir valor según el tipo de registro
+        # Procesar respuesta
+        if not hasattr(response, 'isError') or not response.isError():
             if register_type in ["holding", "input"]:
-                try:
-                    # Verificar si es un valor decimal con punto
-                    if '.' in value_str:
-                        float_value = float(value_str)
-                        scale = self.scale_var.get()
-                        value = int(float_value / scale)
-                    else:
-                        value = int(value_str)
-                except ValueError:
-                    self.update_results(f"Valor no válido: {value_str}")
-                    client.close()
-                    return
-            else:
-                # Para coils, convertir a booleano
-                value = value_str.lower() in ['1', 'true', 't', 'yes', 'y', 'on']
-            
-            # Escribir según el tipo de registro
-            if register_type == "holding":
-                response = client.write_register(register, value, slave=slave)
-            elif register_type == "coil":
-                response = client.write_coil(register, value, slave=slave)
+                self.update_results(f"Lectura exitosa de {count} registros {register_type} desde {register}:")
+                # Escalado y formato de todo el bloque de una vez
+                registers = response.registers
+                formatted = format_array(RegisterFormat("uint16", scale).decode_array(registers), scale)
+                for i, (value, text) in enumerate(zip(registers, formatted)):
+                    self.update_results(f"  Registro {register + i}: {value} (0x{value:04X}) → {text}")
             else:
-                self.update_results(f"No se puede escribir en registro tipo: {register_type}")
-                client.close()
-                return
+                self.update_results(f"Lectura exitosa de {count} bits {register_type} desde {register}:")
+                for i, value in enumerate(response.bits):
+                    addr = register + i
+                    self.update_results(f"  Bit {addr}: {value}")
             
-            # Procesar respuesta
-            if not hasattr(response, 'isError') or not response.isError():
-                self.update_results(f"Escritura exitosa en registro {register_type} {register}: {value}")
-                self.add_to_history("Escritura", 
-                                   f"Tipo: {register_type}, Reg: {register}, Valor: {value}, Slave: {slave}",
-                                   "Exitoso")
-            else:
-                self.update_results(f"Error al escribir en registro: {response}")
-                self.add_to_history("Escritura", 
-                                   f"Tipo: {register_type}, Reg: {register}, Valor: {value}, Slave: {slave}",
-                                   f"Error: {response}")
+            # Guardar en historial
+            self.add_to_history("Lectura", parameters, "Exitoso")
+        else:
+            self.update_results(f"Error al leer registros: {response}")
+            self.add_to_history("Lectura", parameters, f"Error: {response}")
+    
+    def write_register(self):
+        """Escribe en un registro Modbus según la configuración actual (devuelve un Future)"""
+        register = self.register_var.get()
+        slave = self.slave_var.get()
+        register_type = self.register_type_var.get()
+        value_str = self.write_value_var.get()
+        
+        # Convertir valor según el tipo de registro
+        if register_type in ["holding", "input"]:
+            try:
+                # Verificar si es un valor decimal con punto
+                if '.' in value_str:
+                    float_value = float(value_str)
+                    scale = self.scale_var.get()
+                    value = int(float_value / scale)
+                else:
+                    value = int(value_str)
+            except ValueError:
+                self.update_results(f"Valor no válido: {value_str}")
+                return None
+        else:
+            # Para coils, convertir a booleano
+            value = value_str.lower() in ['1', 'true', 't', 'yes', 'y', 'on']
+        
+        if register_type not in ["holding", "coil"]:
+            self.update_results(f"No se puede escribir en registro tipo: {register_type}")
+            return None
         
+        # Las escrituras tienen la máxima prioridad en la cola del bus
+        future = self.get_modbus_bus().write(register_type, register, value, slave, priority=PRIORITY_WRITE)
+        future.add_done_callback(lambda f: self.root.after(
+            0, self.show_write_result, f, register_type, register, value, slave))
+        return future
+    
+    def show_write_result(self, future, register_type, register, value, slave):
+        """Muestra el resultado de una escritura terminada"""
+        parameters = f"Tipo: {register_type}, Reg: {register}, Valor: {value}, Slave: {slave}"
+        try:
+            response = future.result()
         except Exception as e:
             self.update_results(f"Error: {e}")
-            self.add_to_history("Escritura", 
-                               f"Tipo: {register_type}, Reg: {register}, Valor: {value_str}, Slave: {slave}",
-                               f"Excepción: {e}")
+            self.update_status(f"Error: {e}")
+            self.add_to_history("Escritura", parameters, f"Excepción: {e}")
+            return
         
-        finally:
-            client.close()
+        # Procesar respuesta
+        if not hasattr(response, 'isError') or not response.isError():
+            self.update_results(f"Escritura exitosa en registro {register_type} {register}: {value}")
+            self.add_to_history("Escritura", parameters, "Exitoso")
+        else:
+            self.update_results(f"Error al escribir en registro: {response}")
+            self.add_to_history("Escritura", parameters, f"Error: {response}")
     
     def toggle_auto_refresh(self):
         """Activa o desactiva la actualización automática de lecturas"""
@@ -513,7 +590,13 @@ class ModbusRTUApp:
     def auto_refresh_loop(self):
         """Bucle para actualización automática de lecturas"""
         while self.auto_refreshing:
-            self.read_registers()
+            future = self.read_registers(priority=PRIORITY_POLL)
+            if future is not None:
+                # Esperar la respuesta para no acumular lecturas en la cola del bus
+                try:
+                    future.result()
+                except Exception:
+                    pass  # El error ya se muestra en show_read_result
             time.sleep(self.refresh_rate_var.get())
     
     def start_monitoring(self):
@@ -521,18 +604,65 @@ class ModbusRTUApp:
         if self.monitoring:
             return
         
-        self.client = self.create_modbus_client()
-        if not self.client:
+        # Construir los tags con su periodo ("0-3@1, 100@30s") antes de conectar
+        try:
+            register_type = self.register_type_var.get()
+            rates = parse_rate_list(self.monitor_registers_var.get(), self.refresh_rate_var.get())
+            datatype = self.monitor_datatype_var.get()
+            word_order, byte_order = parse_order(self.monitor_order_var.get())
+            scheduled = [(Tag(self.slave_var.get(), register_type, address, datatype, self.scale_var.get(),
+                              word_order=word_order, byte_order=byte_order), period)
+                         for address, period in rates]
+            self.monitor_filter = ChangeFilter(self.monitor_deadband_var.get(),
+                                               self.monitor_deadband_percent_var.get(),
+                                               self.monitor_heartbeat_var.get())
+        except (ValueError, tk.TclError) as e:
+            self.update_status(f"Configuración del monitor no válida: {e}")
             return
         
+        # La conexión se abre en el hilo del bus; la GUI sigue respondiendo mientras tanto
+        self.monitor_bus = self.get_modbus_bus()
+        self.monitor_start_button.config(state=tk.DISABLED)
+        self.update_status(f"Conectando a {self.port_var.get()}...")
+        future = self.monitor_bus.connect()
+        future.add_done_callback(lambda f: self.root.after(
+            0, self.finish_start_monitoring, f, scheduled, rates))
+    
+    def finish_start_monitoring(self, future, scheduled, rates):
+        """Arranca el planificador del monitor cuando la conexión está abierta"""
+        try:
+            connected = future.result()
+        except Exception as e:
+            connected = False
+            self.update_status(f"Error al conectar: {e}")
+        else:
+            if not connected:
+                self.update_status(f"No se pudo conectar al puerto {self.port_var.get()}")
+        if not connected:
+            self.monitor_start_button.config(state=tk.NORMAL)
+            return
+        
+        # Un grupo por periodo; los grupos que vencen a la vez se leen juntos
+        self.monitor_scheduler = PollScheduler(
+            self.monitor_bus,
+            scheduled,
+            on_results=self.handle_monitor_cycle,
+            on_error=lambda e: self.root.after(0, self.update_status, f"Error: {e}"),
+            max_gap=self.monitor_max_gap_var.get()
+        )
+        self.monitor_first_address = rates[0][0]
+        groups = self.monitor_scheduler.groups
+        self.monitor_plan_var.set(f"{len(scheduled)} registros en {len(groups)} grupo(s), "
+                                  f"{self.monitor_scheduler.requests_per_second():.1f} peticiones/s")
+        
         self.monitoring = True
+        self.record_session_start = now_ms()
         self.monitor_start_button.config(state=tk.DISABLED)
         self.monitor_stop_button.config(state=tk.NORMAL)
         
-        # Iniciar hilo de monitoreo
-        self.monitor_thread = threading.Thread(target=self.monitor_loop)
-        self.monitor_thread.daemon = True
-        self.monitor_thread.start()
+        # Con asyncio el planificador es una corrutina del bucle compartido; si no, un hilo
+        self.monitor_scheduler.start()
+        self.root.after(1000, self.update_monitor_stats)
         
         self.update_status("Monitoreo iniciado")
     
@@ -542,162 +672,225 @@ class ModbusRTUApp:
             return
         
         self.monitoring = False
-        if self.client:
-            self.client.close()
+        if self.monitor_scheduler is not None:
+            self.monitor_scheduler.stop()
         
         self.monitor_start_button.config(state=tk.NORMAL)
         self.monitor_stop_button.config(state=tk.DISABLED)
         self.update_status("Monitoreo detenido")
     
-    def monitor_loop(self):
-        """Bucle para monitoreo continuo de un registro"""
-        register = self.register_var.get()
-        register_type = self.register_type_var.get()
-        scale = self.scale_var.get()
-        slave = self.slave_var.get()
-        max_history = 100  # Máximo número de entradas en el historial
-        
-        while self.monitoring:
-            try:
-                # Leer registro según el tipo
-                if register_type == "holding":
-                    response = self.client.read_holding_registers(register, 1, slave=slave)
-                elif register_type == "input":
-                    response = self.client.read_input_registers(register, 1, slave=slave)
-                else:
-                    self.root.after(0, self.update_status, f"Tipo de registro no válido: {register_type}")
-                    break
-                
-                if not hasattr(response, 'isError') or not response.isError():
-                    value = response.registers[0]
-                    scaled_value = value * scale
-                    
-                    # Formatear según escala
-                    if scale == 1:
-                        formatted = f"{scaled_value}"
-                    elif scale == 0.1:
-                        formatted = f"{scaled_value:.1f}"
-                    elif scale == 0.01:
-                        formatted = f"{scaled_value:.2f}"
-                    else:
-                        formatted = f"{scaled_value:.3f}"
-                    
-                    # Actualizar interfaz en el hilo principal
-                    self.root.after(0, self.update_monitor_display, value, scaled_value, formatted)
+    def handle_monitor_cycle(self, results):
+        """Graba y muestra los resultados de un ciclo de sondeo del monitor.
+
+        Se ejecuta en el hilo del planificador: no toca widgets ni variables
+        de Tk, todo lo que se muestra pasa por ``root.after``.
+        """
+        # El grabador recibe todas las muestras del ciclo con la misma marca de tiempo
+        if self.monitor_record:
+            recorded = []
+            for result in results:
+                tag = result.tag
+                if result.ok:
+                    recorded.extend((tag.slave, tag.address + i, word, QUALITY_GOOD)
+                                    for i, word in enumerate(result.raw))
                 else:
-                    self.root.after(0, self.update_status, f"Error al leer registro: {response}")
-            
-            except Exception as e:
-                self.root.after(0, self.update_status, f"Error: {e}")
-                if not self.monitoring:  # Si se detuvo durante la excepción
-                    break
-            
-            time.sleep(self.refresh_rate_var.get())
+                    quality = QUALITY_COMM_ERROR if result.comm_error else QUALITY_BAD
+                    recorded.extend((tag.slave, tag.address + i, 0, quality) for i in range(tag.words))
+            if recorded:
+                self.recorder.record_many(recorded, now_ms())
+        
+        # En pantalla solo los tags que cambiaron (o cuyo latido venció)
+        samples = []
+        for result in self.monitor_filter.filter(results):
+            tag = result.tag
+            if result.ok:
+                raw = " ".join(str(r) for r in result.raw)
+                samples.append((tag.address, raw, format_scaled(result.value, tag.scale)))
+            else:
+                self.root.after(0, self.update_status, f"Error al leer registro {tag.address}: {result.error}")
+        
+        # Actualizar interfaz en el hilo principal
+        if samples:
+            self.root.after(0, self.update_monitor_display, samples)
+    
+    def update_monitor_stats(self):
+        """Muestra el jitter y los vencimientos perdidos del planificador"""
+        if not self.monitoring or self.monitor_scheduler is None:
+            return
+        stats = self.monitor_scheduler.stats()
+        changes = self.monitor_filter.stats()
+        self.monitor_sched_var.set(f"Jitter máx. {stats['jitter_max_ms']:.0f} ms, "
+                                   f"perdidos {stats['missed']}, "
+                                   f"sin cambios {changes['suppressed_ratio'] * 100:.0f}%")
+        self.root.after(1000, self.update_monitor_stats)
     
-    def update_monitor_display(self, value, scaled_value, formatted):
-        """Actualiza la visualización del monitor con un nuevo valor"""
+    def update_monitor_display(self, samples):
+        """Actualiza la visualización del monitor con los valores de un ciclo"""
         timestamp = time.strftime("%H:%M:%S")
         
-        # Actualizar etiqueta de valor actual
-        if formatted.endswith(".0"):
-            display_value = formatted.rstrip("0").rstrip(".")
-        else:
-            display_value = formatted
-        self.current_value_var.set(f"{display_value}")
-        
-        # Añadir a la tabla de historial
-        self.monitor_tree.insert("", 0, values=(timestamp, value, formatted))
-        
-        # Limitar el número de entradas en la tabla
-        if len(self.monitor_tree.get_children()) > 100:
-            last_item = self.monitor_tree.get_children()[-1]
-            self.monitor_tree.delete(last_item)
+        # Actualizar etiqueta de valor actual (primer registro del monitor)
+        for register, _, formatted in samples:
+            if register != self.monitor_first_address:
+                continue
+            if formatted.endswith(".0"):
+                display_value = formatted.rstrip("0").rstrip(".")
+            else:
+                display_value = formatted
+            self.current_value_var.set(f"{display_value}")
+            break
+        
+        # Añadir al historial del monitor (buffer circular; la tabla solo dibuja lo visible)
+        for register, value, formatted in samples:
+            self.monitor_samples.append((timestamp, register, value, formatted))
+        self.monitor_tree.refresh()
     
     def start_scanning(self):
-        """Inicia el escaneo de un rango de registros"""
-        client = self.create_modbus_client()
-        if not client:
+        """Inicia el escaneo de un rango de registros en un hilo de trabajo"""
+        if self.scanning:
             return
         
-        # Limpiar resultados anteriores
-        self.clear_scan_results()
-        
         try:
             start_register = self.scan_start_var.get()
             count = self.scan_count_var.get()
             scan_type = self.scan_type_var.get()
             slave = self.slave_var.get()
+            min_block = self.scan_min_block_var.get()
+        except tk.TclError as e:
+            self.update_status(f"Configuración del escáner no válida: {e}")
+            return
+        
+        # Limitar el número máximo de registros por seguridad
+        if count > 125:
+            if not messagebox.askyesno("Advertencia", 
+                                     f"Estás intentando escanear {count} registros, lo que puede llevar tiempo. ¿Continuar?"):
+                self.update_status("Escaneo cancelado")
+                return
+        
+        # Limpiar resultados anteriores
+        self.clear_scan_results()
+        
+        tables = {"holding": ["holding"], "input": ["input"], "both": ["holding", "input"]}.get(scan_type, [])
+        self.scan_start = start_register
+        self.scan_count = count
+        self.scan_total = count * len(tables)
+        self.scan_table_index = 0
+        self.scan_started = time.time()
+        self.scan_progress_bar["maximum"] = max(self.scan_total, 1)
+        self.scan_progress_bar["value"] = 0
+        self.scan_progress_var.set(f"0 / {self.scan_total}")
+        
+        self.scanning = True
+        self.active_scanner = None
+        self.scan_queue = queue.Queue()
+        self.scan_start_button.config(state=tk.DISABLED)
+        self.scan_stop_button.config(state=tk.NORMAL)
+        self.update_status(f"Escaneando {count} registros desde {start_register}...")
+        
+        # El hilo de trabajo hace las lecturas; la GUI solo vacía la cola por lotes
+        self.scan_thread = threading.Thread(target=self.scan_worker,
+                                            args=(self.get_modbus_bus(), tables, start_register, count, slave, min_block))
+        self.scan_thread.daemon = True
+        self.scan_thread.start()
+        self.root.after(SCAN_DRAIN_INTERVAL_MS, self.drain_scan_queue)
+    
+    def stop_scanning(self):
+        """Cancela el escaneo en curso"""
+        if not self.scanning:
+            return
+        self.scanning = False
+        if self.active_scanner:
+            self.active_scanner.cancel()
+        self.update_status("Cancelando escaneo...")
+    
+    def scan_worker(self, bus, tables, start_register, count, slave, min_block):
+        """Hilo de escaneo: lee por bloques y envía las filas a la cola de la GUI"""
+        try:
+            if not bus.connect().result():
+                self.scan_queue.put(("done", f"No se pudo conectar al puerto {bus.settings['port']}"))
+                return
             
-            self.update_status(f"Escaneando {count} registros desde {start_register}...")
-            
-            # Limitar el número máximo de registros por seguridad
-            if count > 125:
-                if not messagebox.askyesno("Advertencia", 
-                                         f"Estás intentando escanear {count} registros, lo que puede llevar tiempo. ¿Continuar?"):
-                    client.close()
-                    self.update_status("Escaneo cancelado")
-                    return
-            
-            # Escanear registros holding
-            if scan_type in ["holding", "both"]:
-                for i in range(0, count, 20):  # Leer en bloques de 20 para evitar timeouts
-                    block_size = min(20, count - i)
-                    try:
-                        response = client.read_holding_registers(start_register + i, block_size, slave=slave)
-                        if not hasattr(response, 'isError') or not response.isError():
-                            for j, value in enumerate(response.registers):
-                                addr = start_register + i + j
-                                self.scan_tree.insert("", "end", values=(
-                                    addr, 
-                                    "holding", 
-                                    value, 
-                                    f"0x{value:04X}", 
-                                    f"{value/10.0:.1f}"
-                                ))
-                    except Exception as e:
-                        pass  # Ignorar errores en escaneo
-                    
-                    # Actualizar la interfaz
-                    self.root.update()
-            
-            # Escanear registros input
-            if scan_type in ["input", "both"]:
-                for i in range(0, count, 20):
-                    block_size = min(20, count - i)
-                    try:
-                        response = client.read_input_registers(start_register + i, block_size, slave=slave)
-                        if not hasattr(response, 'isError') or not response.isError():
-                            for j, value in enumerate(response.registers):
-                                addr = start_register + i + j
-                                self.scan_tree.insert("", "end", values=(
-                                    addr, 
-                                    "input", 
-                                    value, 
-                                    f"0x{value:04X}", 
-                                    f"{value/10.0:.1f}"
-                                ))
-                    except Exception as e:
-                        pass  # Ignorar errores en escaneo
-                    
-                    # Actualizar la interfaz
-                    self.root.update()
+            # El escaneo va detrás de escrituras, lecturas y sondeo en la cola del bus
+            def reader(table, address, block_size, slave):
+                return bus.read(table, address, block_size, slave, priority=PRIORITY_BACKGROUND).result()
             
-            self.update_status(f"Escaneo completado")
+            total_requests = 0
+            found = 0
+            for index, table in enumerate(tables):
+                if not self.scanning:
+                    break
+                # Bloques grandes que se parten a la mitad en huecos o timeouts
+                profile = self.scan_profiles.get(bus.settings["port"], slave, table)
+                scanner = AdaptiveScanner(reader, profile, min_block=min_block)
+                self.active_scanner = scanner
+                self.scan_table_index = index
+                try:
+                    for address, registers in scanner.scan(table, start_register, count, slave):
+                        rows = [(address + j, table, value, f"0x{value:04X}", f"{value/10.0:.1f}")
+                                for j, value in enumerate(registers)]
+                        self.scan_queue.put(("rows", rows))
+                        found += len(rows)
+                except ScanAborted as e:
+                    self.scan_queue.put(("status", f"Escaneo {table} interrumpido: {e}"))
+                total_requests += scanner.requests
             
+            self.scan_profiles.save()
+            if self.scanning:
+                self.scan_queue.put(("done", f"Escaneo completado: {found} registros ({total_requests} peticiones)"))
+            else:
+                self.scan_queue.put(("done", f"Escaneo cancelado: {found} registros ({total_requests} peticiones)"))
+        
         except Exception as e:
-            self.update_status(f"Error durante el escaneo: {e}")
+            self.scan_queue.put(("done", f"Error durante el escaneo: {e}"))
+    
+    def drain_scan_queue(self):
+        """Inserta en la tabla los resultados pendientes sin bloquear la interfaz"""
+        deadline = time.time() + SCAN_DRAIN_BUDGET
+        finished = None
+        while time.time() < deadline:
+            try:
+                kind, payload = self.scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "rows":
+                self.scan_results.extend(payload)
+                self.scan_tree.refresh()
+            elif kind == "status":
+                self.update_status(payload)
+            elif kind == "done":
+                finished = payload
+                break
+        
+        # Progreso y tiempo restante estimado
+        scanner = self.active_scanner
+        done = self.scan_table_index * self.scan_count
+        if scanner is not None and scanner.position is not None:
+            done += scanner.position - self.scan_start
+        done = max(0, min(done, self.scan_total))
+        self.scan_progress_bar["value"] = done
+        elapsed = time.time() - self.scan_started
+        if 0 < done < self.scan_total:
+            remaining = elapsed / done * (self.scan_total - done)
+            self.scan_progress_var.set(f"{done} / {self.scan_total} (quedan ~{remaining:.0f} s)")
+        else:
+            self.scan_progress_var.set(f"{done} / {self.scan_total}")
+        
+        if finished is not None:
+            self.scanning = False
+            self.active_scanner = None
+            self.scan_start_button.config(state=tk.NORMAL)
+            self.scan_stop_button.config(state=tk.DISABLED)
+            self.update_status(finished)
+            return
         
-        finally:
-            client.close()
+        self.root.after(SCAN_DRAIN_INTERVAL_MS, self.drain_scan_queue)
     
     def clear_scan_results(self):
         """Limpia los resultados del escaneo"""
-        for item in self.scan_tree.get_children():
-            self.scan_tree.delete(item)
+        self.scan_tree.clear()
     
     def export_scan_data(self):
         """Exporta los resultados del escaneo a un archivo CSV"""
-        if not self.scan_tree.get_children():
+        if not self.scan_results:
             messagebox.showinfo("Información", "No hay datos para exportar")
             return
         
@@ -708,8 +901,7 @@ class ModbusRTUApp:
             with open(filepath, 'w') as f:
                 f.write("Dirección,Tipo,Valor (Dec),Valor (Hex),Valor (÷10)\n")
                 
-                for item in self.scan_tree.get_children():
-                    values = self.scan_tree.item(item, 'values')
+                for values in self.scan_tree.rows():
                     f.write(f"{values[0]},{values[1]},{values[2]},{values[3]},{values[4]}\n")
             
             self.update_status(f"Datos exportados a {filename}")
@@ -721,7 +913,7 @@ class ModbusRTUApp:
     
     def export_monitor_data(self):
         """Exporta los datos del monitor a un archivo CSV"""
-        if not self.monitor_tree.get_children():
+        if not self.monitor_samples:
             messagebox.showinfo("Información", "No hay datos para exportar")
             return
         
@@ -730,11 +922,10 @@ class ModbusRTUApp:
             filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
             
             with open(filepath, 'w') as f:
-                f.write("Hora,Valor (raw),Valor formateado\n")
+                f.write("Hora,Registro,Valor (raw),Valor formateado\n")
                 
-                for item in self.monitor_tree.get_children():
-                    values = self.monitor_tree.item(item, 'values')
-                    f.write(f"{values[0]},{values[1]},{values[2]}\n")
+                for values in self.monitor_tree.rows():
+                    f.write(f"{values[0]},{values[1]},{values[2]},{values[3]}\n")
             
             self.update_status(f"Datos exportados a {filename}")
             messagebox.showinfo("Exportación exitosa", f"Datos exportados a {filename}")
@@ -743,10 +934,53 @@ class ModbusRTUApp:
             self.update_status(f"Error al exportar datos: {e}")
             messagebox.showerror("Error", f"Error al exportar datos: {e}")
     
+    def export_recording(self):
+        """Exporta a CSV lo grabado para los registros del monitor desde que se inició"""
+        scheduler = self.monitor_scheduler
+        if scheduler is None or self.record_session_start is None:
+            messagebox.showinfo("Información", "No hay grabación para exportar")
+            return
+        
+        try:
+            bucket_ms = int(self.record_bucket_var.get() * 1000)
+            start_ms = self.record_session_start
+            end_ms = now_ms() + 1
+            addresses = sorted({(tag.slave, tag.address + i) for tag in scheduler.tags for i in range(tag.words)})
+            
+            filename = f"monitor_recording_{time.strftime('%Y%m%d_%H%M%S')}.csv"
+            filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+            
+            rows = 0
+            with open(filepath, 'w') as f:
+                if bucket_ms > 0:
+                    # Reducción: una fila por intervalo y registro
+                    f.write("Hora,Esclavo,Registro,Muestras,Mínimo,Máximo,Media,Último\n")
+                    for slave, address in addresses:
+                        for bucket, count, low, high, mean, last in self.recorder.downsample(
+                                start_ms, end_ms, bucket_ms, slave, address):
+                            stamp = datetime.fromtimestamp(bucket / 1000).strftime("%Y-%m-%d %H:%M:%S")
+                            f.write(f"{stamp},{slave},{address},{count},{low},{high},{mean:.2f},{last}\n")
+                            rows += 1
+                else:
+                    f.write("Hora,Esclavo,Registro,Valor (raw),Calidad\n")
+                    wanted = set(addresses)
+                    for ms, slave, address, raw, quality in self.recorder.query(start_ms, end_ms):
+                        if (slave, address) not in wanted:
+                            continue
+                        stamp = datetime.fromtimestamp(ms / 1000).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+                        f.write(f"{stamp},{slave},{address},{raw},{quality}\n")
+                        rows += 1
+            
+            self.update_status(f"Grabación exportada a {filename} ({rows} filas)")
+            messagebox.showinfo("Exportación exitosa", f"Grabación exportada a {filename}")
+        
+        except Exception as e:
+            self.update_status(f"Error al exportar grabación: {e}")
+            messagebox.showerror("Error", f"Error al exportar grabación: {e}")
+    
     def clear_monitor_history(self):
         """Limpia el historial del monitor"""
-        for item in self.monitor_tree.get_children():
-            self.monitor_tree.delete(item)
+        self.monitor_tree.clear()
         self.current_value_var.set("--")
     
     def update_results(self, message):
@@ -766,58 +1000,79 @@ class ModbusRTUApp:
         """Actualiza la barra de estado con un nuevo mensaje"""
         self.status_var.set(message)
     
+    def update_bus_stats(self):
+        """Muestra la cola y la utilización del bus del puerto actual"""
+        port = self.port_var.get()
+        for stats in all_stats() + all_async_stats():
+            if stats["port"] == port and stats["backend"] == self.backend_var.get():
+                self.bus_stats_var.set(f"Bus {port}: cola {stats['queue_depth']}, "
+                                       f"uso {stats['recent_utilization'] * 100:.0f}%, "
+                                       f"espera {stats['avg_wait_ms']:.0f} ms, "
+                                       f"p99 {stats['latency_p99_ms']:.0f} ms")
+                break
+        self.root.after(1000, self.update_bus_stats)
+    
     def add_to_history(self, operation, parameters, result):
         """Añade una entrada al historial de comandos"""
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
         
-        # Añadir a la lista interna
-        self.command_history.append({
+        record = {
             "timestamp": timestamp,
             "operation": operation,
             "parameters": parameters,
             "result": result
-        })
+        }
         
-        # Añadir a la tabla de historial
-        self.history_tree.insert("", 0, values=(timestamp, operation, parameters, result))
+        # Anexar al archivo de historial (sin reescribirlo); un comando idéntico
+        # al anterior solo incrementa su contador
+        try:
+            record, merged = self.history_store.append(record)
+        except Exception as e:
+            print(f"Error al guardar historial: {e}")
+            merged = False
         
-        # Guardar historial en archivo
-        self.save_history()
+        # Actualizar la lista interna (acotada)
+        if merged and self.command_history:
+            self.command_history[-1] = record
+        else:
+            self.command_history.append(record)
+        
+        # La tabla lee directamente de la lista; solo se redibujan las filas visibles
+        self.history_tree.refresh()
     
     def load_history(self):
         """Carga el historial de comandos desde un archivo"""
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r') as f:
-                    self.command_history = json.load(f)
-                
-                # Cargar en la tabla (si ya está creada)
-                if hasattr(self, 'history_tree'):
-                    for item in self.command_history:
-                        self.history_tree.insert("", "end", values=(
-                            item["timestamp"],
-                            item["operation"],
-                            item["parameters"],
-                            item["result"]
-                        ))
+            # Lectura en streaming, línea a línea
+            self.command_history.clear()
+            for item in self.history_store.load():
+                self.command_history.append(item)
+            
+            # Refrescar la tabla (si ya está creada)
+            if hasattr(self, 'history_tree'):
+                self.history_tree.refresh()
         except Exception as e:
             print(f"Error al cargar historial: {e}")
     
+    def history_row(self, item):
+        """Valores de la fila de la tabla de historial para un registro"""
+        return (item["timestamp"], item["operation"], item["parameters"], item["result"], item.get("count", 1))
+    
     def save_history(self):
-        """Guarda el historial de comandos en un archivo"""
+        """Fuerza a disco las entradas del historial pendientes de fsync"""
         try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.command_history, f)
+            # Si al cargar se descartaron líneas corruptas, reescribir el archivo limpio
+            if self.history_store.skipped_lines:
+                self.history_store.compact(self.command_history)
+            self.history_store.sync()
         except Exception as e:
             print(f"Error al guardar historial: {e}")
     
     def clear_history(self):
         """Limpia el historial de comandos"""
         if messagebox.askyesno("Confirmar", "¿Estás seguro de que quieres borrar todo el historial?"):
-            self.command_history = []
-            for item in self.history_tree.get_children():
-                self.history_tree.delete(item)
-            self.save_history()
+            self.history_tree.clear()
+            self.history_store.clear()
     
     def export_history(self):
         """Exporta el historial de comandos a un archivo CSV"""
@@ -830,10 +1085,12 @@ class ModbusRTUApp:
             filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
             
             with open(filepath, 'w') as f:
-                f.write("Fecha/Hora,Operación,Parámetros,Resultado\n")
+                f.write("Fecha/Hora,Operación,Parámetros,Resultado,Veces,Primera vez\n")
                 
                 for item in self.command_history:
-                    f.write(f"{item['timestamp']},{item['operation']},{item['parameters']},{item['result']}\n")
+                    first = item.get('first_timestamp', item['timestamp'])
+                    f.write(f"{item['timestamp']},{item['operation']},{item['parameters']},{item['result']},"
+                            f"{item.get('count', 1)},{first}\n")
             
             self.update_status(f"Historial exportado a {filename}")
             messagebox.showinfo("Exportación exitosa", f"Historial exportado a {filename}")
@@ -844,12 +1101,11 @@ class ModbusRTUApp:
     
     def repeat_command(self):
         """Repite el comando seleccionado en el historial"""
-        selected = self.history_tree.selection()
-        if not selected:
+        values = self.history_tree.selected_values()
+        if not values:
             messagebox.showinfo("Información", "Selecciona un comando del historial para repetir")
             return
         
-        values = self.history_tree.item(selected[0], 'values')
         operation = values[1]
         parameters = values[2]
         
@@ -887,13 +1143,24 @@ class ModbusRTUApp:
         if hasattr(self, 'auto_refreshing') and self.auto_refreshing:
             self.stop_auto_refresh()
         
-        # Guardar historial
+        if self.scanning:
+            self.stop_scanning()
+        
+        # Guardar historial y grabación
         self.save_history()
+        self.history_store.close()
+        self.recorder.close()
+        self.metrics_panel.stop_server()
+        
+        # Detener los hilos de bus y el bucle asyncio y cerrar las conexiones persistentes
+        shutdown_backends(self.connection_pool)
         
         # Cerrar la aplicación
         self.root.destroy()
 
 if __name__ == "__main__":
+    # Configurar logging (solo al ejecutar la aplicación, no al importarla)
+    logging.basicConfig(level=logging.INFO)
     root = tk.Tk()
     app = ModbusRTUApp(root)
     root.mainloop()
@@ -0,0 +1,276 @@
+"""Motor de sondeo multi-registro con agrupación automática de peticiones.
+
+Cada tag se define como (esclavo, tabla, dirección, tipo de dato, escala)
+y se decodifica con un ``RegisterFormat`` del módulo ``decoding``.
+Las direcciones cercanas de un mismo esclavo y tabla se agrupan en el menor
+número posible de lecturas FC03/FC04 (máximo 125 registros por petición,
+con una tolerancia de hueco configurable) y después cada respuesta se
+reparte de vuelta en valores por tag.
+"""
+import threading
+from bus_arbiter import execute_read, PRIORITY_POLL
+from metrics import classify_outcome, OUTCOME_EXCEPTION
+from decoding import RegisterFormat, BIG
+
+# Máximo de registros por lectura FC03/FC04 según la especificación Modbus
+MAX_READ_REGISTERS = 125
+
+POLL_TABLES = ("holding", "input")
+
+
+class Tag:
+    """Variable a sondear dentro de un esclavo Modbus"""
+
+    def __init__(self, slave, table, address, datatype="uint16", scale=1.0, name=None,
+                 offset=0.0, word_order=BIG, byte_order=BIG, bit=0, bits=1):
+        if table not in POLL_TABLES:
+            raise ValueError(f"Tipo de registro no válido para sondeo: {table}")
+        self.format = RegisterFormat(datatype, scale, offset, word_order, byte_order, bit, bits)
+        self.slave = int(slave)
+        self.table = table
+        self.address = int(address)
+        self.datatype = datatype
+        self.scale = float(scale)
+        self.name = name or f"{table}:{slave}:{address}"
+
+    @property
+    def words(self):
+        return self.format.words
+
+    @property
+    def end(self):
+        """Primera dirección después del tag"""
+        return self.address + self.words
+
+    def __repr__(self):
+        return f"Tag({self.slave}, {self.table!r}, {self.address}, {self.datatype!r}, {self.scale})"
+
+
+class ReadRequest:
+    """Lectura agrupada que cubre uno o varios tags"""
+
+    def __init__(self, slave, table, start, count, tags):
+        self.slave = slave
+        self.table = table
+        self.start = start
+        self.count = count
+        self.tags = tags
+
+    def __repr__(self):
+        return f"ReadRequest({self.slave}, {self.table!r}, {self.start}, {self.count}, {len(self.tags)} tags)"
+
+
+class TagValue:
+    """Resultado de sondear un tag.
+
+    ``comm_error`` distingue un fallo de comunicación (timeout, puerto
+    caído, circuito abierto) de una respuesta de excepción del equipo o un
+    valor que no se pudo decodificar.
+    """
+
+    __slots__ = ("tag", "raw", "value", "error", "comm_error")
+
+    def __init__(self, tag, raw=None, value=None, error=None, comm_error=False):
+        self.tag = tag
+        self.raw = raw
+        self.value = value
+        self.error = error
+        self.comm_error = comm_error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def plan_requests(tags, max_gap=8, max_count=MAX_READ_REGISTERS):
+    """Agrupa los tags en el mínimo de lecturas.
+
+    Dos tags se leen en la misma petición si pertenecen al mismo esclavo y
+    tabla, los separan como mucho ``max_gap`` registros sin usar y el bloque
+    resultante no supera ``max_count`` registros.
+    """
+    groups = {}
+    for tag in tags:
+        groups.setdefault((tag.slave, tag.table), []).append(tag)
+
+    requests = []
+    for (slave, table), group in sorted(groups.items()):
+        group.sort(key=lambda t: (t.address, t.end))
+        start = end = None
+        members = []
+        for tag in group:
+            if members and tag.address - end <= max_gap and max(end, tag.end) - start <= max_count:
+                end = max(end, tag.end)
+                members.append(tag)
+                continue
+            if members:
+                requests.append(ReadRequest(slave, table, start, end - start, members))
+            start, end, members = tag.address, tag.end, [tag]
+        if members:
+            requests.append(ReadRequest(slave, table, start, end - start, members))
+    return requests
+
+
+def decode_tag(tag, registers):
+    """Convierte los registros crudos de un tag a su valor escalado"""
+    return tag.format.decode(registers)
+
+
+def parse_register_list(text):
+    """Convierte "0, 1, 10-15" en la lista de direcciones [0, 1, 10, ..., 15]"""
+    addresses = []
+    for part in text.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            addresses.extend(range(int(first), int(last) + 1))
+        else:
+            addresses.append(int(part))
+    if not addresses:
+        raise ValueError("No se indicó ningún registro")
+    return addresses
+
+
+class PollingEngine:
+    """Sondea una lista de tags con el mínimo de peticiones por ciclo"""
+
+    def __init__(self, tags, max_gap=8, max_count=MAX_READ_REGISTERS):
+        self.tags = list(tags)
+        self.max_gap = max_gap
+        self.max_count = max_count
+        self.requests = plan_requests(self.tags, max_gap, max_count)
+
+        self.cycles = 0
+        self.requests_sent = 0
+        self.request_errors = 0
+
+    @property
+    def requests_saved(self):
+        """Peticiones ahorradas por ciclo frente a leer cada tag por separado"""
+        return len(self.tags) - len(self.requests)
+
+    def _split(self, request, response, results):
+        """Reparte la respuesta de una petición agrupada entre sus tags"""
+        if hasattr(response, 'isError') and response.isError():
+            self.request_errors += 1
+            # pymodbus devuelve sin lanzar las peticiones sin respuesta válida
+            comm_error = classify_outcome(response)[0] != OUTCOME_EXCEPTION
+            for tag in request.tags:
+                results[id(tag)] = TagValue(tag, error=str(response), comm_error=comm_error)
+            return
+        registers = response.registers
+        for tag in request.tags:
+            offset = tag.address - request.start
+            raw = registers[offset:offset + tag.words]
+            try:
+                results[id(tag)] = TagValue(tag, raw, decode_tag(tag, raw))
+            except Exception as e:
+                results[id(tag)] = TagValue(tag, raw, error=str(e))
+
+    def _fail(self, request, error, results):
+        self.request_errors += 1
+        for tag in request.tags:
+            results[id(tag)] = TagValue(tag, error=str(error), comm_error=True)
+
+    def _collect(self, results):
+        self.cycles += 1
+        return [results[id(tag)] for tag in self.tags]
+
+    def poll(self, client):
+        """Ejecuta un ciclo de sondeo directamente con un cliente Modbus"""
+        results = {}
+        for request in self.requests:
+            self.requests_sent += 1
+            try:
+                response = execute_read(client, request.table, request.start, request.count, request.slave)
+            except Exception as e:
+                self._fail(request, e, results)
+                continue
+            self._split(request, response, results)
+        return self._collect(results)
+
+    def poll_bus(self, bus, priority=PRIORITY_POLL):
+        """Ejecuta un ciclo de sondeo a través del árbitro del bus.
+
+        Todas las peticiones se encolan a la vez; las escrituras y lecturas
+        interactivas pueden intercalarse entre ellas.
+        """
+        futures = []
+        for request in self.requests:
+            self.requests_sent += 1
+            futures.append((request, bus.read(request.table, request.start, request.count,
+                                              request.slave, priority=priority)))
+        results = {}
+        for request, future in futures:
+            try:
+                response = future.result()
+            except Exception as e:
+                self._fail(request, e, results)
+                continue
+            self._split(request, response, results)
+        return self._collect(results)
+
+    def poll_submit(self, bus, on_done, priority=PRIORITY_POLL):
+        """Encola un ciclo de sondeo sin esperarlo.
+
+        ``on_done(resultados)`` se llama desde el hilo del bus (o desde el
+        bucle asyncio) cuando han terminado todas las peticiones del ciclo.
+        """
+        if not self.requests:
+            on_done(self._collect({}))
+            return
+        results = {}
+        pending = [len(self.requests)]
+        lock = threading.Lock()
+
+        def request_done(request, future):
+            with lock:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    self._fail(request, e, results)
+                else:
+                    self._split(request, response, results)
+                pending[0] -= 1
+                if pending[0]:
+                    return
+                values = self._collect(results)
+            on_done(values)
+
+        for request in self.requests:
+            self.requests_sent += 1
+            future = bus.read(request.table, request.start, request.count, request.slave, priority=priority)
+            future.add_done_callback(lambda f, request=request: request_done(request, f))
+
+    async def poll_async(self, bus, priority=PRIORITY_POLL):
+        """Ejecuta un ciclo de sondeo desde una corrutina del bucle asyncio.
+
+        ``bus`` es un ``AsyncBusHandle``; las peticiones se encolan a la vez
+        y se esperan juntas sin bloquear el bucle.
+        """
+        import asyncio
+        self.requests_sent += len(self.requests)
+        responses = await asyncio.gather(
+            *(bus.aread(request.table, request.start, request.count, request.slave, priority=priority)
+              for request in self.requests),
+            return_exceptions=True)
+        results = {}
+        for request, response in zip(self.requests, responses):
+            if isinstance(response, Exception):
+                self._fail(request, response, results)
+            else:
+                self._split(request, response, results)
+        return self._collect(results)
+
+    def stats(self):
+        """Devuelve contadores del motor de sondeo"""
+        return {
+            "tags": len(self.tags),
+            "requests_per_cycle": len(self.requests),
+            "requests_saved_per_cycle": self.requests_saved,
+            "cycles": self.cycles,
+            "requests_sent": self.requests_sent,
+            "request_errors": self.request_errors,
+        }
@@ -0,0 +1,327 @@
+"""Grabador de series temporales para los tags monitorizados.
+
+Cada muestra ocupa un registro binario de tamaño fijo (10 bytes):
+milisegundos desde el inicio del segmento, esclavo, dirección, valor crudo
+uint16 y calidad. Los registros se agrupan en segmentos de una hora (un
+archivo por segmento) que solo crecen por el final, de modo que:
+
+- escribir es anexar bytes al segmento actual,
+- una consulta por rango descarta los segmentos fuera del rango por su
+  nombre y localiza el inicio dentro de cada segmento con búsqueda binaria
+  sobre el archivo mapeado en memoria (mmap),
+- la retención consiste en borrar segmentos enteros.
+
+A 10 Hz un tag ocupa unos 8,6 MB al día.
+"""
+import os
+import mmap
+import time
+import struct
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+# Cabecera de segmento: firma, versión, reservado y marca de tiempo base (ms)
+SEGMENT_MAGIC = b"MBTS"
+SEGMENT_VERSION = 1
+HEADER = struct.Struct("<4sHHq")
+
+# Registro: desplazamiento (ms), esclavo, dirección, valor crudo, calidad
+RECORD = struct.Struct("<IBHHB")
+
+SEGMENT_SUFFIX = ".mbts"
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+# Calidad de la muestra
+QUALITY_GOOD = 0
+QUALITY_BAD = 1        # El equipo devolvió una excepción Modbus
+QUALITY_COMM_ERROR = 2  # Sin respuesta o error de comunicación
+
+QUALITY_NAMES = {
+    QUALITY_GOOD: "good",
+    QUALITY_BAD: "bad",
+    QUALITY_COMM_ERROR: "comm_error",
+}
+
+
+def now_ms():
+    """Hora actual en milisegundos desde la época"""
+    return int(time.time() * 1000)
+
+
+class Segment:
+    """Segmento de solo lectura mapeado en memoria"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        header = self._file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            self._file.close()
+            raise ValueError(f"Segmento incompleto: {path}")
+        magic, version, _, self.base_ms = HEADER.unpack(header)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            self._file.close()
+            raise ValueError(f"Segmento no válido: {path}")
+        # Solo registros completos (el último puede estar a medio escribir)
+        self.count = (size - HEADER.size) // RECORD.size
+        self._map = None
+        if self.count:
+            self._map = mmap.mmap(self._file.fileno(), HEADER.size + self.count * RECORD.size,
+                                  access=mmap.ACCESS_READ)
+
+    def offset_at(self, index):
+        return RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)[0]
+
+    def bisect(self, offset_ms):
+        """Índice del primer registro con desplazamiento >= offset_ms"""
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.offset_at(mid) < offset_ms:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def last_ms(self):
+        if not self.count:
+            return self.base_ms
+        return self.base_ms + self.offset_at(self.count - 1)
+
+    def read(self, start_ms, end_ms):
+        """Recorre (ms, esclavo, dirección, valor, calidad) con start_ms <= ms < end_ms"""
+        if not self.count:
+            return
+        first = self.bisect(max(0, start_ms - self.base_ms))
+        last = self.bisect(max(0, end_ms - self.base_ms))
+        if first >= last:
+            return
+        view = memoryview(self._map)[HEADER.size + first * RECORD.size:HEADER.size + last * RECORD.size]
+        try:
+            base = self.base_ms
+            for offset, slave, address, raw, quality in RECORD.iter_unpack(view):
+                yield base + offset, slave, address, raw, quality
+        finally:
+            view.release()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class TimeSeriesRecorder:
+    """Graba muestras (esclavo, dirección, valor uint16, calidad) en segmentos binarios.
+
+    Args:
+        directory (str): Carpeta de los segmentos
+        segment_ms (int): Duración de cada segmento
+        retention_days (float): Días que se conservan (None = sin límite)
+        flush_every (int): Muestras en memoria antes de escribir al archivo
+        flush_interval (float): Segundos máximos entre escrituras
+    """
+
+    def __init__(self, directory, segment_ms=HOUR_MS, retention_days=None,
+                 flush_every=512, flush_interval=1.0):
+        self.directory = directory
+        self.segment_ms = segment_ms
+        self.retention_days = retention_days
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._file = None
+        self._base_ms = None
+        self._last_offset = 0
+
+        self.recorded = 0
+        self.deleted_segments = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.apply_retention()
+
+    def _segment_path(self, base_ms):
+        return os.path.join(self.directory, f"{base_ms}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        """Devuelve [(base_ms, ruta)] de los segmentos existentes, ordenados"""
+        result = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                base_ms = int(name[:-len(SEGMENT_SUFFIX)])
+            except ValueError:
+                continue
+            result.append((base_ms, os.path.join(self.directory, name)))
+        result.sort()
+        return result
+
+    def _open_segment(self, base_ms):
+        """Abre (o crea) el segmento para anexar registros"""
+        self._close_segment()
+        path = self._segment_path(base_ms)
+        self._last_offset = 0
+        if os.path.exists(path):
+            # Recortar un registro incompleto y continuar tras el último completo
+            with open(path, 'r+b') as f:
+                size = os.fstat(f.fileno()).st_size
+                count = max(0, size - HEADER.size) // RECORD.size
+                valid = HEADER.size + count * RECORD.size
+                if size != valid:
+                    f.truncate(valid)
+                    log.warning("Grabador: descartado un registro incompleto en %s", path)
+                if count:
+                    f.seek(valid - RECORD.size)
+                    self._last_offset = RECORD.unpack(f.read(RECORD.size))[0]
+            self._file = open(path, 'ab')
+        else:
+            self._file = open(path, 'ab')
+            self._file.write(HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0, base_ms))
+            self._file.flush()
+        self._base_ms = base_ms
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._base_ms = None
+
+    def _write_locked(self):
+        if self._buffer and self._file is not None:
+            self._file.write(self._buffer)
+            self._file.flush()
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    def record_many(self, samples, timestamp_ms=None):
+        """Graba varias muestras [(esclavo, dirección, valor, calidad)] con la misma hora"""
+        timestamp_ms = now_ms() if timestamp_ms is None else int(timestamp_ms)
+        with self._lock:
+            base_ms = timestamp_ms - timestamp_ms % self.segment_ms
+            if self._base_ms is None or base_ms > self._base_ms:
+                self._write_locked()
+                self._open_segment(base_ms)
+                self.apply_retention(timestamp_ms)
+            # Los segmentos deben quedar ordenados: si el reloj retrocede se
+            # reutiliza la última marca de tiempo del segmento actual
+            offset = max(timestamp_ms - self._base_ms, self._last_offset)
+            self._last_offset = offset
+            pack = RECORD.pack
+            for slave, address, raw, quality in samples:
+                self._buffer += pack(offset, slave, address, raw & 0xFFFF, quality)
+                self._buffered += 1
+            self.recorded += len(samples)
+            if (self._buffered >= self.flush_every
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._write_locked()
+
+    def record(self, slave, address, raw, quality=QUALITY_GOOD, timestamp_ms=None):
+        """Graba una muestra"""
+        self.record_many([(slave, address, raw, quality)], timestamp_ms)
+
+    def flush(self):
+        """Escribe al archivo las muestras que están en memoria"""
+        with self._lock:
+            self._write_locked()
+
+    def query(self, start_ms, end_ms, slave=None, address=None):
+        """Recorre las muestras con start_ms <= ms < end_ms, opcionalmente de un solo tag.
+
+        Devuelve tuplas (ms, esclavo, dirección, valor, calidad) en orden temporal.
+        """
+        self.flush()
+        segments = self.segments()
+        for i, (base_ms, path) in enumerate(segments):
+            next_base = segments[i + 1][0] if i + 1 < len(segments) else None
+            if base_ms >= end_ms or (next_base is not None and next_base <= start_ms):
+                continue
+            try:
+                segment = Segment(path)
+            except (OSError, ValueError) as e:
+                log.warning("Grabador: no se pudo leer %s: %s", path, e)
+                continue
+            try:
+                for sample in segment.read(start_ms, end_ms):
+                    if slave is not None and sample[1] != slave:
+                        continue
+                    if address is not None and sample[2] != address:
+                        continue
+                    yield sample
+            finally:
+                segment.close()
+
+    def downsample(self, start_ms, end_ms, bucket_ms, slave, address, good_only=True):
+        """Agrega las muestras de un tag en intervalos de ``bucket_ms``.
+
+        Devuelve [(inicio del intervalo, muestras, mínimo, máximo, media, último)].
+        """
+        buckets = []
+        current = None
+        for ms, _, _, raw, quality in self.query(start_ms, end_ms, slave, address):
+            if good_only and quality != QUALITY_GOOD:
+                continue
+            bucket = ms - ms % bucket_ms
+            if current is None or current[0] != bucket:
+                if current is not None:
+                    buckets.append(current)
+                current = [bucket, 0, raw, raw, 0, raw]
+            current[1] += 1
+            current[2] = min(current[2], raw)
+            current[3] = max(current[3], raw)
+            current[4] += raw
+            current[5] = raw
+        if current is not None:
+            buckets.append(current)
+        return [(bucket, count, low, high, total / count, last)
+                for bucket, count, low, high, total, last in buckets]
+
+    def apply_retention(self, now=None):
+        """Borra los segmentos más antiguos que el periodo de retención"""
+        if not self.retention_days:
+            return 0
+        limit = (now_ms() if now is None else now) - int(self.retention_days * DAY_MS)
+        segments = self.segments()
+        deleted = 0
+        for i, (base_ms, path) in enumerate(segments):
+            # Un segmento se borra cuando el siguiente también empieza antes del límite
+            next_base = segments[i + 1][0] if i + 1 < len(segments) else base_ms + self.segment_ms
+            if next_base > limit or base_ms == self._base_ms:
+                break
+            try:
+                os.remove(path)
+                deleted += 1
+            except OSError as e:
+                log.warning("Grabador: no se pudo borrar %s: %s", path, e)
+        self.deleted_segments += deleted
+        return deleted
+
+    def stats(self):
+        """Devuelve número de segmentos, bytes en disco y muestras grabadas"""
+        segments = self.segments()
+        size = 0
+        for _, path in segments:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return {
+            "segments": len(segments),
+            "bytes": size,
+            "recorded": self.recorded,
+            "buffered": self._buffered,
+            "deleted_segments": self.deleted_segments,
+        }
+
+    def close(self):
+        with self._lock:
+            self._write_locked()
+            self._close_segment()
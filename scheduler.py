@@ -0,0 +1,251 @@
+"""Planificador de sondeo con un periodo propio por tag.
+
+Cada tag pertenece a un grupo según su periodo (por ejemplo alarmas cada
+200 ms, temperaturas cada segundo y consignas cada 30 s). Un planificador
+por bus despacha siempre el grupo con el vencimiento más próximo; los
+grupos que vencen casi a la vez se leen juntos, con las peticiones
+agrupadas como en ``PollingEngine``. Los ciclos se encolan sin esperar su
+respuesta, y los grupos lentos van con prioridad de fondo en el árbitro, de
+modo que las lecturas rápidas no esperan detrás de las lentas.
+
+Para cada grupo se mide el retraso con que se despacha respecto a su
+vencimiento (jitter) y los vencimientos perdidos (el ciclo anterior seguía
+en curso o el planificador llegó tarde).
+"""
+import time
+import threading
+import logging
+from collections import deque
+from bus_arbiter import PRIORITY_POLL, PRIORITY_BACKGROUND
+from async_transport import run_coroutine, BACKEND_ASYNCIO
+from polling import PollingEngine, parse_register_list, MAX_READ_REGISTERS
+
+log = logging.getLogger(__name__)
+
+# Los grupos que vencen dentro de esta ventana se despachan juntos
+COALESCE_WINDOW = 0.02
+
+# Los grupos con periodo igual o mayor van con prioridad de fondo
+BACKGROUND_PERIOD = 5.0
+
+# Espera máxima del planificador sin revisar si debe detenerse
+MAX_IDLE = 0.1
+
+# Muestras de jitter que se conservan por grupo
+JITTER_SAMPLES = 200
+
+
+def parse_period(text):
+    """Convierte "200ms", "1.5s" o "30" (segundos) en segundos"""
+    text = text.strip().lower()
+    if text.endswith("ms"):
+        period = float(text[:-2]) / 1000.0
+    elif text.endswith("s"):
+        period = float(text[:-1])
+    else:
+        period = float(text)
+    if period <= 0:
+        raise ValueError(f"Periodo no válido: {text}")
+    return period
+
+
+def parse_rate_list(text, default_period=1.0):
+    """Convierte "0-3@1, 100@30s, 200@200ms" en [(dirección, periodo en segundos)].
+
+    Las entradas sin ``@`` usan ``default_period``.
+    """
+    rates = []
+    for part in text.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        addresses, _, period = part.partition("@")
+        period = parse_period(period) if period.strip() else default_period
+        rates.extend((address, period) for address in parse_register_list(addresses))
+    if not rates:
+        raise ValueError("No se indicó ningún registro")
+    return rates
+
+
+class PollGroup:
+    """Tags que comparten periodo y sus estadísticas de planificación"""
+
+    def __init__(self, period, tags):
+        self.period = period
+        self.tags = tags
+        self.priority = PRIORITY_POLL if period < BACKGROUND_PERIOD else PRIORITY_BACKGROUND
+        self.deadline = None
+        self.in_flight = False
+
+        self.dispatches = 0
+        self.completed = 0
+        self.missed = 0
+        self.jitter = deque(maxlen=JITTER_SAMPLES)  # Retraso del despacho (s)
+        self.cycle_time = deque(maxlen=JITTER_SAMPLES)  # Duración del ciclo (s)
+
+    def advance(self, now):
+        """Pasa al siguiente vencimiento; los que ya pasaron cuentan como perdidos"""
+        self.deadline += self.period
+        if self.deadline <= now:
+            skipped = int((now - self.deadline) // self.period) + 1
+            self.missed += skipped
+            self.deadline += skipped * self.period
+
+    def stats(self):
+        jitter = list(self.jitter)
+        cycles = list(self.cycle_time)
+        return {
+            "period": self.period,
+            "tags": len(self.tags),
+            "dispatches": self.dispatches,
+            "completed": self.completed,
+            "missed": self.missed,
+            "jitter_avg_ms": (sum(jitter) / len(jitter) * 1000) if jitter else 0.0,
+            "jitter_max_ms": (max(jitter) * 1000) if jitter else 0.0,
+            "cycle_avg_ms": (sum(cycles) / len(cycles) * 1000) if cycles else 0.0,
+        }
+
+
+class PollScheduler:
+    """Despacha los grupos de tags de un bus por vencimiento más próximo (EDF).
+
+    Args:
+        bus: Acceso al bus (``BusHandle`` o ``AsyncBusHandle``)
+        scheduled_tags (list): [(Tag, periodo en segundos)]
+        on_results (callable): on_results(valores) con los ``TagValue`` de cada ciclo;
+            se llama desde el hilo del bus o desde el bucle asyncio
+        on_error (callable): on_error(excepción) si falla un despacho
+        max_gap (int): Registros sin usar tolerados al agrupar peticiones
+        coalesce_window (float): Segundos de adelanto con que se agrupan vencimientos
+    """
+
+    def __init__(self, bus, scheduled_tags, on_results=None, on_error=None, max_gap=8,
+                 max_count=MAX_READ_REGISTERS, coalesce_window=COALESCE_WINDOW):
+        self.bus = bus
+        self.on_results = on_results
+        self.on_error = on_error
+        self.max_gap = max_gap
+        self.max_count = max_count
+        self.coalesce_window = coalesce_window
+
+        by_period = {}
+        for tag, period in scheduled_tags:
+            by_period.setdefault(float(period), []).append(tag)
+        self.groups = [PollGroup(period, tags) for period, tags in sorted(by_period.items())]
+
+        self.running = False
+        self.started = None
+        self._lock = threading.Lock()
+        self._engines = {}  # Plan de peticiones por combinación de grupos
+        self._worker = None
+
+    @property
+    def tags(self):
+        return [tag for group in self.groups for tag in group.tags]
+
+    def _engine_for(self, groups):
+        """Motor de sondeo (peticiones agrupadas) para una combinación de grupos"""
+        key = tuple(id(group) for group in groups)
+        engine = self._engines.get(key)
+        if engine is None:
+            engine = PollingEngine([tag for group in groups for tag in group.tags],
+                                   self.max_gap, self.max_count)
+            self._engines[key] = engine
+        return engine
+
+    def requests_per_second(self):
+        """Peticiones por segundo si cada grupo se despacha por separado"""
+        return sum(len(self._engine_for([group]).requests) / group.period for group in self.groups)
+
+    def _tick(self):
+        """Despacha los grupos vencidos. Devuelve los segundos hasta el próximo vencimiento"""
+        now = time.monotonic()
+        with self._lock:
+            due = []
+            for group in self.groups:
+                if group.deadline - now > self.coalesce_window:
+                    continue
+                if group.in_flight:
+                    # El ciclo anterior sigue en el bus: este vencimiento se pierde
+                    group.missed += 1
+                else:
+                    group.jitter.append(max(0.0, now - group.deadline))
+                    group.in_flight = True
+                    group.dispatches += 1
+                    due.append(group)
+                group.advance(now)
+            next_deadline = min(group.deadline for group in self.groups)
+
+        if due:
+            self._dispatch(due, now)
+        return max(0.0, next_deadline - time.monotonic())
+
+    def _dispatch(self, groups, started):
+        engine = self._engine_for(groups)
+        priority = min(group.priority for group in groups)
+
+        def done(values):
+            finished = time.monotonic()
+            with self._lock:
+                for group in groups:
+                    group.in_flight = False
+                    group.completed += 1
+                    group.cycle_time.append(finished - started)
+            if self.on_results and self.running:
+                self.on_results(values)
+
+        try:
+            engine.poll_submit(self.bus, done, priority=priority)
+        except Exception as e:
+            with self._lock:
+                for group in groups:
+                    group.in_flight = False
+            log.debug("Error al despachar el sondeo: %s", e)
+            if self.on_error:
+                self.on_error(e)
+
+    def _run(self):
+        while self.running:
+            delay = self._tick()
+            if delay:
+                time.sleep(min(delay, MAX_IDLE))
+
+    async def _run_async(self):
+        import asyncio
+        while self.running:
+            delay = self._tick()
+            if delay:
+                await asyncio.sleep(min(delay, MAX_IDLE))
+
+    def start(self):
+        """Arranca el planificador (corrutina con el transporte asyncio, hilo si no)"""
+        if self.running or not self.groups:
+            return
+        self.running = True
+        self.started = time.monotonic()
+        for group in self.groups:
+            group.deadline = self.started
+        if getattr(self.bus, "backend", None) == BACKEND_ASYNCIO:
+            self._worker = run_coroutine(self._run_async())
+        else:
+            self._worker = threading.Thread(target=self._run, name="poll-scheduler")
+            self._worker.daemon = True
+            self._worker.start()
+
+    def stop(self):
+        """Detiene el despacho; los ciclos ya encolados terminan sin notificar"""
+        self.running = False
+
+    def stats(self):
+        """Devuelve las estadísticas globales y por grupo"""
+        with self._lock:
+            groups = [group.stats() for group in self.groups]
+        jitter = [g["jitter_max_ms"] for g in groups]
+        return {
+            "groups": groups,
+            "tags": sum(g["tags"] for g in groups),
+            "dispatches": sum(g["dispatches"] for g in groups),
+            "missed": sum(g["missed"] for g in groups),
+            "jitter_max_ms": max(jitter) if jitter else 0.0,
+            "elapsed": (time.monotonic() - self.started) if self.started else 0.0,
+        }
@@ -0,0 +1,570 @@
+"""Granja de esclavos Modbus simulados para pruebas de carga y de regresión sin hardware.
+
+Aloja cientos de IDs de esclavo con su mapa de registros, latencia de
+respuesta con jitter, huecos que responden "dirección ilegal" y una tasa de
+peticiones sin respuesta. Se sirve a la vez por varios canales:
+
+    loop://nombre             En el mismo proceso (pruebas y benchmarks)
+    tcp://127.0.0.1:PUERTO    Modbus TCP (atiende peticiones en paralelo)
+    rtu+tcp://127.0.0.1:P     RTU sobre TCP (una petición cada vez, como una pasarela)
+    /dev/pts/N o COMx         RTU por un par serie virtual (pty en Linux, com0com en Windows)
+
+Las herramientas (modbus_gui.py, slave_finder.py y main.py) se conectan
+indicando ese puerto. Ejemplo:
+
+    python simulator.py --slaves 1-247 --tcp 5020 --rtu-tcp 5021 --pty --latency 0.005 --jitter 0.002
+    python main.py discover --port tcp://127.0.0.1:5020 --slaves 1-247 --backend asyncio
+
+Con ``--config granja.json`` cada rango de esclavos puede tener su perfil::
+
+    {
+      "seed": 1,
+      "baudrate": 9600,
+      "defaults": {"holding": 200, "input": 100, "coils": 64, "discrete": 64,
+                   "latency": 0.005, "jitter": 0.002, "drop_rate": 0.0, "holes": "100-109"},
+      "slaves": {"1-200": {}, "201-210": {"latency": 0.05, "drop_rate": 0.1}}
+    }
+
+Con ``baudrate`` (o ``--line-baudrate``) cada respuesta tarda además lo que
+tardaría en viajar por una línea RTU de esa velocidad.
+
+En cada esclavo el holding 0 y el input 0 son una temperatura (÷10) que
+oscila, el holding 1 vale 1000 + ID y el resto de registros valen su
+dirección. Con la misma semilla las caídas y el jitter se repiten igual.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import select
+import struct
+import logging
+import argparse
+import threading
+from loopback import (LoopbackDevice, LoopbackResponse, LoopbackExceptionResponse, register_loopback_device,
+                      ILLEGAL_FUNCTION, ILLEGAL_DATA_ADDRESS, _no_response)
+from polling import parse_register_list
+from timing import frame_time, read_response_bytes, READ_REQUEST_BYTES
+
+log = logging.getLogger(__name__)
+
+# Perfil por defecto de cada esclavo
+DEFAULT_PROFILE = {
+    "holding": 200,
+    "input": 100,
+    "coils": 64,
+    "discrete": 64,
+    "latency": 0.0,
+    "jitter": 0.0,
+    "drop_rate": 0.0,
+    "holes": "",
+}
+
+_TABLES_BY_FUNCTION = {1: "coil", 2: "discrete_input", 3: "holding", 4: "input"}
+
+# Cabecera MBAP: ID de transacción, protocolo (0), longitud, unidad
+_MBAP = struct.Struct(">HHHB")
+
+# Espera máxima entre bytes de una misma trama RTU
+RTU_FRAME_TIMEOUT = 0.1
+
+
+def crc16(data):
+    """CRC-16 Modbus de una trama RTU"""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def rtu_frame(slave, pdu):
+    """Trama RTU completa: esclavo, PDU y CRC (byte bajo primero)"""
+    body = bytes([slave]) + pdu
+    return body + struct.pack("<H", crc16(body))
+
+
+class SlaveProfile:
+    """Comportamiento de respuesta de un esclavo"""
+
+    __slots__ = ("latency", "jitter", "drop_rate")
+
+    def __init__(self, latency=0.0, jitter=0.0, drop_rate=0.0):
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.drop_rate = float(drop_rate)
+
+
+class SlaveFarm(LoopbackDevice):
+    """Equipo simulado con muchos esclavos, cada uno con su perfil de respuesta.
+
+    Se usa igual que ``LoopbackDevice`` (también desde ``loop://``) y además
+    responde PDUs crudas para los servidores TCP y RTU. Con ``baudrate`` cada
+    respuesta tarda además lo que tardarían la petición y la respuesta en
+    viajar por una línea RTU de esa velocidad.
+    """
+
+    def __init__(self, seed=None, baudrate=None, parity='N', stopbits=1, bytesize=8):
+        super().__init__()
+        self.line = (baudrate, parity, stopbits, bytesize) if baudrate else None
+        self.profiles = {}
+        self.random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.dropped = 0
+        self.exceptions = 0
+
+    def add_slave(self, slave, holding=200, input=100, coils=64, discrete=64, holes="",
+                  latency=0.0, jitter=0.0, drop_rate=0.0):
+        """Añade un esclavo con ``holding``/``input``/``coils``/``discrete`` direcciones por tabla"""
+        hole_set = set(parse_register_list(holes)) if str(holes).strip() else set()
+        tables = {
+            "holding": {a: a for a in range(int(holding)) if a not in hole_set},
+            "input": {a: a for a in range(int(input)) if a not in hole_set},
+            "coil": {a: a % 2 for a in range(int(coils)) if a not in hole_set},
+            "discrete_input": {a: (a + 1) % 2 for a in range(int(discrete)) if a not in hole_set},
+        }
+        if 1 in tables["holding"]:
+            tables["holding"][1] = 1000 + slave
+        self.slaves[slave] = tables
+        # Temperatura (÷10) con una fase distinta en cada esclavo
+        temperature = (lambda phase: lambda t: int(215 + 15 * math.sin(t / 30 + phase)))(slave)
+        for table in ("holding", "input"):
+            if 0 in tables[table]:
+                self.dynamic[(slave, table, 0)] = temperature
+        self.profiles[slave] = SlaveProfile(latency, jitter, drop_rate)
+
+    def _uniform(self):
+        with self._random_lock:
+            return self.random.random()
+
+    def response_delay(self, slave, table="holding", count=1):
+        wire = 0.0
+        if self.line is not None:
+            wire = frame_time(READ_REQUEST_BYTES + read_response_bytes(count, table), *self.line)
+        profile = self.profiles.get(slave)
+        if profile is None:
+            return self.latency + wire
+        if not profile.jitter:
+            return profile.latency + wire
+        return max(0.0, profile.latency + (self._uniform() * 2 - 1) * profile.jitter) + wire
+
+    def pdu_delay(self, slave, pdu):
+        """``response_delay`` para la PDU de una petición cruda"""
+        if len(pdu) >= 5 and pdu[0] in _TABLES_BY_FUNCTION:
+            return self.response_delay(slave, _TABLES_BY_FUNCTION[pdu[0]], struct.unpack(">H", pdu[3:5])[0])
+        return self.response_delay(slave)
+
+    def answers(self, slave):
+        """Indica si el esclavo contesta a esta petición (existe y no se pierde)"""
+        if slave not in self.slaves:
+            return False
+        profile = self.profiles.get(slave)
+        if profile is not None and profile.drop_rate and self._uniform() < profile.drop_rate:
+            self.dropped += 1
+            return False
+        return True
+
+    def read(self, table, address, count, slave):
+        if slave in self.slaves and not self.answers(slave):
+            raise _no_response(slave)
+        response = super().read(table, address, count, slave)
+        if response.isError():
+            self.exceptions += 1
+        return response
+
+    def write(self, table, address, value, slave):
+        if slave in self.slaves and not self.answers(slave):
+            raise _no_response(slave)
+        response = super().write(table, address, value, slave)
+        if response.isError():
+            self.exceptions += 1
+        return response
+
+    def handle_pdu(self, slave, pdu):
+        """Responde a la PDU de una petición. Devuelve la PDU de respuesta o None si no contesta"""
+        if not pdu or not self.answers(slave):
+            self.requests += 1
+            return None
+        requests = self.requests
+        function_code = pdu[0]
+        try:
+            if function_code in _TABLES_BY_FUNCTION:
+                address, count = struct.unpack(">HH", pdu[1:5])
+                response = LoopbackDevice.read(self, _TABLES_BY_FUNCTION[function_code], address, count, slave)
+            elif function_code in (5, 6):
+                address, value = struct.unpack(">HH", pdu[1:5])
+                if function_code == 5:
+                    value = 1 if value == 0xFF00 else 0
+                table = "coil" if function_code == 5 else "holding"
+                response = LoopbackDevice.write(self, table, address, value, slave)
+            elif function_code in (15, 16):
+                address, count, size = struct.unpack(">HHB", pdu[1:6])
+                data = pdu[6:6 + size]
+                if function_code == 16:
+                    values = struct.unpack(f">{count}H", data[:2 * count])
+                else:
+                    values = [data[i // 8] >> (i % 8) & 1 for i in range(count)]
+                response = LoopbackResponse(function_code, address=address, value=count)
+                for offset, value in enumerate(values):
+                    result = LoopbackDevice.write(self, "holding" if function_code == 16 else "coil",
+                                                  address + offset, value, slave)
+                    if result.isError():
+                        response = LoopbackExceptionResponse(function_code, result.exception_code)
+                        break
+            else:
+                response = LoopbackExceptionResponse(function_code, ILLEGAL_FUNCTION)
+        except struct.error:
+            response = LoopbackExceptionResponse(function_code, ILLEGAL_DATA_ADDRESS)
+        self.requests = requests + 1  # Una petición aunque escriba varios registros
+        return self._encode(response)
+
+    def _encode(self, response):
+        if response.isError():
+            self.exceptions += 1
+            return bytes([response.function_code | 0x80, response.exception_code])
+        function_code = response.function_code
+        if function_code in (3, 4):
+            registers = response.registers
+            return struct.pack(f">BB{len(registers)}H", function_code, 2 * len(registers), *registers)
+        if function_code in (1, 2):
+            bits = response.bits
+            data = bytearray((len(bits) + 7) // 8)
+            for i, bit in enumerate(bits):
+                if bit:
+                    data[i // 8] |= 1 << (i % 8)
+            return bytes([function_code, len(data)]) + bytes(data)
+        if function_code == 5:
+            return struct.pack(">BHH", 5, response.address, 0xFF00 if response.value else 0)
+        return struct.pack(">BHH", function_code, response.address, response.value & 0xFFFF)
+
+    def stats(self):
+        return {
+            "slaves": len(self.slaves),
+            "requests": self.requests,
+            "dropped": self.dropped,
+            "exceptions": self.exceptions,
+        }
+
+
+def build_farm(slaves="1-247", seed=None, baudrate=None, **profile):
+    """Crea una granja con el mismo perfil para todos los esclavos indicados"""
+    farm = SlaveFarm(seed, baudrate)
+    settings = dict(DEFAULT_PROFILE, **profile)
+    for slave in parse_register_list(slaves):
+        farm.add_slave(slave, **settings)
+    return farm
+
+
+def load_farm(path):
+    """Crea una granja a partir de un JSON con ``defaults`` y perfiles por rango de esclavos"""
+    with open(path, 'r') as f:
+        config = json.load(f)
+    farm = SlaveFarm(config.get("seed"), config.get("baudrate"))
+    defaults = dict(DEFAULT_PROFILE, **config.get("defaults", {}))
+    for slaves, overrides in config.get("slaves", {"1-247": {}}).items():
+        settings = dict(defaults, **(overrides or {}))
+        for slave in parse_register_list(slaves):
+            farm.add_slave(slave, **settings)
+    return farm
+
+
+def _rtu_remaining(head):
+    """Bytes que faltan de una petición RTU a partir de sus primeros bytes (None = función desconocida)"""
+    function_code = head[1]
+    if 1 <= function_code <= 6:
+        return 8 - len(head)
+    if function_code in (15, 16):
+        if len(head) < 7:
+            return 7 - len(head)
+        return 7 + head[6] + 2 - len(head)
+    return None
+
+
+class _FdStream:
+    """Extremo de un pty como flujo de bytes con timeout"""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def read(self, size, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return b""
+        return os.read(self.fd, size)
+
+    def write(self, data):
+        os.write(self.fd, data)
+
+    def discard(self):
+        while self.read(256, 0.01):
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _SerialStream:
+    """Puerto serie de pyserial como flujo de bytes con timeout"""
+
+    def __init__(self, port, baudrate, parity, stopbits, bytesize):
+        import serial
+        self.serial = serial.Serial(port, baudrate=baudrate, parity=parity, stopbits=stopbits,
+                                    bytesize=bytesize, timeout=0)
+
+    def read(self, size, timeout):
+        self.serial.timeout = timeout
+        return self.serial.read(size)
+
+    def write(self, data):
+        self.serial.write(data)
+
+    def discard(self):
+        self.serial.reset_input_buffer()
+
+    def close(self):
+        self.serial.close()
+
+
+class Simulator:
+    """Sirve una granja por TCP, RTU sobre TCP, un pty o un puerto serie.
+
+    Args:
+        farm (SlaveFarm): Esclavos simulados
+        host (str): Dirección en la que escuchan los servidores TCP
+    """
+
+    def __init__(self, farm, host="127.0.0.1"):
+        self.farm = farm
+        self.host = host
+        self.endpoints = []
+        self.running = False
+        self._loop_thread = None
+        self._servers = []
+        self._threads = []
+        self._streams = []
+
+    def _event_loop(self):
+        if self._loop_thread is None:
+            # Bucle propio: no compite con el del transporte asyncio de los clientes
+            from async_transport import EventLoopThread
+            self._loop_thread = EventLoopThread()
+        return self._loop_thread
+
+    def add_loopback(self, name="loop://farm"):
+        """Publica la granja en el mismo proceso como ``loop://nombre``"""
+        register_loopback_device(name, self.farm)
+        self.endpoints.append(name)
+        return name
+
+    def add_tcp(self, port=0, rtu=False):
+        """Arranca un servidor Modbus TCP (o RTU sobre TCP). ``port=0`` elige uno libre"""
+        import asyncio
+        handler = self._serve_rtu_tcp if rtu else self._serve_tcp
+
+        async def start():
+            return await asyncio.start_server(handler, self.host, port)
+
+        self.running = True
+        server = self._event_loop().run(start()).result()
+        self._servers.append(server)
+        bound = server.sockets[0].getsockname()[1]
+        endpoint = f"{'rtu+tcp' if rtu else 'tcp'}://{self.host}:{bound}"
+        self.endpoints.append(endpoint)
+        return endpoint
+
+    def add_pty(self):
+        """Crea un par serie virtual (solo POSIX). Devuelve la ruta que deben abrir las herramientas"""
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        name = os.ttyname(slave)
+        self._streams.append(_FdStream(slave))  # Mantiene abierto el extremo de las herramientas
+        self._start_rtu_thread(_FdStream(master), name)
+        return name
+
+    def add_serial(self, port, baudrate=9600, parity='N', stopbits=1, bytesize=8):
+        """Atiende un puerto serie real o un extremo de un par virtual (com0com, socat)"""
+        self._start_rtu_thread(_SerialStream(port, baudrate, parity, stopbits, bytesize), port)
+        return port
+
+    def _start_rtu_thread(self, stream, name):
+        self.running = True
+        self._streams.append(stream)
+        worker = threading.Thread(target=self._serve_rtu_stream, args=(stream,), name=f"simulator-{name}")
+        worker.daemon = True
+        worker.start()
+        self._threads.append(worker)
+        self.endpoints.append(name)
+
+    async def _serve_tcp(self, reader, writer):
+        """Conexión Modbus TCP: cada petición se responde por su cuenta (admite pipelining)"""
+        import asyncio
+
+        async def respond(tid, unit, pdu):
+            delay = self.farm.pdu_delay(unit, pdu)
+            if delay:
+                await asyncio.sleep(delay)
+            response = self.farm.handle_pdu(unit, pdu)
+            if response is not None and not writer.is_closing():
+                writer.write(_MBAP.pack(tid, 0, len(response) + 1, unit) + response)
+
+        pending = set()
+        try:
+            while self.running:
+                tid, _, length, unit = _MBAP.unpack(await reader.readexactly(_MBAP.size))
+                pdu = await reader.readexactly(length - 1)
+                task = asyncio.ensure_future(respond(tid, unit, pdu))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in pending:
+                task.cancel()
+            writer.close()
+
+    async def _serve_rtu_tcp(self, reader, writer):
+        """Conexión RTU sobre TCP: una petición cada vez, como la línea serie detrás de la pasarela"""
+        import asyncio
+        try:
+            while self.running:
+                frame = await reader.readexactly(2)
+                remaining = _rtu_remaining(frame)
+                if remaining is None:
+                    continue
+                while remaining:
+                    frame += await reader.readexactly(remaining)
+                    remaining = _rtu_remaining(frame)
+                if crc16(frame[:-2]) != struct.unpack("<H", frame[-2:])[0]:
+                    continue
+                slave = frame[0]
+                delay = self.farm.pdu_delay(slave, frame[1:-2])
+                if delay:
+                    await asyncio.sleep(delay)
+                response = self.farm.handle_pdu(slave, frame[1:-2])
+                if response is not None:
+                    writer.write(rtu_frame(slave, response))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _read_rtu_request(self, stream):
+        frame = stream.read(2, 0.2)
+        if len(frame) < 2:
+            return None
+        remaining = _rtu_remaining(frame)
+        while remaining:
+            chunk = stream.read(remaining, RTU_FRAME_TIMEOUT)
+            if not chunk:
+                break
+            frame += chunk
+            remaining = _rtu_remaining(frame)
+        if remaining is None or remaining or crc16(frame[:-2]) != struct.unpack("<H", frame[-2:])[0]:
+            # Trama incompleta, función desconocida o CRC erróneo: se descarta como haría un esclavo
+            stream.discard()
+            return None
+        return frame[0], frame[1:-2]
+
+    def _serve_rtu_stream(self, stream):
+        while self.running:
+            try:
+                request = self._read_rtu_request(stream)
+            except OSError as e:
+                log.debug("Canal serie del simulador cerrado: %s", e)
+                return
+            if request is None:
+                continue
+            slave, pdu = request
+            delay = self.farm.pdu_delay(slave, pdu)
+            if delay:
+                time.sleep(delay)
+            response = self.farm.handle_pdu(slave, pdu)
+            if response is not None:
+                stream.write(rtu_frame(slave, response))
+
+    def stop(self):
+        """Detiene todos los canales"""
+        self.running = False
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        for worker in self._threads:
+            worker.join(timeout=1)
+        self._threads = []
+        for stream in self._streams:
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self._streams = []
+        if self._loop_thread is not None:
+            self._loop_thread.stop()
+            self._loop_thread = None
+
+    def stats(self):
+        return dict(self.farm.stats(), endpoints=list(self.endpoints))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Granja de esclavos Modbus simulados")
+    parser.add_argument("--config", metavar="FICHERO", help="JSON con los perfiles de los esclavos")
+    parser.add_argument("--slaves", default="1-247", help='IDs de esclavo: "1-247" o "1, 5, 10-20"')
+    parser.add_argument("--holding", type=int, default=DEFAULT_PROFILE["holding"], help="Holding registers por esclavo")
+    parser.add_argument("--input", type=int, default=DEFAULT_PROFILE["input"], help="Input registers por esclavo")
+    parser.add_argument("--holes", default="", help='Direcciones que responden "dirección ilegal": "100-109, 150"')
+    parser.add_argument("--latency", type=float, default=0.0, help="Tiempo de respuesta (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variación máxima del tiempo de respuesta (s)")
+    parser.add_argument("--drop", type=float, default=0.0, help="Fracción de peticiones sin respuesta (0-1)")
+    parser.add_argument("--line-baudrate", type=int, metavar="BAUDIOS",
+                        help="Simular además el tiempo de transmisión de una línea RTU de esta velocidad")
+    parser.add_argument("--seed", type=int, help="Semilla para repetir las mismas caídas y el mismo jitter")
+    parser.add_argument("--host", default="127.0.0.1", help="Dirección de escucha de los servidores TCP")
+    parser.add_argument("--tcp", type=int, metavar="PUERTO", help="Servir Modbus TCP en este puerto")
+    parser.add_argument("--rtu-tcp", type=int, metavar="PUERTO", help="Servir RTU sobre TCP en este puerto")
+    parser.add_argument("--pty", action="store_true", help="Crear un par serie virtual (Linux/macOS)")
+    parser.add_argument("--serial", metavar="PUERTO", help="Atender un puerto serie (p. ej. un extremo de com0com)")
+    parser.add_argument("--baudrate", type=int, default=9600)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.config:
+        farm = load_farm(args.config)
+    else:
+        farm = build_farm(args.slaves, args.seed, args.line_baudrate, holding=args.holding, input=args.input, holes=args.holes,
+                          latency=args.latency, jitter=args.jitter, drop_rate=args.drop)
+
+    simulator = Simulator(farm, args.host)
+    if args.tcp is not None:
+        simulator.add_tcp(args.tcp)
+    if args.rtu_tcp is not None:
+        simulator.add_tcp(args.rtu_tcp, rtu=True)
+    if args.pty:
+        simulator.add_pty()
+    if args.serial:
+        simulator.add_serial(args.serial, args.baudrate)
+    if not simulator.endpoints:
+        simulator.add_tcp(5020)
+
+    print(f"{len(farm.slaves)} esclavos simulados en:")
+    for endpoint in simulator.endpoints:
+        print(f"  {endpoint}")
+    print("Presiona Ctrl+C para detener el simulador")
+    try:
+        while True:
+            time.sleep(10)
+            stats = farm.stats()
+            print(f"[{time.strftime('%H:%M:%S')}] {stats['requests']} peticiones, "
+                  f"{stats['dropped']} sin respuesta, {stats['exceptions']} excepciones")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,16 +2,18 @@ import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import time
 import threading
-from pymodbus.client import ModbusSerialClient
 import logging
 import json
 import os
 from datetime import datetime
+from connection_pool import get_default_pool
+from async_transport import shutdown_backends, BACKENDS, BACKEND_THREADS
+from discovery import DiscoveryEngine, parse_bus_list
+from autodetect import LineDetector, default_cache
+from virtual_tree import VirtualTreeview
+from metrics_panel import MetricsPanel
 
-# Configurar logging
-logging.basicConfig()
-log = logging.getLogger()
-log.setLevel(logging.INFO)
+log = logging.getLogger(__name__)
 
 class ModbusSlaveFinderApp:
     def __init__(self, root):
@@ -27,6 +29,8 @@ class ModbusSlaveFinderApp:
         self.stopbits_var = tk.IntVar(value=1)
         self.bytesize_var = tk.IntVar(value=8)
         self.timeout_var = tk.DoubleVar(value=0.1)  # Timeout más corto para escaneo rápido
+        self.backend_var = tk.StringVar(value=BACKEND_THREADS)
+        self.two_phase_var = tk.BooleanVar(value=False)
         
         # Variables para la búsqueda
         self.slave_start_var = tk.IntVar(value=1)
@@ -36,8 +40,14 @@ class ModbusSlaveFinderApp:
         
         # Variables para el control de la búsqueda
         self.slave_finding = False
-        self.slave_finder_thread = None
-        self.slave_finder_client = None
+        self.discovery = None
+        self.detector = None
+        self.found_slaves = []
+        self.line_cache = default_cache()
+        self.metrics_window = None
+        
+        # Conexiones persistentes compartidas (se abren una vez por puerto)
+        self.connection_pool = get_default_pool()
         
         # Crear interfaz
         self.create_widgets()
@@ -54,8 +64,9 @@ class ModbusSlaveFinderApp:
         frame1 = ttk.Frame(config_frame)
         frame1.pack(fill=tk.X, pady=5)
         
-        ttk.Label(frame1, text="Puerto:").pack(side=tk.LEFT, padx=5)
-        ttk.Entry(frame1, textvariable=self.port_var, width=10).pack(side=tk.LEFT, padx=5)
+        # Varios puertos/pasarelas separados por comas: "COM3, COM4@19200, tcp://10.0.0.5:502, rtu+tcp://10.0.0.6:4001"
+        ttk.Label(frame1, text="Puertos:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(frame1, textvariable=self.port_var, width=24).pack(side=tk.LEFT, padx=5)
         
         ttk.Label(frame1, text="Baudrate:").pack(side=tk.LEFT, padx=5)
         ttk.Combobox(frame1, textvariable=self.baudrate_var, 
@@ -74,6 +85,10 @@ class ModbusSlaveFinderApp:
         ttk.Combobox(frame1, textvariable=self.bytesize_var, 
                     values=[7, 8], width=5).pack(side=tk.LEFT, padx=5)
         
+        ttk.Label(frame1, text="Transporte:").pack(side=tk.LEFT, padx=5)
+        ttk.Combobox(frame1, textvariable=self.backend_var, 
+                    values=list(BACKENDS), width=8).pack(side=tk.LEFT, padx=5)
+        
         # Panel de configuración de búsqueda
         search_frame = ttk.LabelFrame(self.root, text="Configuración de búsqueda", padding=10)
         search_frame.pack(fill=tk.X, expand=False, pady=5, padx=10)
@@ -98,6 +113,10 @@ class ModbusSlaveFinderApp:
         ttk.Label(frame2, text="Timeout (s):").pack(side=tk.LEFT, padx=5)
         ttk.Entry(frame2, textvariable=self.timeout_var, width=8).pack(side=tk.LEFT, padx=5)
         
+        # Barrido rápido con timeout calculado y confirmación de los candidatos
+        ttk.Checkbutton(frame2, text="Búsqueda en dos fases", 
+                       variable=self.two_phase_var).pack(side=tk.LEFT, padx=5)
+        
         # Botones de control
         button_frame = ttk.Frame(search_frame)
         button_frame.pack(fill=tk.X, pady=5)
@@ -110,6 +129,10 @@ class ModbusSlaveFinderApp:
                                     command=self.stop_slave_finder, state=tk.DISABLED)
         self.stop_button.pack(side=tk.LEFT, padx=5)
         
+        self.autodetect_button = ttk.Button(button_frame, text="Autodetectar línea", 
+                                          command=self.start_autodetect)
+        self.autodetect_button.pack(side=tk.LEFT, padx=5)
+        
         # Barra de progreso
         self.progress_frame = ttk.Frame(search_frame)
         self.progress_frame.pack(fill=tk.X, pady=5)
@@ -126,22 +149,13 @@ class ModbusSlaveFinderApp:
         results_frame.pack(fill=tk.BOTH, expand=True, pady=5, padx=10)
         
         # Tabla para los resultados
-        columns = ("slave_id", "response_time", "register_value", "status")
-        self.results_tree = ttk.Treeview(results_frame, columns=columns, show="headings")
-        self.results_tree.heading("slave_id", text="ID Esclavo")
-        self.results_tree.heading("response_time", text="Tiempo de respuesta (ms)")
-        self.results_tree.heading("register_value", text="Valor del registro")
-        self.results_tree.heading("status", text="Estado")
-        self.results_tree.column("slave_id", width=100, anchor=tk.CENTER)
-        self.results_tree.column("response_time", width=150, anchor=tk.CENTER)
-        self.results_tree.column("register_value", width=150, anchor=tk.CENTER)
-        self.results_tree.column("status", width=150, anchor=tk.CENTER)
-        self.results_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # Scrollbar para la tabla
-        scrollbar = ttk.Scrollbar(results_frame, orient=tk.VERTICAL, command=self.results_tree.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.results_tree.configure(yscrollcommand=scrollbar.set)
+        columns = [("bus", "Bus"), ("slave_id", "ID Esclavo"), ("response_time", "Tiempo de respuesta (ms)"),
+                   ("register_value", "Valor del registro"), ("status", "Estado"), ("confidence", "Confianza")]
+        self.results_tree = VirtualTreeview(results_frame, columns, source=self.found_slaves,
+                                            widths={"bus": 150, "slave_id": 100, "response_time": 150,
+                                                    "register_value": 150, "status": 150, "confidence": 90},
+                                            anchors={column_id: tk.CENTER for column_id, _ in columns})
+        self.results_tree.pack(fill=tk.BOTH, expand=True)
         
         # Botones para exportar datos
         export_frame = ttk.Frame(self.root)
@@ -151,6 +165,8 @@ class ModbusSlaveFinderApp:
                   command=self.export_results).pack(side=tk.LEFT, padx=5)
         ttk.Button(export_frame, text="Limpiar resultados", 
                   command=self.clear_results).pack(side=tk.LEFT, padx=5)
+        ttk.Button(export_frame, text="Métricas", 
+                  command=self.show_metrics).pack(side=tk.RIGHT, padx=5)
         
         # Barra de estado
         self.status_var = tk.StringVar(value="Listo")
@@ -158,30 +174,40 @@ class ModbusSlaveFinderApp:
         status_bar.pack(side=tk.BOTTOM, fill=tk.X)
     
     def start_slave_finder(self):
-        """Inicia la búsqueda de esclavos Modbus"""
+        """Inicia la búsqueda de esclavos Modbus en todos los puertos indicados"""
         if self.slave_finding:
             return
         
         # Limpiar resultados anteriores
         self.clear_results()
         
-        # Configurar cliente con timeout específico para la búsqueda
         try:
-            # Crear cliente con configuración actual
-            self.slave_finder_client = ModbusSerialClient(
-                port=self.port_var.get(),
+            # Un bus por puerto o pasarela: "COM3, COM4@19200, tcp://192.168.1.10:502, rtu+tcp://10.0.0.6:4001"
+            buses = parse_bus_list(
+                self.port_var.get(),
                 baudrate=self.baudrate_var.get(),
                 parity=self.parity_var.get(),
                 stopbits=self.stopbits_var.get(),
                 bytesize=self.bytesize_var.get(),
                 timeout=self.timeout_var.get()
             )
+            start_id = self.slave_start_var.get()
+            end_id = self.slave_end_var.get()
             
-            connection = self.slave_finder_client.connect()
-            if not connection:
-                self.update_status(f"No se pudo conectar al puerto {self.port_var.get()}")
-                messagebox.showerror("Error de conexión", f"No se pudo conectar al puerto {self.port_var.get()}")
-                return
+            # Los buses se sondean en paralelo; cada uno serializa sus propias sondas
+            self.discovery = DiscoveryEngine(
+                buses,
+                range(start_id, end_id + 1),
+                table=self.slave_test_function_var.get(),
+                register=self.slave_test_register_var.get(),
+                backend=self.backend_var.get(),
+                pool=self.connection_pool,
+                two_phase=self.two_phase_var.get(),
+                on_result=lambda result: self.root.after(0, self.add_slave_to_results, result),
+                on_progress=lambda probed, found: self.root.after(0, self.update_progress, probed, found),
+                on_status=lambda message: self.root.after(0, self.update_status, message),
+                on_done=lambda stats: self.root.after(0, self.finish_slave_finder, stats)
+            )
             
             # Configurar variables de control
             self.slave_finding = True
@@ -189,121 +215,133 @@ class ModbusSlaveFinderApp:
             self.stop_button.config(state=tk.NORMAL)
             
             # Configurar barra de progreso
-            start_id = self.slave_start_var.get()
-            end_id = self.slave_end_var.get()
-            total_slaves = end_id - start_id + 1
-            self.progress_bar["maximum"] = total_slaves
+            total = self.discovery.total
+            self.progress_bar["maximum"] = total
             self.progress_bar["value"] = 0
-            self.progress_var.set(f"0 / {total_slaves}")
-            
-            # Iniciar hilo de búsqueda
-            self.slave_finder_thread = threading.Thread(target=self.slave_finder_loop)
-            self.slave_finder_thread.daemon = True
-            self.slave_finder_thread.start()
+            self.progress_var.set(f"0 / {total}")
             
-            self.update_status("Búsqueda de esclavos iniciada")
+            self.discovery.start()
+            if self.discovery.two_phase:
+                sweep = ", ".join(f"{port} {bus['sweep_timeout'] * 1000:.0f} ms"
+                                  for port, bus in self.discovery.bus_stats.items())
+                self.update_status(f"Barrido rápido iniciado en {len(buses)} bus(es) (timeout: {sweep})")
+            else:
+                self.update_status(f"Búsqueda de esclavos iniciada en {len(buses)} bus(es)")
             
         except Exception as e:
+            self.slave_finding = False
+            self.start_button.config(state=tk.NORMAL)
+            self.stop_button.config(state=tk.DISABLED)
             self.update_status(f"Error al iniciar búsqueda: {e}")
             messagebox.showerror("Error", f"Error al iniciar búsqueda: {e}")
     
+    def start_autodetect(self):
+        """Detecta baudrate, paridad y bits de parada del primer puerto de la lista"""
+        if self.slave_finding or self.detector is not None:
+            return
+        
+        try:
+            port = parse_bus_list(self.port_var.get())[0]["port"]
+            # El ID inicial se prueba antes que los IDs habituales de fábrica
+            self.detector = LineDetector(
+                port,
+                slave_ids=[self.slave_start_var.get(), 1, 0, 2, 3, 247],
+                table=self.slave_test_function_var.get(),
+                register=self.slave_test_register_var.get(),
+                backend=self.backend_var.get(),
+                pool=self.connection_pool,
+                cache=self.line_cache,
+                on_progress=lambda attempt, total, line: self.root.after(
+                    0, self.update_status,
+                    f"Autodetección en {port}: {line[0]} {line[3]}{line[1]}{line[2]} ({attempt}/{total})")
+            )
+        except Exception as e:
+            self.update_status(f"Error al iniciar autodetección: {e}")
+            messagebox.showerror("Error", f"Error al iniciar autodetección: {e}")
+            return
+        
+        self.start_button.config(state=tk.DISABLED)
+        self.autodetect_button.config(state=tk.DISABLED)
+        self.update_status(f"Autodetectando parámetros de línea en {port}...")
+        
+        thread = threading.Thread(target=self.autodetect_worker, args=(self.detector,))
+        thread.daemon = True
+        thread.start()
+    
+    def autodetect_worker(self, detector):
+        """Hilo de la autodetección"""
+        try:
+            line = detector.run()
+            self.root.after(0, self.finish_autodetect, detector, line, None)
+        except Exception as e:
+            self.root.after(0, self.finish_autodetect, detector, None, e)
+    
+    def finish_autodetect(self, detector, line, error):
+        """Aplica la línea detectada a la configuración de comunicación"""
+        self.detector = None
+        self.start_button.config(state=tk.NORMAL)
+        self.autodetect_button.config(state=tk.NORMAL)
+        
+        if error is not None:
+            self.update_status(f"Error en la autodetección: {error}")
+            messagebox.showerror("Error", f"Error en la autodetección: {error}")
+            return
+        if line is None:
+            self.update_status(f"Autodetección sin respuesta en {detector.port} "
+                               f"({detector.attempts} combinaciones, {detector.elapsed:.1f} s)")
+            return
+        
+        self.baudrate_var.set(line["baudrate"])
+        self.parity_var.set(line["parity"])
+        self.stopbits_var.set(line["stopbits"])
+        self.bytesize_var.set(line["bytesize"])
+        origin = "configuración guardada" if detector.from_cache else f"{detector.attempts} combinaciones"
+        self.update_status(f"Línea detectada en {detector.port}: {line['baudrate']} "
+                           f"{line['bytesize']}{line['parity']}{line['stopbits']}, esclavo {line['slave']} "
+                           f"({origin}, {detector.elapsed:.1f} s)")
+    
     def stop_slave_finder(self):
         """Detiene la búsqueda de esclavos Modbus"""
         if not self.slave_finding:
             return
         
+        # Los puertos quedan abiertos en el pool para la próxima búsqueda
         self.slave_finding = False
-        if self.slave_finder_client:
-            self.slave_finder_client.close()
+        if self.discovery is not None:
+            self.discovery.stop()
         
         self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
         self.update_status("Búsqueda de esclavos detenida")
     
-    def slave_finder_loop(self):
-        """Bucle para buscar esclavos Modbus"""
-        start_id = self.slave_start_var.get()
-        end_id = self.slave_end_var.get()
-        test_function = self.slave_test_function_var.get()
-        test_register = self.slave_test_register_var.get()
-        progress = 0
-        found_count = 0
-        
-        for slave_id in range(start_id, end_id + 1):
-            if not self.slave_finding:
-                break
-            
-            try:
-                # Medir tiempo de respuesta
-                start_time = time.time()
-                
-                # Leer según el tipo de registro
-                if test_function == "holding":
-                    response = self.slave_finder_client.read_holding_registers(test_register, 1, slave=slave_id)
-                elif test_function == "input":
-                    response = self.slave_finder_client.read_input_registers(test_register, 1, slave=slave_id)
-                elif test_function == "coil":
-                    response = self.slave_finder_client.read_coils(test_register, 1, slave=slave_id)
-                elif test_function == "discrete_input":
-                    response = self.slave_finder_client.read_discrete_inputs(test_register, 1, slave=slave_id)
-                
-                end_time = time.time()
-                response_time = (end_time - start_time) * 1000  # Convertir a ms
-                
-                # Verificar si hay respuesta válida
-                if not hasattr(response, 'isError') or not response.isError():
-                    # Obtener valor del registro
-                    if test_function in ["holding", "input"]:
-                        value = response.registers[0] if response.registers else "N/A"
-                    else:
-                        value = response.bits[0] if response.bits else "N/A"
-                    
-                    # Añadir a la tabla en el hilo principal
-                    self.root.after(0, self.add_slave_to_results, slave_id, response_time, value, "Activo")
-                    found_count += 1
-                else:
-                    # Añadir error a la tabla
-                    self.root.after(0, self.add_slave_to_results, slave_id, response_time, "N/A", f"Error: {response}")
-            
-            except Exception as e:
-                # Ignorar errores (timeouts esperados para IDs no existentes)
-                pass
-            
-            # Actualizar progreso
-            progress += 1
-            self.root.after(0, self.update_progress, progress, found_count)
-            
-            # Pequeña pausa para no saturar el puerto
-            time.sleep(0.01)
-        
-        # Finalizar búsqueda
-        if self.slave_finding:  # Si no fue detenido manualmente
-            self.root.after(0, self.stop_slave_finder)
-            self.root.after(0, self.update_status, f"Búsqueda completada. Encontrados: {found_count} esclavos")
+    def finish_slave_finder(self, stats):
+        """Finaliza la búsqueda cuando terminan todos los buses"""
+        if not self.slave_finding:  # Detenida manualmente
+            return
+        self.stop_slave_finder()
+        slowest = max((bus["elapsed"] for bus in stats["per_bus"].values()), default=0.0)
+        self.update_status(f"Búsqueda completada. Encontrados: {stats['found']} esclavos en "
+                           f"{stats['buses']} bus(es), {stats['elapsed']:.1f} s "
+                           f"(bus más lento {slowest:.1f} s)")
     
-    def add_slave_to_results(self, slave_id, response_time, value, status):
-        """Añade un esclavo encontrado a la tabla de resultados"""
-        self.results_tree.insert("", "end", values=(
-            slave_id,
-            f"{response_time:.1f}",
-            value,
-            status
-        ))
+    def add_slave_to_results(self, result):
+        """Añade un esclavo encontrado al inventario"""
+        self.found_slaves.append(result.row())
+        self.results_tree.refresh()
     
     def update_progress(self, value, found_count):
         """Actualiza la barra de progreso de la búsqueda"""
         self.progress_bar["value"] = value
-        total = self.slave_end_var.get() - self.slave_start_var.get() + 1
+        total = self.discovery.total if self.discovery is not None else 0
         self.progress_var.set(f"{value} / {total} (Encontrados: {found_count})")
     
     def clear_results(self):
         """Limpia los resultados de la búsqueda de esclavos"""
-        for item in self.results_tree.get_children():
-            self.results_tree.delete(item)
+        self.results_tree.clear()
     
     def export_results(self):
         """Exporta los resultados de la búsqueda de esclavos a un archivo CSV"""
-        if not self.results_tree.get_children():
+        if not self.found_slaves:
             messagebox.showinfo("Información", "No hay datos para exportar")
             return
         
@@ -312,11 +350,10 @@ class ModbusSlaveFinderApp:
             filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
             
             with open(filepath, 'w') as f:
-                f.write("ID Esclavo,Tiempo de respuesta (ms),Valor del registro,Estado\n")
+                f.write("Bus,ID Esclavo,Tiempo de respuesta (ms),Valor del registro,Estado,Confianza\n")
                 
-                for item in self.results_tree.get_children():
-                    values = self.results_tree.item(item, 'values')
-                    f.write(f"{values[0]},{values[1]},{values[2]},{values[3]}\n")
+                for values in self.results_tree.rows():
+                    f.write(f"{values[0]},{values[1]},{values[2]},{values[3]},{values[4]},{values[5]}\n")
             
             self.update_status(f"Datos exportados a {filename}")
             messagebox.showinfo("Exportación exitosa", f"Datos exportados a {filename}")
@@ -329,16 +366,34 @@ class ModbusSlaveFinderApp:
         """Actualiza la barra de estado con un nuevo mensaje"""
         self.status_var.set(message)
     
+    def show_metrics(self):
+        """Abre (o trae al frente) la ventana con la latencia y los errores de cada esclavo"""
+        if self.metrics_window is not None and self.metrics_window.winfo_exists():
+            self.metrics_window.lift()
+            return
+        self.metrics_window = tk.Toplevel(self.root)
+        self.metrics_window.title("Métricas del bus")
+        self.metrics_window.geometry("1000x400")
+        MetricsPanel(self.metrics_window, on_status=self.update_status).pack(fill=tk.BOTH, expand=True,
+                                                                             padx=10, pady=10)
+    
     def on_closing(self):
         """Maneja el cierre de la aplicación"""
         # Detener hilos activos
         if self.slave_finding:
             self.stop_slave_finder()
+        if self.detector is not None:
+            self.detector.cancel()
+        
+        # Detener los hilos de bus y el bucle asyncio y cerrar las conexiones persistentes
+        shutdown_backends(self.connection_pool)
         
         # Cerrar la aplicación
         self.root.destroy()
 
 if __name__ == "__main__":
+    # Configurar logging (solo al ejecutar la aplicación, no al importarla)
+    logging.basicConfig(level=logging.INFO)
     root = tk.Tk()
     app = ModbusSlaveFinderApp(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""Bloques adaptativos, huecos recordados y límite de bloque de adaptive_scanner"""
+import pytest
+
+pytest.importorskip("pymodbus")
+
+from adaptive_scanner import AdaptiveScanner, DeviceProfile, ScanAborted, merge_ranges  # noqa: E402
+from loopback import LoopbackResponse, LoopbackExceptionResponse  # noqa: E402
+
+
+class FakeDevice:
+    """Equipo con registros en ``present`` que rechaza bloques de más de ``block_limit``"""
+
+    def __init__(self, present, block_limit=125, silent=False):
+        self.present = set(present)
+        self.block_limit = block_limit
+        self.silent = silent
+        self.requests = []
+
+    def read(self, table, address, count, slave):
+        self.requests.append((address, count))
+        if self.silent:
+            from pymodbus.exceptions import ModbusIOException
+            raise ModbusIOException("sin respuesta")
+        addresses = range(address, address + count)
+        if count > self.block_limit or not all(a in self.present for a in addresses):
+            return LoopbackExceptionResponse(3, 2)
+        return LoopbackResponse(3, registers=list(addresses))
+
+
+def found(blocks):
+    return sorted(a for _, registers in blocks for a in registers)
+
+
+def test_full_map_reads_in_max_blocks():
+    device = FakeDevice(range(250))
+    scanner = AdaptiveScanner(device.read)
+    assert found(scanner.scan("holding", 0, 250, 1)) == list(range(250))
+    assert device.requests == [(0, 125), (125, 125)]
+
+
+def test_hole_is_isolated_and_remembered():
+    present = [a for a in range(64) if not 20 <= a < 24]
+    device = FakeDevice(present)
+    profile = DeviceProfile(best_block=64)
+    scanner = AdaptiveScanner(device.read, profile)
+    assert found(scanner.scan("holding", 0, 64, 1)) == present
+    assert profile.holes == [[20, 24]]
+
+    # El siguiente escaneo salta el hueco sin preguntar por él
+    device.requests.clear()
+    rescanned = found(AdaptiveScanner(device.read, profile).scan("holding", 0, 64, 1))
+    assert rescanned == present
+    assert device.requests == [(0, 20), (24, 40)]
+
+
+def test_size_limit_is_learned_from_illegal_replies():
+    device = FakeDevice(range(100), block_limit=50)
+    profile = DeviceProfile()
+    scanner = AdaptiveScanner(device.read, profile)
+    assert found(scanner.scan("holding", 0, 100, 1)) == list(range(100))
+    assert profile.block_limit == 50
+    assert profile.best_block == 50
+    assert profile.holes == []
+
+
+def test_silent_device_aborts_the_scan():
+    device = FakeDevice([], silent=True)
+    scanner = AdaptiveScanner(device.read, max_consecutive_timeouts=3)
+    with pytest.raises(ScanAborted):
+        list(scanner.scan("holding", 0, 500, 1))
+    assert len(device.requests) == 3
+
+
+def test_profile_hole_bookkeeping():
+    assert merge_ranges([[5, 8], [0, 2], [2, 3], [7, 10]]) == [[0, 3], [5, 10]]
+    profile = DeviceProfile(holes=[[10, 20]])
+    profile.remove_hole(12, 15)
+    assert profile.holes == [[10, 12], [15, 20]]
+    assert profile.valid_ranges(0, 30) == [(0, 10), (12, 15), (20, 30)]
+    assert DeviceProfile.from_dict(profile.to_dict()).holes == profile.holes
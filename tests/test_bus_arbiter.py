@@ -0,0 +1,124 @@
+"""Árbitro del bus: orden de prioridad y reintentos a través de ``BusHandle``"""
+import threading
+
+import pytest
+
+pytest.importorskip("pymodbus")
+
+from bus_arbiter import (BusArbiter, BusHandle, PRIORITY_WRITE, PRIORITY_INTERACTIVE,  # noqa: E402
+                         PRIORITY_POLL, PRIORITY_BACKGROUND)
+from connection_pool import ConnectionPool  # noqa: E402
+from fault_policy import FaultPolicy, get_fault_policy, set_fault_policy  # noqa: E402
+from metrics import MetricsRegistry  # noqa: E402
+from simulator import SlaveFarm, Simulator  # noqa: E402
+from transport import create_modbus_client  # noqa: E402
+
+
+class NullPool:
+    """Pool que no abre nada: los trabajos del test no usan el cliente"""
+
+    def get_client(self, **settings):
+        return None
+
+
+LOOP_SETTINGS = {"port": "loop://arbiter", "baudrate": 115200, "parity": "N",
+                 "stopbits": 1, "bytesize": 8, "timeout": 0.2}
+
+
+def hold_bus(arbiter, gate):
+    """Ocupa el hilo del bus hasta que se abra ``gate``; vuelve cuando el trabajo ya corre"""
+    running = threading.Event()
+    future = arbiter.submit(lambda client: running.set() or gate.wait(5), LOOP_SETTINGS, PRIORITY_BACKGROUND)
+    assert running.wait(5)
+    return future
+
+
+def test_jobs_run_by_priority_then_arrival():
+    arbiter = BusArbiter("loop://arbiter", NullPool())
+    gate = threading.Event()
+    order = []
+    try:
+        blocker = hold_bus(arbiter, gate)
+        futures = [arbiter.submit(lambda client, name=name: order.append(name), LOOP_SETTINGS, priority)
+                   for name, priority in (("poll-1", PRIORITY_POLL), ("background", PRIORITY_BACKGROUND),
+                                          ("interactive", PRIORITY_INTERACTIVE), ("poll-2", PRIORITY_POLL),
+                                          ("write", PRIORITY_WRITE))]
+        assert arbiter.queue_depth() == 5
+        gate.set()
+        blocker.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+        assert order == ["write", "interactive", "poll-1", "poll-2", "background"]
+        assert arbiter.stats()["completed"] == 6
+    finally:
+        arbiter.shutdown()
+
+
+def test_failed_job_reports_its_exception():
+    arbiter = BusArbiter("loop://arbiter", NullPool())
+    try:
+        future = arbiter.submit(lambda client: 1 / 0, LOOP_SETTINGS)
+        with pytest.raises(ZeroDivisionError):
+            future.result(timeout=5)
+        assert arbiter.stats()["failed"] == 1
+    finally:
+        arbiter.shutdown()
+
+
+def test_shutdown_cancels_queued_jobs():
+    arbiter = BusArbiter("loop://arbiter", NullPool())
+    gate = threading.Event()
+    hold_bus(arbiter, gate)
+    queued = arbiter.submit(lambda client: None, LOOP_SETTINGS)
+    threading.Timer(0.1, gate.set).start()
+    arbiter.shutdown()
+    assert queued.cancelled()
+    with pytest.raises(RuntimeError):
+        arbiter.submit(lambda client: None, LOOP_SETTINGS).result(timeout=1)
+
+
+@pytest.fixture
+def policy():
+    previous = get_fault_policy()
+    policy = set_fault_policy(FaultPolicy(retries=2, backoff=0.0, failure_threshold=0,
+                                          registry=MetricsRegistry()))
+    yield policy
+    set_fault_policy(previous)
+
+
+@pytest.fixture
+def silent_slave():
+    """Granja servida por Modbus TCP cuyo esclavo 1 nunca contesta"""
+    farm = SlaveFarm()
+    farm.add_slave(1, drop_rate=1.0)
+    simulator = Simulator(farm)
+    endpoint = simulator.add_tcp()
+    yield farm, endpoint
+    simulator.stop()
+
+
+def test_only_the_fault_policy_retries(policy, silent_slave):
+    farm, endpoint = silent_slave
+    pool = ConnectionPool()
+    arbiter = BusArbiter(endpoint, pool)
+    bus = BusHandle(arbiter, {"port": endpoint, "baudrate": 9600, "parity": "N",
+                              "stopbits": 1, "bytesize": 8, "timeout": 0.2})
+    try:
+        try:
+            bus.read("holding", 0, 1, 1).result(timeout=10)
+        except Exception:
+            pass
+        # 1 intento + 2 reintentos de la política; pymodbus no debe repetir por su cuenta
+        assert farm.dropped == 3
+        assert policy.breaker(bus.settings, 1).retries == 2
+    finally:
+        arbiter.shutdown()
+        pool.close_all()
+
+
+@pytest.mark.parametrize("port", ["COM9", "tcp://127.0.0.1:5020", "rtu+tcp://127.0.0.1:5021"])
+def test_sync_clients_do_not_retry_on_their_own(port):
+    client = create_modbus_client(port, timeout=0.2)
+    params = getattr(client, "params", None)
+    retries = getattr(params, "retries", getattr(client, "retries", None))
+    assert retries == 0
@@ -0,0 +1,66 @@
+"""Bandas muertas y latido de change_detect.ChangeFilter"""
+from change_detect import ChangeFilter
+
+KEY = (1, "holding", 0)
+
+
+def test_first_value_is_always_reported():
+    assert ChangeFilter().check(KEY, 10.0, now=0)
+
+
+def test_without_deadband_any_change_is_reported():
+    changes = ChangeFilter()
+    changes.check(KEY, 10.0, now=0)
+    assert not changes.check(KEY, 10.0, now=1)
+    assert changes.check(KEY, 10.01, now=2)
+
+
+def test_absolute_deadband_compares_with_last_reported_value():
+    changes = ChangeFilter(deadband=0.5)
+    changes.check(KEY, 20.0, now=0)
+    assert not changes.check(KEY, 20.4, now=1)
+    assert not changes.check(KEY, 20.5, now=2)
+    # La deriva lenta se acumula frente al último valor notificado, no el último leído
+    assert changes.check(KEY, 20.6, now=3)
+    assert not changes.check(KEY, 21.0, now=4)
+
+
+def test_percent_deadband():
+    changes = ChangeFilter(deadband_percent=10)
+    changes.check(KEY, 200.0, now=0)
+    assert not changes.check(KEY, 219.0, now=1)
+    assert changes.check(KEY, 221.0, now=2)
+
+
+def test_either_deadband_triggers_a_report():
+    changes = ChangeFilter(deadband=100, deadband_percent=1)
+    changes.check(KEY, 1000.0, now=0)
+    assert changes.check(KEY, 1011.0, now=1)
+
+
+def test_heartbeat_reports_an_unchanged_value():
+    changes = ChangeFilter(deadband=1, heartbeat=60)
+    changes.check(KEY, 5.0, now=0)
+    assert not changes.check(KEY, 5.0, now=59)
+    assert changes.check(KEY, 5.0, now=60)
+    assert not changes.check(KEY, 5.0, now=61)
+    assert changes.stats()["heartbeats"] == 1
+
+
+def test_quality_changes_are_reported_once():
+    changes = ChangeFilter(deadband=1)
+    changes.check(KEY, 5.0, now=0)
+    assert changes.check(KEY, error="timeout", now=1)
+    assert not changes.check(KEY, error="timeout", now=2)
+    assert changes.check(KEY, error="exception 2", now=3)
+    assert changes.check(KEY, 5.0, now=4)
+
+
+def test_stats_count_suppressed_samples():
+    changes = ChangeFilter()
+    for now in range(4):
+        changes.check(KEY, 1.0, now=now)
+    stats = changes.stats()
+    assert stats["received"] == 4
+    assert stats["reported"] == 1
+    assert stats["suppressed_ratio"] == 0.75
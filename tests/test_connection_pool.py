@@ -0,0 +1,100 @@
+"""Reutilización, reconexión y cierre de configuraciones hermanas en connection_pool"""
+import threading
+import time
+
+import pytest
+
+from connection_pool import ConnectionPool
+
+
+class FakeClient:
+    """Cliente físico que anota aperturas y cierres"""
+
+    def __init__(self, key, log, fail_next=None):
+        self.key = key
+        self.log = log
+        self.open = False
+        self.fail_next = fail_next
+
+    def connect(self):
+        time.sleep(0.001)
+        self.open = True
+        self.log.append(("open", self.key))
+        return True
+
+    def is_socket_open(self):
+        return self.open
+
+    def close(self):
+        if self.open:
+            self.log.append(("close", self.key))
+        self.open = False
+
+    def read_holding_registers(self, address, count=1, slave=0):
+        if self.fail_next is not None:
+            error, self.fail_next = self.fail_next, None
+            raise error
+        return [address] * count
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+@pytest.fixture
+def pool(events):
+    clients = []
+
+    def factory(port, baudrate, parity, stopbits, bytesize, timeout):
+        client = FakeClient((port, baudrate), events)
+        clients.append(client)
+        return client
+    pool = ConnectionPool(client_factory=factory)
+    pool.clients = clients
+    yield pool
+    pool.close_all()
+
+
+def test_connection_is_reused(pool):
+    for _ in range(3):
+        client = pool.get_client("COM9", 9600)
+        assert client.read_holding_registers(0, 1, slave=1) == [0]
+    stats = pool.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+    assert len(pool.clients) == 1
+
+
+def test_opening_another_line_setting_closes_the_sibling(pool, events):
+    pool.get_client("COM9", 9600).connect()
+    pool.get_client("COM9", 19200).connect()
+    pool.get_client("COM8", 9600).connect()
+    assert events == [("open", ("COM9", 9600)), ("close", ("COM9", 9600)),
+                      ("open", ("COM9", 19200)), ("open", ("COM8", 9600))]
+    assert pool.stats()["open_connections"] == 2
+
+
+def test_connection_error_reconnects_on_next_use(pool):
+    client = pool.get_client("COM9", 9600)
+    client.connect()
+    pool.clients[0].fail_next = OSError("puerto desconectado")
+    with pytest.raises(OSError):
+        client.read_holding_registers(0, 1, slave=1)
+    assert client.read_holding_registers(5, 1, slave=1) == [5]
+    assert pool.stats()["reconnects"] == 1
+    assert len(pool.clients) == 2
+
+
+def test_concurrent_line_settings_of_one_port_do_not_deadlock(pool):
+    def worker(baudrate):
+        for _ in range(50):
+            pool.get_client("COM9", baudrate).connect()
+    threads = [threading.Thread(target=worker, args=(b,), daemon=True) for b in (9600, 19200, 38400)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not any(thread.is_alive() for thread in threads)
+    # Un puerto serie solo admite una configuración abierta
+    assert pool.stats()["open_connections"] == 1
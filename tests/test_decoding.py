@@ -0,0 +1,86 @@
+"""Tipos de dato y órdenes de palabras/bytes de decoding.RegisterFormat"""
+import struct
+
+import pytest
+
+from decoding import RegisterFormat, BYTE_ORDERS, DATATYPES, parse_order, registers_to_bytes, BIG, LITTLE
+
+
+def wire_registers(data, order):
+    """Registros que enviaría un equipo con el orden ``order`` para los bytes big endian ``data``"""
+    a_to_z = [data[i:i + 2] for i in range(0, len(data), 2)]
+    word_order, byte_order = BYTE_ORDERS[order]
+    if word_order == LITTLE:
+        a_to_z.reverse()
+    if byte_order == LITTLE:
+        a_to_z = [word[::-1] for word in a_to_z]
+    return [int.from_bytes(word, "big") for word in a_to_z]
+
+
+SAMPLES = {
+    "uint16": 0xBEEF,
+    "int16": -12345,
+    "uint32": 0x12345678,
+    "int32": -123456789,
+    "float32": 3.5,
+    "float64": -1234.0625,
+}
+
+
+@pytest.mark.parametrize("order", sorted(BYTE_ORDERS))
+@pytest.mark.parametrize("datatype", sorted(SAMPLES))
+def test_datatype_and_order_matrix(datatype, order):
+    value = SAMPLES[datatype]
+    data = struct.pack(">" + DATATYPES[datatype][0], value)
+    registers = wire_registers(data, order)
+    fmt = RegisterFormat.from_order(datatype, order)
+    assert fmt.decode(registers) == value
+
+
+def test_known_word_orders():
+    # 0x12345678 como lo mandan los equipos con cada notación
+    assert RegisterFormat.from_order("uint32", "ABCD").decode([0x1234, 0x5678]) == 0x12345678
+    assert RegisterFormat.from_order("uint32", "CDAB").decode([0x5678, 0x1234]) == 0x12345678
+    assert RegisterFormat.from_order("uint32", "BADC").decode([0x3412, 0x7856]) == 0x12345678
+    assert RegisterFormat.from_order("uint32", "DCBA").decode([0x7856, 0x3412]) == 0x12345678
+
+
+def test_block_decode_matches_single_values():
+    fmt = RegisterFormat.from_order("float32", "CDAB")
+    values = [1.5, -2.25, 100.0]
+    registers = []
+    for value in values:
+        registers += wire_registers(struct.pack(">f", value), "CDAB")
+    # Un registro sobrante que no completa un valor se descarta
+    assert fmt.decode_array(registers + [7]) == values
+
+
+def test_scale_and_offset():
+    fmt = RegisterFormat("int16", scale=0.5, offset=-10)
+    assert fmt.decode_array([20, 0xFFFE]) == [0.0, -11.0]
+
+
+def test_bit_field():
+    fmt = RegisterFormat("bit", bit=4, bits=3)
+    assert fmt.decode([0b1010000]) == 0b101
+    assert RegisterFormat("bit", bit=0, byte_order=LITTLE).decode([0x0100]) == 1
+
+
+def test_decode_needs_enough_registers():
+    with pytest.raises(ValueError):
+        RegisterFormat("uint32").decode([1])
+
+
+def test_invalid_formats():
+    with pytest.raises(ValueError):
+        RegisterFormat("int64")
+    with pytest.raises(ValueError):
+        RegisterFormat("bit", bit=15, bits=2)
+    with pytest.raises(ValueError):
+        parse_order("ACBD")
+
+
+def test_registers_to_bytes_leaves_input_untouched():
+    registers = [0x1234, 0x5678]
+    assert registers_to_bytes(registers, 2, LITTLE, BIG) == bytes.fromhex("56781234")
+    assert registers == [0x1234, 0x5678]
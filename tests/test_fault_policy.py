@@ -0,0 +1,208 @@
+"""Máquina de estados del circuito por esclavo y reintentos de fault_policy"""
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("pymodbus")
+
+from fault_policy import FaultPolicy, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN  # noqa: E402
+from metrics import MetricsRegistry  # noqa: E402
+
+SETTINGS = {"port": "loop://test", "baudrate": 9600, "parity": "N", "stopbits": 1, "bytesize": 8}
+
+
+class Reply:
+    """Respuesta correcta, de excepción Modbus o sin respuesta válida (como las de pymodbus)"""
+
+    def __init__(self, error=False, exception_code=None):
+        self.error = error
+        self.exception_code = exception_code
+
+    def isError(self):
+        return self.error
+
+
+OK = Reply()
+NO_RESPONSE = Reply(error=True)
+ILLEGAL_ADDRESS = Reply(error=True, exception_code=2)
+
+
+def make_policy(**kwargs):
+    options = dict(retries=0, backoff=0.0, failure_threshold=3, probe_interval=5.0,
+                   probe_interval_max=20.0, registry=MetricsRegistry())
+    options.update(kwargs)
+    return FaultPolicy(**options)
+
+
+def run(policy, reply, slave=1):
+    return policy.execute(SETTINGS, slave, 3, lambda: reply)
+
+
+def allow_probe(policy, slave=1):
+    """Simula que ha pasado el intervalo de prueba"""
+    policy.breaker(SETTINGS, slave).next_probe = 0.0
+
+
+def test_opens_after_threshold_consecutive_failures():
+    policy = make_policy()
+    for _ in range(2):
+        run(policy, NO_RESPONSE)
+    assert policy.breaker(SETTINGS, 1).state == STATE_CLOSED
+    run(policy, NO_RESPONSE)
+    breaker = policy.breaker(SETTINGS, 1)
+    assert breaker.state == STATE_OPEN
+    assert breaker.trips == 1
+
+
+def test_success_resets_the_failure_count():
+    policy = make_policy()
+    run(policy, NO_RESPONSE)
+    run(policy, NO_RESPONSE)
+    run(policy, OK)
+    run(policy, NO_RESPONSE)
+    assert policy.breaker(SETTINGS, 1).state == STATE_CLOSED
+
+
+def test_exception_reply_counts_as_an_answer():
+    policy = make_policy()
+    for _ in range(5):
+        run(policy, ILLEGAL_ADDRESS)
+    assert policy.breaker(SETTINGS, 1).state == STATE_CLOSED
+
+
+def test_open_circuit_rejects_without_calling_the_slave():
+    policy = make_policy()
+    for _ in range(3):
+        run(policy, NO_RESPONSE)
+    calls = []
+    with pytest.raises(Exception):
+        policy.execute(SETTINGS, 1, 3, lambda: calls.append(1))
+    assert calls == []
+    assert policy.breaker(SETTINGS, 1).rejected == 1
+
+
+def test_probe_success_closes_the_circuit():
+    policy = make_policy()
+    for _ in range(3):
+        run(policy, NO_RESPONSE)
+    allow_probe(policy)
+    states = []
+    policy.execute(SETTINGS, 1, 3, lambda: states.append(policy.breaker(SETTINGS, 1).state) or OK)
+    assert states == [STATE_HALF_OPEN]
+    breaker = policy.breaker(SETTINGS, 1)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.failures == 0
+    assert breaker.interval == 5.0
+
+
+def test_failed_probe_reopens_and_doubles_the_interval():
+    policy = make_policy(retries=2)
+    for _ in range(3):
+        run(policy, NO_RESPONSE)
+    breaker = policy.breaker(SETTINGS, 1)
+    for expected in (10.0, 20.0, 20.0):
+        allow_probe(policy)
+        calls = []
+        policy.execute(SETTINGS, 1, 3, lambda: calls.append(1) or NO_RESPONSE)
+        assert calls == [1]  # La prueba no se repite
+        assert breaker.state == STATE_OPEN
+        assert breaker.interval == expected
+    assert breaker.trips == 1
+
+
+def test_retries_are_bounded_and_counted():
+    policy = make_policy(retries=2)
+    calls = []
+    policy.execute(SETTINGS, 1, 3, lambda: calls.append(1) or NO_RESPONSE)
+    assert len(calls) == 3
+    assert policy.breaker(SETTINGS, 1).retries == 2
+    # Una transacción con reintentos cuenta como un solo fallo del circuito
+    assert policy.breaker(SETTINGS, 1).failures == 1
+
+
+def test_circuits_are_per_slave_and_line():
+    policy = make_policy()
+    for _ in range(3):
+        run(policy, NO_RESPONSE, slave=1)
+    assert policy.breaker(SETTINGS, 2).state == STATE_CLOSED
+    other_baud = dict(SETTINGS, baudrate=19200)
+    assert policy.breaker(other_baud, 1).state == STATE_CLOSED
+    assert policy.state_of("loop://test", 1) == STATE_OPEN
+
+
+class InlineBus:
+    """submit(fn, priority) que ejecuta el trabajo al momento y anota cada intento"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.jobs = 0
+
+    def submit(self, fn, priority):
+        self.jobs += 1
+        future = Future()
+        future.set_result(fn(None))
+        return future
+
+    def transaction(self, client):
+        return self.replies.pop(0)
+
+
+def test_submit_reenqueues_each_retry_as_a_separate_job():
+    policy = make_policy(retries=2, backoff=0.01)
+    bus = InlineBus([NO_RESPONSE, NO_RESPONSE, OK])
+    future = policy.submit(bus.submit, SETTINGS, 1, 3, bus.transaction, 2)
+    assert future.result(timeout=2) is OK
+    assert bus.jobs == 3
+    assert policy.breaker(SETTINGS, 1).retries == 2
+
+
+def test_submit_backoff_does_not_run_in_the_bus_job():
+    policy = make_policy(retries=1, backoff=0.2)
+    bus = InlineBus([NO_RESPONSE, OK])
+    future = policy.submit(bus.submit, SETTINGS, 1, 3, bus.transaction, 2)
+    # El primer intento terminó y el reintento espera en un temporizador, no en el bus
+    assert bus.jobs == 1
+    assert not future.done()
+    assert future.result(timeout=2) is OK
+
+
+def test_submit_rejects_open_circuit_without_a_bus_job():
+    policy = make_policy()
+    for _ in range(3):
+        run(policy, NO_RESPONSE)
+    bus = InlineBus([OK])
+    future = policy.submit(bus.submit, SETTINGS, 1, 3, bus.transaction, 2)
+    with pytest.raises(Exception):
+        future.result(timeout=1)
+    assert bus.jobs == 0
+
+
+def test_measurement_is_single_shot_and_creates_no_circuit():
+    policy = make_policy(retries=3)
+    bus = InlineBus([NO_RESPONSE])
+    response, elapsed_ms = policy.submit(bus.submit, SETTINGS, 9, 3, bus.transaction, 2,
+                                         measurement=True).result(timeout=1)
+    assert response is NO_RESPONSE
+    assert elapsed_ms >= 0
+    assert bus.jobs == 1
+    assert policy.stats() == []
+
+
+def test_measurement_probes_an_open_circuit():
+    policy = make_policy()
+    for _ in range(3):
+        run(policy, NO_RESPONSE)
+    bus = InlineBus([OK])
+    policy.submit(bus.submit, SETTINGS, 1, 3, bus.transaction, 2, measurement=True).result(timeout=1)
+    assert policy.breaker(SETTINGS, 1).state == STATE_CLOSED
+
+
+def test_raised_timeout_counts_toward_the_circuit():
+    policy = make_policy()
+
+    def timeout():
+        raise TimeoutError("sin respuesta")
+    for _ in range(3):
+        with pytest.raises(TimeoutError):
+            policy.execute(SETTINGS, 1, 3, timeout)
+    assert policy.breaker(SETTINGS, 1).state == STATE_OPEN
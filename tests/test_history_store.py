@@ -0,0 +1,118 @@
+"""Agrupación de repeticiones, límite de entradas y recuperación de history_store"""
+import json
+
+from history_store import HistoryStore
+
+
+def command(timestamp, register=0, result="OK"):
+    return {"timestamp": timestamp, "operation": "Leer",
+            "parameters": {"register": register}, "result": result}
+
+
+def test_consecutive_repeats_collapse_into_one_entry(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.jsonl"))
+    store.append(command("10:00"))
+    _, merged = store.append(command("10:01"))
+    assert merged
+    store.append(command("10:02", register=1))
+    store.append(command("10:03"))
+    records = list(store.load())
+    store.close()
+    assert len(records) == 3
+    assert records[0]["count"] == 2
+    assert records[0]["first_timestamp"] == "10:00"
+    assert records[0]["timestamp"] == "10:01"
+    assert "count" not in records[2]
+
+
+def test_repeat_is_appended_without_rewriting_earlier_lines(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = HistoryStore(str(path))
+    store.append(command("10:00"))
+    before = path.read_bytes()
+    store.append(command("10:01"))
+    store.append(command("10:02"))
+    after = path.read_bytes()
+    store.close()
+    assert after.startswith(before)
+    assert len(after.splitlines()) == 3
+
+
+def test_repeat_counts_survive_reopen(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    store = HistoryStore(path)
+    for t in ("10:00", "10:01", "10:02"):
+        store.append(command(t))
+    store.close()
+    store = HistoryStore(path)
+    store.append(command("10:03"))
+    records = list(store.load())
+    store.close()
+    assert len(records) == 1
+    assert records[0]["count"] == 4
+    assert records[0]["first_timestamp"] == "10:00"
+    assert len(store) == 1
+
+
+def test_crash_while_appending_a_repeat_keeps_the_previous_count(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = HistoryStore(str(path))
+    store.append(command("10:00"))
+    store.append(command("10:01"))
+    store.close()
+    # Corte de luz a mitad de la línea de la tercera repetición
+    with open(path, "ab") as f:
+        f.write(b'{"timestamp": "10:02", "count": 3, "repl')
+    store = HistoryStore(str(path))
+    records = list(store.load())
+    store.close()
+    assert len(records) == 1
+    assert records[0]["count"] == 2
+
+
+def test_superseded_lines_are_compacted(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = HistoryStore(str(path))
+    for i in range(200):
+        store.append(command(f"t{i}"))
+    records = list(store.load())
+    store.close()
+    assert records[0]["count"] == 200
+    assert len(path.read_bytes().splitlines()) < 100
+
+
+def test_different_result_is_not_collapsed(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.jsonl"))
+    store.append(command("10:00"))
+    _, merged = store.append(command("10:01", result="Timeout"))
+    store.close()
+    assert not merged
+
+
+def test_cap_drops_oldest_entries(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.jsonl"), max_entries=10)
+    for i in range(40):
+        store.append(command(f"t{i}", register=i))
+    records = list(store.load())
+    store.close()
+    assert len(records) <= 10 * 1.25
+    assert records[-1]["parameters"]["register"] == 39
+    assert [r["parameters"]["register"] for r in records] == sorted(r["parameters"]["register"] for r in records)
+
+
+def test_torn_last_line_is_recovered(tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text(json.dumps(command("10:00")) + "\n" + '{"timestamp": "10:0', encoding="utf-8")
+    store = HistoryStore(str(path))
+    store.append(command("10:05", register=5))
+    records = list(store.load())
+    store.close()
+    assert [r["timestamp"] for r in records] == ["10:00", "10:05"]
+
+
+def test_compact_collapses_and_caps(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.jsonl"), max_entries=2)
+    store.compact([command("a"), command("b"), command("c", register=1), command("d", register=2)])
+    records = list(store.load())
+    store.close()
+    assert [r["parameters"]["register"] for r in records] == [1, 2]
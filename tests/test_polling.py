@@ -0,0 +1,86 @@
+"""Agrupación de tags en lecturas (plan_requests) y reparto de las respuestas"""
+from polling import Tag, PollingEngine, plan_requests, parse_register_list, MAX_READ_REGISTERS
+
+
+class Registers:
+    """Respuesta correcta mínima de una lectura de registros"""
+
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self):
+        return False
+
+
+class ExceptionReply:
+    """Respuesta de excepción Modbus (dirección ilegal)"""
+
+    exception_code = 2
+
+    def isError(self):
+        return True
+
+
+def spans(requests):
+    return [(r.slave, r.table, r.start, r.count) for r in requests]
+
+
+def test_nearby_tags_share_one_request():
+    tags = [Tag(1, "holding", a) for a in (0, 1, 5, 12)]
+    assert spans(plan_requests(tags, max_gap=8)) == [(1, "holding", 0, 13)]
+
+
+def test_gap_larger_than_max_gap_splits():
+    tags = [Tag(1, "holding", 0), Tag(1, "holding", 10)]
+    assert spans(plan_requests(tags, max_gap=8)) == [(1, "holding", 0, 1), (1, "holding", 10, 1)]
+    assert spans(plan_requests(tags, max_gap=9)) == [(1, "holding", 0, 11)]
+
+
+def test_gap_counts_from_end_of_multiword_tag():
+    tags = [Tag(1, "holding", 0, "float64"), Tag(1, "holding", 6)]
+    assert spans(plan_requests(tags, max_gap=2)) == [(1, "holding", 0, 7)]
+
+
+def test_slaves_and_tables_never_mix():
+    tags = [Tag(1, "holding", 0), Tag(2, "holding", 1), Tag(1, "input", 2)]
+    assert spans(plan_requests(tags)) == [(1, "holding", 0, 1), (1, "input", 2, 1), (2, "holding", 1, 1)]
+
+
+def test_request_never_exceeds_125_registers():
+    tags = [Tag(1, "holding", a) for a in range(300)]
+    requests = plan_requests(tags, max_gap=8)
+    assert all(r.count <= MAX_READ_REGISTERS for r in requests)
+    assert spans(requests) == [(1, "holding", 0, 125), (1, "holding", 125, 125), (1, "holding", 250, 50)]
+    assert sum(len(r.tags) for r in requests) == 300
+
+
+def test_multiword_tag_is_not_split_at_the_limit():
+    tags = [Tag(1, "holding", a) for a in range(124)] + [Tag(1, "holding", 124, "uint32")]
+    requests = plan_requests(tags)
+    assert spans(requests) == [(1, "holding", 0, 124), (1, "holding", 124, 2)]
+
+
+def test_engine_splits_block_reply_between_tags():
+    tags = [Tag(1, "holding", 10, scale=0.1), Tag(1, "holding", 12, "int32")]
+    engine = PollingEngine(tags)
+    results = {}
+    engine._split(engine.requests[0], Registers([215, 0, 0xFFFF, 0xFFFE]), results)
+    values = [results[id(tag)].value for tag in tags]
+    assert values[0] == 21.5
+    assert values[1] == -2
+
+
+def test_exception_reply_is_not_a_comm_error():
+    tag = Tag(1, "holding", 0)
+    engine = PollingEngine([tag])
+    results = {}
+    engine._split(engine.requests[0], ExceptionReply(), results)
+    assert not results[id(tag)].ok
+    assert not results[id(tag)].comm_error
+
+    engine._fail(engine.requests[0], TimeoutError("sin respuesta"), results)
+    assert results[id(tag)].comm_error
+
+
+def test_parse_register_list():
+    assert parse_register_list("0, 1; 10-12") == [0, 1, 10, 11, 12]
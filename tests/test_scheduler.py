@@ -0,0 +1,154 @@
+"""Planificación EDF de PollScheduler: jitter, vencimientos perdidos y agrupación"""
+from concurrent.futures import Future
+
+import pytest
+
+import scheduler
+from bus_arbiter import PRIORITY_POLL, PRIORITY_BACKGROUND
+from polling import Tag
+from scheduler import PollScheduler, PollGroup, parse_period, parse_rate_list
+
+
+class FakeClock:
+    """Sustituye al módulo ``time`` del planificador con un reloj que avanza a mano"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Registers:
+    def __init__(self, count):
+        self.registers = list(range(count))
+
+    def isError(self):
+        return False
+
+
+class FakeBus:
+    """Acceso al bus que deja las lecturas pendientes hasta ``complete()``"""
+
+    backend = "threads"
+
+    def __init__(self):
+        self.reads = []
+
+    def read(self, table, address, count, slave, priority=PRIORITY_POLL):
+        future = Future()
+        self.reads.append(((slave, table, address, count, priority), future))
+        return future
+
+    def complete(self):
+        pending = [(request, future) for request, future in self.reads if not future.done()]
+        for (_, _, _, count, _), future in pending:
+            future.set_result(Registers(count))
+        return len(pending)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, "time", clock)
+    return clock
+
+
+def make_scheduler(bus, scheduled, results=None):
+    poller = PollScheduler(bus, scheduled, on_results=results.append if results is not None else None)
+    poller.running = True
+    poller.started = scheduler.time.monotonic()
+    for group in poller.groups:
+        group.deadline = poller.started
+    return poller
+
+
+def test_advance_counts_every_skipped_deadline():
+    group = PollGroup(1.0, [])
+    group.deadline = 0.0
+    group.advance(0.5)
+    assert (group.deadline, group.missed) == (1.0, 0)
+    group.advance(3.5)
+    assert (group.deadline, group.missed) == (4.0, 2)
+
+
+def test_advance_on_an_exact_deadline_counts_it_as_missed():
+    group = PollGroup(1.0, [])
+    group.deadline = 0.0
+    group.advance(1.0)
+    assert (group.deadline, group.missed) == (2.0, 1)
+
+
+def test_groups_due_within_the_window_are_read_together(clock):
+    bus = FakeBus()
+    poller = make_scheduler(bus, [(Tag(1, "holding", 0), 1.0), (Tag(1, "holding", 1), 2.0),
+                                  (Tag(1, "holding", 2), 3.0)])
+    fast, medium, slow = poller.groups
+    medium.deadline = clock.now + scheduler.COALESCE_WINDOW / 2
+    slow.deadline = clock.now + scheduler.COALESCE_WINDOW * 2
+    poller._tick()
+    # Una sola lectura de 2 registros cubre los dos grupos que vencían juntos
+    assert [request for request, _ in bus.reads] == [(1, "holding", 0, 2, PRIORITY_POLL)]
+    assert (fast.dispatches, medium.dispatches, slow.dispatches) == (1, 1, 0)
+
+
+def test_tick_returns_time_until_next_deadline(clock):
+    poller = make_scheduler(FakeBus(), [(Tag(1, "holding", 0), 1.0), (Tag(1, "holding", 5), 0.25)])
+    assert poller._tick() == pytest.approx(0.25)
+
+
+def test_in_flight_cycle_skips_the_deadline(clock):
+    bus = FakeBus()
+    results = []
+    poller = make_scheduler(bus, [(Tag(1, "holding", 0), 1.0)], results)
+    group = poller.groups[0]
+    poller._tick()
+    clock.now += 1.0
+    poller._tick()
+    assert (group.dispatches, group.missed, len(bus.reads)) == (1, 1, 1)
+
+    assert bus.complete() == 1
+    assert not group.in_flight
+    assert group.completed == 1
+    assert len(results) == 1
+
+    clock.now += 1.0
+    poller._tick()
+    assert (group.dispatches, group.missed, len(bus.reads)) == (2, 1, 2)
+
+
+def test_late_dispatch_records_jitter_and_missed_deadlines(clock):
+    bus = FakeBus()
+    poller = make_scheduler(bus, [(Tag(1, "holding", 0), 1.0)])
+    group = poller.groups[0]
+    clock.now += 2.05
+    poller._tick()
+    stats = poller.stats()
+    assert stats["jitter_max_ms"] == pytest.approx(2050)
+    # Los vencimientos de +1 s y +2 s pasaron sin despacho
+    assert stats["missed"] == 2
+    assert group.deadline == pytest.approx(poller.started + 3.0)
+
+
+def test_slow_groups_use_background_priority(clock):
+    bus = FakeBus()
+    poller = make_scheduler(bus, [(Tag(1, "holding", 0), 1.0), (Tag(1, "holding", 100), 30.0)])
+    slow = poller.groups[1]
+    assert slow.priority == PRIORITY_BACKGROUND
+    poller.groups[0].deadline = clock.now + 0.5
+    poller._tick()
+    assert [request[4] for request, _ in bus.reads] == [PRIORITY_BACKGROUND]
+
+
+def test_requests_per_second():
+    poller = PollScheduler(FakeBus(), [(Tag(1, "holding", 0), 0.5), (Tag(1, "holding", 1), 0.5),
+                                       (Tag(2, "holding", 0), 2.0)])
+    assert poller.requests_per_second() == pytest.approx(2.5)
+
+
+def test_parse_rates():
+    assert parse_period("200ms") == pytest.approx(0.2)
+    assert parse_period("1.5s") == 1.5
+    assert parse_rate_list("0-1@200ms, 10", 2.0) == [(0, 0.2), (1, 0.2), (10, 2.0)]
+    with pytest.raises(ValueError):
+        parse_period("0")
@@ -0,0 +1,103 @@
+"""Pipelining de Modbus TCP: emparejamiento de respuestas por ID de transacción"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("pymodbus")
+
+from simulator import SlaveFarm, Simulator  # noqa: E402
+from transport import PipelinedTcpClient, parse_tcp_port  # noqa: E402
+
+
+@pytest.fixture
+def farm_endpoint():
+    """Esclavo 1 lento, esclavo 2 rápido y esclavo 3 que nunca contesta"""
+    farm = SlaveFarm()
+    farm.add_slave(1, latency=0.2)
+    farm.add_slave(2)
+    farm.add_slave(3, drop_rate=1.0)
+    simulator = Simulator(farm)
+    endpoint = simulator.add_tcp()
+    yield parse_tcp_port(endpoint)
+    simulator.stop()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_out_of_order_responses_reach_their_own_request(farm_endpoint):
+    host, port = farm_endpoint
+
+    async def scenario():
+        client = PipelinedTcpClient(host, port, timeout=2.0)
+        assert await client.connect()
+        finished = []
+
+        async def read(slave):
+            response = await client.read_holding_registers(1, 1, slave=slave)
+            finished.append(slave)
+            return response.registers
+
+        try:
+            values = await asyncio.gather(read(1), read(2))
+        finally:
+            client.close()
+        return values, finished, client.stats()
+
+    values, finished, stats = run(scenario())
+    # El holding 1 de cada esclavo vale 1000 + ID
+    assert values == [[1001], [1002]]
+    assert finished == [2, 1]
+    assert stats["max_in_flight"] == 2
+
+
+def test_timeout_only_fails_its_own_request(farm_endpoint):
+    host, port = farm_endpoint
+    from pymodbus.exceptions import ModbusIOException
+
+    async def scenario():
+        client = PipelinedTcpClient(host, port, timeout=0.3)
+        assert await client.connect()
+        try:
+            return await asyncio.gather(client.read_holding_registers(1, 1, slave=3),
+                                        client.read_holding_registers(1, 1, slave=2),
+                                        return_exceptions=True)
+        finally:
+            client.close()
+
+    silent, answered = run(scenario())
+    assert isinstance(silent, ModbusIOException)
+    assert answered.registers == [1002]
+
+
+def test_exception_response_is_decoded(farm_endpoint):
+    host, port = farm_endpoint
+
+    async def scenario():
+        client = PipelinedTcpClient(host, port, timeout=1.0)
+        assert await client.connect()
+        try:
+            return await client.read_holding_registers(60000, 1, slave=2)
+        finally:
+            client.close()
+
+    response = run(scenario())
+    assert response.isError()
+    assert response.exception_code == 2
+
+
+def test_closing_fails_pending_requests(farm_endpoint):
+    host, port = farm_endpoint
+    from pymodbus.exceptions import ConnectionException
+
+    async def scenario():
+        client = PipelinedTcpClient(host, port, timeout=2.0)
+        assert await client.connect()
+        pending = asyncio.ensure_future(client.read_holding_registers(1, 1, slave=1))
+        await asyncio.sleep(0.05)
+        client.close()
+        with pytest.raises(ConnectionException):
+            await pending
+
+    run(scenario())
@@ -0,0 +1,143 @@
+"""Tiempos de la línea serie Modbus RTU.
+
+Con los parámetros de la línea se calcula cuánto dura un carácter, el
+silencio mínimo entre tramas (t3.5) y cuánto tarda en viajar una trama
+completa. A partir de ahí se obtiene un timeout ajustado al mínimo
+necesario en lugar de un valor fijo, y ``LinePacer`` espacia las
+peticiones al ritmo máximo que admite la línea en lugar de con pausas
+fijas.
+"""
+import time
+from transport import transport_of, is_network, TRANSPORT_SERIAL
+from loopback import is_loopback
+
+# Por encima de 19200 baudios la especificación fija t3.5 en 1,75 ms
+FIXED_SILENT_INTERVAL_BAUDRATE = 19200
+FIXED_SILENT_INTERVAL = 0.00175
+
+# Tamaños de trama RTU (dirección + PDU + CRC) en bytes
+READ_REQUEST_BYTES = 8          # FC01-04: esclavo, función, dirección, cantidad, CRC
+READ_RESPONSE_OVERHEAD = 5      # Esclavo, función, contador de bytes, CRC
+
+# Margen por defecto para el tiempo de proceso del esclavo y la latencia del adaptador USB
+DEFAULT_TURNAROUND = 0.02
+DEFAULT_ADAPTER_LATENCY = 0.01
+
+# Timeout de barrido para pasarelas TCP y equipos simulados (no dependen del baudrate)
+TCP_SWEEP_TIMEOUT = 0.3
+LOOPBACK_SWEEP_TIMEOUT = 0.05
+
+
+def bits_per_character(parity='N', stopbits=1, bytesize=8):
+    """Bits de un carácter: inicio + datos + paridad + parada"""
+    return 1 + bytesize + (0 if parity == 'N' else 1) + stopbits
+
+
+def character_time(baudrate, parity='N', stopbits=1, bytesize=8):
+    """Duración de un carácter en segundos"""
+    return bits_per_character(parity, stopbits, bytesize) / float(baudrate)
+
+
+def silent_interval(baudrate, parity='N', stopbits=1, bytesize=8):
+    """Silencio mínimo entre tramas (t3.5) en segundos"""
+    if baudrate > FIXED_SILENT_INTERVAL_BAUDRATE:
+        return FIXED_SILENT_INTERVAL
+    return 3.5 * character_time(baudrate, parity, stopbits, bytesize)
+
+
+def frame_time(nbytes, baudrate, parity='N', stopbits=1, bytesize=8):
+    """Tiempo que tarda en transmitirse una trama de ``nbytes`` bytes"""
+    return nbytes * character_time(baudrate, parity, stopbits, bytesize)
+
+
+def read_response_bytes(count, table="holding"):
+    """Bytes de la respuesta a una lectura de ``count`` registros o bits"""
+    if table in ("coil", "discrete_input"):
+        return READ_RESPONSE_OVERHEAD + (count + 7) // 8
+    return READ_RESPONSE_OVERHEAD + 2 * count
+
+
+def is_serial(port):
+    """Indica si el puerto es una línea serie real (no una pasarela TCP ni un equipo simulado)"""
+    return transport_of(port) == TRANSPORT_SERIAL
+
+
+def inter_frame_gap(port, baudrate=9600, parity='N', stopbits=1, bytesize=8):
+    """Silencio que debe quedar entre dos tramas en el bus del puerto.
+
+    Las pasarelas TCP y los equipos simulados delimitan las tramas por sí
+    mismos, así que no necesitan pausa.
+    """
+    if not is_serial(port):
+        return 0.0
+    return silent_interval(baudrate, parity, stopbits, bytesize)
+
+
+def expected_response_time(count, baudrate=9600, parity='N', stopbits=1, bytesize=8, table="holding",
+                           turnaround=DEFAULT_TURNAROUND):
+    """Tiempo esperado de una lectura de ``count`` registros: petición, proceso del esclavo y respuesta"""
+    line = (baudrate, parity, stopbits, bytesize)
+    return (frame_time(READ_REQUEST_BYTES, *line) + turnaround
+            + frame_time(read_response_bytes(count, table), *line))
+
+
+def sweep_timeout(port, baudrate=9600, parity='N', stopbits=1, bytesize=8, table="holding",
+                  turnaround=DEFAULT_TURNAROUND, adapter_latency=DEFAULT_ADAPTER_LATENCY):
+    """Timeout mínimo para saber si un ID de esclavo responde a la lectura de un registro.
+
+    Petición + respuesta de un registro + silencios t3.5 + el tiempo de
+    proceso del esclavo y la latencia del adaptador. Con 9600 baudios son
+    unos 55 ms en lugar de los 100 ms fijos habituales.
+    """
+    if is_loopback(port):
+        return LOOPBACK_SWEEP_TIMEOUT
+    if is_network(port):
+        return TCP_SWEEP_TIMEOUT
+    line = (baudrate, parity, stopbits, bytesize)
+    return (expected_response_time(1, *line, table=table, turnaround=turnaround)
+            + 2 * silent_interval(*line) + adapter_latency)
+
+
+class LinePacer:
+    """Deja el silencio t3.5 entre el final de una transacción y el inicio de la siguiente.
+
+    Lo usa el dueño del puerto (el árbitro de bus o la tarea asyncio) antes
+    de cada trabajo, de modo que las herramientas no necesitan pausas fijas
+    entre peticiones. ``settings`` es el diccionario de configuración del bus.
+    """
+
+    def __init__(self):
+        self._last_end = None
+        self._gaps = {}
+        self.paced = 0         # Trabajos que tuvieron que esperar
+        self.paced_time = 0.0  # Segundos esperados en total
+
+    def gap(self, settings):
+        key = (settings["port"], settings["baudrate"], settings["parity"],
+               settings["stopbits"], settings["bytesize"])
+        gap = self._gaps.get(key)
+        if gap is None:
+            gap = inter_frame_gap(*key)
+            self._gaps[key] = gap
+        return gap
+
+    def delay(self, settings):
+        """Segundos que faltan para poder transmitir con la configuración indicada"""
+        if self._last_end is None:
+            return 0.0
+        remaining = self._last_end + self.gap(settings) - time.perf_counter()
+        if remaining <= 0:
+            return 0.0
+        self.paced += 1
+        self.paced_time += remaining
+        return remaining
+
+    def wait(self, settings):
+        """Espera (bloqueando) hasta poder transmitir"""
+        remaining = self.delay(settings)
+        if remaining:
+            time.sleep(remaining)
+
+    def mark(self):
+        """Anota el final de una transacción"""
+        self._last_end = time.perf_counter()
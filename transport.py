@@ -0,0 +1,319 @@
+"""Transportes Modbus: RTU serie, Modbus TCP y RTU sobre TCP.
+
+El transporte se elige con el nombre del puerto, igual en todas las
+herramientas (GUI, buscador de esclavos, main.py y el pool de conexiones):
+
+    COM3, /dev/ttyUSB0        RTU por línea serie
+    tcp://host[:502]          Modbus TCP (cabecera MBAP con ID de transacción)
+    rtu+tcp://host[:502]      Tramas RTU (con CRC) dentro de una conexión TCP,
+                              como las pasarelas serie-Ethernet en modo transparente
+    loop://nombre             Equipo simulado en memoria
+
+Con el transporte asyncio, Modbus TCP usa ``PipelinedTcpClient``: varias
+peticiones viajan a la vez por la misma conexión y cada respuesta se
+empareja con su petición por el ID de transacción, de modo que el
+rendimiento no queda limitado a una petición por ida y vuelta. RTU sobre
+TCP no lleva ID de transacción y va de una en una.
+"""
+import struct
+import logging
+import itertools
+from loopback import is_loopback, LoopbackClient, AsyncLoopbackClient
+
+log = logging.getLogger(__name__)
+
+TCP_PREFIX = "tcp://"
+RTU_TCP_PREFIX = "rtu+tcp://"
+DEFAULT_TCP_PORT = 502
+
+TRANSPORT_SERIAL = "serial"
+TRANSPORT_TCP = "tcp"
+TRANSPORT_RTU_OVER_TCP = "rtu+tcp"
+TRANSPORT_LOOPBACK = "loop"
+
+# Peticiones en vuelo por conexión Modbus TCP (1 = sin pipelining)
+PIPELINE_DEPTH = 8
+
+# Cabecera MBAP: ID de transacción, protocolo (0), longitud, unidad
+_MBAP = struct.Struct(">HHHB")
+
+_READ_FUNCTIONS = {
+    "holding": 3,
+    "input": 4,
+    "coil": 1,
+    "discrete_input": 2,
+}
+
+
+def transport_of(port):
+    """Devuelve el transporte que corresponde al nombre del puerto"""
+    port = str(port)
+    if is_loopback(port):
+        return TRANSPORT_LOOPBACK
+    if port.startswith(RTU_TCP_PREFIX):
+        return TRANSPORT_RTU_OVER_TCP
+    if port.startswith(TCP_PREFIX):
+        return TRANSPORT_TCP
+    return TRANSPORT_SERIAL
+
+
+def is_network(port):
+    """Indica si el puerto es una conexión TCP (Modbus TCP o RTU sobre TCP)"""
+    return transport_of(port) in (TRANSPORT_TCP, TRANSPORT_RTU_OVER_TCP)
+
+
+def parse_tcp_port(port):
+    """Convierte "tcp://host:puerto" o "rtu+tcp://host:puerto" en (host, puerto); por defecto 502"""
+    port = str(port)
+    prefix = RTU_TCP_PREFIX if port.startswith(RTU_TCP_PREFIX) else TCP_PREFIX
+    host, _, tcp_port = port[len(prefix):].partition(":")
+    return host, int(tcp_port) if tcp_port else DEFAULT_TCP_PORT
+
+
+def create_modbus_client(port, baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1.0):
+    """Crea (sin conectar) el cliente síncrono del transporte que indica el puerto"""
+    transport = transport_of(port)
+    if transport == TRANSPORT_LOOPBACK:
+        return LoopbackClient(port, timeout)
+    # pymodbus tarda decenas de ms en importarse: solo se carga al abrir un puerto real
+    from pymodbus.client import ModbusSerialClient, ModbusTcpClient
+    from pymodbus.framer import Framer
+    # Sin reintentos propios de pymodbus: los decide fault_policy, igual que en los clientes asíncronos
+    if transport == TRANSPORT_TCP:
+        host, tcp_port = parse_tcp_port(port)
+        return ModbusTcpClient(host, port=tcp_port, timeout=timeout, retries=0)
+    if transport == TRANSPORT_RTU_OVER_TCP:
+        host, tcp_port = parse_tcp_port(port)
+        return ModbusTcpClient(host, port=tcp_port, framer=Framer.RTU, timeout=timeout, retries=0)
+    return ModbusSerialClient(
+        port=port,
+        baudrate=baudrate,
+        parity=parity,
+        stopbits=stopbits,
+        bytesize=bytesize,
+        timeout=timeout,
+        retries=0
+    )
+
+
+def create_async_client(port, baudrate=9600, parity='N', stopbits=1, bytesize=8, timeout=1.0):
+    """Crea (sin conectar) el cliente asíncrono del transporte que indica el puerto"""
+    transport = transport_of(port)
+    if transport == TRANSPORT_LOOPBACK:
+        return AsyncLoopbackClient(port, timeout)
+    if transport == TRANSPORT_TCP:
+        host, tcp_port = parse_tcp_port(port)
+        return PipelinedTcpClient(host, tcp_port, timeout)
+    from pymodbus.client import AsyncModbusSerialClient, AsyncModbusTcpClient
+    from pymodbus.framer import Framer
+    # Sin reintentos propios de pymodbus: los decide fault_policy (un esclavo caído costaría 4 timeouts)
+    if transport == TRANSPORT_RTU_OVER_TCP:
+        host, tcp_port = parse_tcp_port(port)
+        return AsyncModbusTcpClient(host, port=tcp_port, framer=Framer.RTU, timeout=timeout, retries=0)
+    return AsyncModbusSerialClient(
+        port=port,
+        baudrate=baudrate,
+        parity=parity,
+        stopbits=stopbits,
+        bytesize=bytesize,
+        timeout=timeout,
+        retries=0
+    )
+
+
+class TcpResponse:
+    """Respuesta correcta con la misma forma que las de pymodbus"""
+
+    def __init__(self, function_code, registers=None, bits=None, address=None, value=None):
+        self.function_code = function_code
+        self.registers = registers or []
+        self.bits = bits or []
+        self.address = address
+        self.value = value
+
+    def isError(self):
+        return False
+
+    def __str__(self):
+        if self.address is not None:
+            return f"TcpResponse(fc={self.function_code}, address={self.address}, value={self.value})"
+        if self.registers:
+            return f"TcpResponse(fc={self.function_code}, registers={self.registers})"
+        return f"TcpResponse(fc={self.function_code}, bits={self.bits})"
+
+
+class TcpExceptionResponse:
+    """Respuesta de excepción Modbus recibida por TCP"""
+
+    def __init__(self, function_code, exception_code):
+        self.function_code = function_code
+        self.exception_code = exception_code
+
+    def isError(self):
+        return True
+
+    def __str__(self):
+        return f"Exception Response({self.function_code}, {self.function_code & 0x7F}, {self.exception_code})"
+
+
+def decode_pdu(pdu, count=None):
+    """Convierte la PDU de una respuesta en ``TcpResponse`` o ``TcpExceptionResponse``"""
+    function_code = pdu[0]
+    if function_code & 0x80:
+        return TcpExceptionResponse(function_code, pdu[1] if len(pdu) > 1 else 0)
+    if function_code in (3, 4):
+        size = pdu[1]
+        return TcpResponse(function_code, registers=list(struct.unpack(f">{size // 2}H", pdu[2:2 + size])))
+    if function_code in (1, 2):
+        size = pdu[1]
+        bits = [bool(byte >> i & 1) for byte in pdu[2:2 + size] for i in range(8)]
+        return TcpResponse(function_code, bits=bits[:count] if count else bits)
+    if function_code in (5, 6):
+        address, value = struct.unpack(">HH", pdu[1:5])
+        if function_code == 5:
+            value = value == 0xFF00
+        return TcpResponse(function_code, address=address, value=value)
+    raise ValueError(f"Función no soportada en la respuesta: {function_code}")
+
+
+class PipelinedTcpClient:
+    """Cliente Modbus TCP asíncrono con varias peticiones en vuelo por conexión.
+
+    Tiene la interfaz de ``AsyncModbusTcpClient`` que usa el transporte
+    asyncio. Cada petición lleva su propio ID de transacción; una tarea lee
+    las respuestas y resuelve el Future de la petición correspondiente, así
+    que las respuestas pueden llegar en cualquier orden. Un timeout afecta
+    solo a su petición; una respuesta tardía se descarta.
+
+    Args:
+        host (str): Dirección de la pasarela o equipo
+        port (int): Puerto TCP
+        timeout (float): Espera máxima de conexión y de cada respuesta
+        depth (int): Peticiones en vuelo que admite la conexión
+    """
+
+    def __init__(self, host, port=DEFAULT_TCP_PORT, timeout=1.0, depth=PIPELINE_DEPTH):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pipeline_depth = max(1, depth)
+        self.connected = False
+        self._reader = None
+        self._writer = None
+        self._task = None
+        self._pending = {}  # ID de transacción -> (Future, número de bits esperados)
+        self._tids = itertools.cycle(range(1, 0x10000))
+
+        self.sent = 0
+        self.late = 0
+        self.max_in_flight = 0
+
+    async def connect(self):
+        import asyncio
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            log.debug("No se pudo conectar a %s:%s: %s", self.host, self.port, e)
+            return False
+        self.connected = True
+        self._task = asyncio.ensure_future(self._receive())
+        return True
+
+    def close(self):
+        self.connected = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending("Conexión cerrada")
+
+    def _fail_pending(self, reason):
+        from pymodbus.exceptions import ConnectionException
+        pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionException(f"{self.host}:{self.port}: {reason}"))
+
+    async def _receive(self):
+        """Tarea lectora: empareja cada respuesta con su petición por el ID de transacción"""
+        import asyncio
+        try:
+            while True:
+                header = await self._reader.readexactly(_MBAP.size)
+                tid, _, length, _ = _MBAP.unpack(header)
+                pdu = await self._reader.readexactly(length - 1)
+                entry = self._pending.pop(tid, None)
+                if entry is None:
+                    self.late += 1
+                    log.debug("Respuesta sin petición pendiente (transacción %s)", tid)
+                    continue
+                future, count = entry
+                if future.done():
+                    continue
+                try:
+                    future.set_result(decode_pdu(pdu, count))
+                except Exception as e:
+                    future.set_exception(e)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.debug("Conexión con %s:%s perdida: %s", self.host, self.port, e)
+            self.connected = False
+            self._fail_pending(f"conexión perdida ({e})")
+
+    def _next_tid(self):
+        for tid in self._tids:
+            if tid not in self._pending:
+                return tid
+
+    async def execute_pdu(self, slave, pdu, count=None):
+        """Envía una PDU y espera su respuesta sin bloquear las demás peticiones"""
+        import asyncio
+        from pymodbus.exceptions import ConnectionException, ModbusIOException
+        if not self.connected or self._writer is None:
+            raise ConnectionException(f"Sin conexión con {self.host}:{self.port}")
+        tid = self._next_tid()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[tid] = (future, count)
+        self.max_in_flight = max(self.max_in_flight, len(self._pending))
+        self._writer.write(_MBAP.pack(tid, 0, len(pdu) + 1, slave) + pdu)
+        self.sent += 1
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(tid, None)
+            raise ModbusIOException(f"Sin respuesta del esclavo {slave} en {self.timeout:g} s "
+                                    f"(transacción {tid})")
+
+    async def _read(self, table, address, count, slave):
+        pdu = struct.pack(">BHH", _READ_FUNCTIONS[table], address, count)
+        return await self.execute_pdu(slave, pdu, count)
+
+    async def read_holding_registers(self, address, count=1, slave=0, **kwargs):
+        return await self._read("holding", address, count, slave)
+
+    async def read_input_registers(self, address, count=1, slave=0, **kwargs):
+        return await self._read("input", address, count, slave)
+
+    async def read_coils(self, address, count=1, slave=0, **kwargs):
+        return await self._read("coil", address, count, slave)
+
+    async def read_discrete_inputs(self, address, count=1, slave=0, **kwargs):
+        return await self._read("discrete_input", address, count, slave)
+
+    async def write_register(self, address, value, slave=0, **kwargs):
+        return await self.execute_pdu(slave, struct.pack(">BHH", 6, address, value & 0xFFFF))
+
+    async def write_coil(self, address, value, slave=0, **kwargs):
+        return await self.execute_pdu(slave, struct.pack(">BHH", 5, address, 0xFF00 if value else 0))
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "in_flight": len(self._pending),
+            "max_in_flight": self.max_in_flight,
+            "late": self.late,
+        }
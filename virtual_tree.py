@@ -0,0 +1,208 @@
+"""Tabla virtual basada en ttk.Treeview.
+
+Solo crea filas de Tk para la ventana visible; los datos viven en una
+secuencia de Python (lista, deque usada como buffer circular, índice del
+historial...). Insertar, recortar o desplazarse cuesta lo mismo con 100 que
+con 100.000 elementos.
+"""
+import tkinter as tk
+from tkinter import ttk
+
+
+class VirtualTreeview(ttk.Frame):
+    """Treeview paginada con barra de desplazamiento propia.
+
+    Args:
+        parent: Widget contenedor
+        columns (list): Pares (id, título) de las columnas
+        source: Secuencia con los datos (len() e índices)
+        formatter: Convierte un elemento de ``source`` en la tupla de valores de la fila
+        newest_first (bool): Muestra el último elemento de ``source`` arriba
+        widths (dict): Ancho por columna
+        anchors (dict): Alineación por columna
+    """
+
+    def __init__(self, parent, columns, source=None, formatter=None, newest_first=False,
+                 widths=None, anchors=None):
+        super().__init__(parent)
+        self.source = source if source is not None else []
+        self.formatter = formatter or tuple
+        self.newest_first = newest_first
+        self.offset = 0
+        self.visible_rows = 20
+        self._selected = None
+        self._render_pending = False
+
+        column_ids = [column_id for column_id, _ in columns]
+        self.tree = ttk.Treeview(self, columns=column_ids, show="headings", selectmode="browse")
+        for column_id, title in columns:
+            self.tree.heading(column_id, text=title)
+            options = {}
+            if widths and column_id in widths:
+                options["width"] = widths[column_id]
+            if anchors and column_id in anchors:
+                options["anchor"] = anchors[column_id]
+            if options:
+                self.tree.column(column_id, **options)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # Altura de fila para calcular cuántas filas caben
+        style = ttk.Style()
+        try:
+            self.row_height = int(style.lookup("Treeview", "rowheight") or 20)
+        except (ValueError, tk.TclError):
+            self.row_height = 20
+
+        self.tree.bind("<Configure>", self._on_configure)
+        self.tree.bind("<MouseWheel>", self._on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<Up>", lambda e: self._move_selection(-1))
+        self.tree.bind("<Down>", lambda e: self._move_selection(1))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-self.visible_rows))
+        self.tree.bind("<Next>", lambda e: self.scroll(self.visible_rows))
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+
+    def __len__(self):
+        return len(self.source)
+
+    def _source_index(self, display_index):
+        if self.newest_first:
+            return len(self.source) - 1 - display_index
+        return display_index
+
+    def item_at(self, display_index):
+        """Elemento de ``source`` mostrado en la posición indicada"""
+        return self.source[self._source_index(display_index)]
+
+    def items(self):
+        """Recorre todos los elementos en el orden en que se muestran"""
+        if self.newest_first:
+            return reversed(self.source)
+        return iter(self.source)
+
+    def rows(self):
+        """Recorre los valores de todas las filas en el orden en que se muestran"""
+        for item in self.items():
+            yield self.formatter(item)
+
+    def set_source(self, source):
+        self.source = source
+        self.offset = 0
+        self._selected = None
+        self.refresh()
+
+    def clear(self):
+        """Vacía la secuencia de datos (si lo permite) y la tabla"""
+        if hasattr(self.source, "clear"):
+            self.source.clear()
+        self.offset = 0
+        self._selected = None
+        self.refresh()
+
+    def refresh(self):
+        """Programa un redibujado; varias llamadas seguidas se agrupan en uno"""
+        if not self._render_pending:
+            self._render_pending = True
+            self.after_idle(self._render)
+
+    def _render(self):
+        """Actualiza solo las filas visibles reutilizando los elementos de Tk"""
+        self._render_pending = False
+        total = len(self.source)
+        max_offset = max(0, total - self.visible_rows)
+        self.offset = max(0, min(self.offset, max_offset))
+        count = min(self.visible_rows, total - self.offset)
+
+        existing = self.tree.get_children()
+        if len(existing) > count:
+            self.tree.delete(*existing[count:])
+            existing = existing[:count]
+
+        selected_iid = None
+        for i in range(count):
+            item = self.item_at(self.offset + i)
+            values = self.formatter(item)
+            if i < len(existing):
+                iid = existing[i]
+                self.tree.item(iid, values=values)
+            else:
+                iid = self.tree.insert("", "end", values=values)
+            if self._selected is not None and item is self._selected:
+                selected_iid = iid
+
+        current = self.tree.selection()
+        if selected_iid is not None:
+            if current != (selected_iid,):
+                self.tree.selection_set(selected_iid)
+        elif current:
+            self.tree.selection_remove(*current)
+
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + count) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _clamp(self):
+        self.offset = max(0, min(self.offset, len(self.source) - self.visible_rows))
+
+    def scroll(self, rows):
+        self.offset += rows
+        self._clamp()
+        self.refresh()
+        return "break"
+
+    def _on_scrollbar(self, *args):
+        total = len(self.source)
+        if args[0] == "moveto":
+            self.offset = int(float(args[1]) * total)
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= self.visible_rows
+            self.offset += step
+        self.refresh()
+
+    def _on_mousewheel(self, event):
+        return self.scroll(-1 if event.delta > 0 else 1) if event.delta else "break"
+
+    def _on_configure(self, event):
+        rows = max(1, event.height // self.row_height - 1)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.refresh()
+
+    def _on_select(self, event):
+        selection = self.tree.selection()
+        if selection:
+            index = self.offset + self.tree.index(selection[0])
+            if index < len(self.source):
+                self._selected = self.item_at(index)
+
+    def _move_selection(self, step):
+        selection = self.tree.selection()
+        if not selection:
+            return None
+        index = self.tree.index(selection[0]) + step
+        if 0 <= index < len(self.tree.get_children()):
+            return None  # Movimiento dentro de la ventana: lo gestiona la Treeview
+        self.offset += step
+        self._clamp()
+        new_index = self.offset + (0 if step < 0 else self.visible_rows - 1)
+        if 0 <= new_index < len(self.source):
+            self._selected = self.item_at(new_index)
+        self.refresh()
+        return "break"
+
+    def selected_item(self):
+        """Elemento de ``source`` seleccionado, o None"""
+        return self._selected
+
+    def selected_values(self):
+        """Valores de la fila seleccionada, o None"""
+        if self._selected is None:
+            return None
+        return self.formatter(self._selected)